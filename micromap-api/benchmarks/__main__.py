@@ -0,0 +1,143 @@
+import argparse
+import json
+import os
+from dataclasses import replace
+from pathlib import Path
+
+from .catalog import SCALES, SyntheticCatalog, generate_catalog
+from .client import Client
+from .comparisons import COMPARISONS, ComparisonContext, run_comparisons, select_comparisons
+from .runner import compare_results, new_results, run_benchmarks, write_results
+from .scenarios import SCENARIOS, Context, select
+
+RESULTS_PATH = Path(__file__).parent / "results"
+
+
+def catalog_of(args: argparse.Namespace) -> SyntheticCatalog:
+    scale = SCALES[args.scale]
+    if args.items is not None:
+        scale = replace(scale, items=args.items)
+    return generate_catalog(scale, args.seed)
+
+
+def load(args: argparse.Namespace):
+    from micromap_api.postgresqldatarepository import PostgresqlDataRepository
+    from .loader import load_catalog, write_stacks
+
+    catalog = catalog_of(args)
+    load_catalog(PostgresqlDataRepository(), catalog, batch_size=args.batch_size,
+                 log=lambda message: print(message, flush=True))
+    if args.stacks:
+        write_stacks(catalog, args.stacks, log=lambda message: print(message, flush=True))
+
+
+def run(args: argparse.Namespace):
+    client = Client(args.url, headers={"Accept-Encoding": args.accept_encoding} if args.accept_encoding else {})
+    results = run_benchmarks(
+        Context(catalog_of(args), client),
+        select(args.scenarios),
+        scale_name=args.scale,
+        requests=args.requests,
+        warmup=args.warmup,
+        concurrency=args.concurrency,
+        duration=args.duration,
+        log=lambda message: print(message, flush=True))
+    print(f"Wrote {write_results(results, args.output)}.", flush=True)
+
+
+def compare(args: argparse.Namespace):
+    regressions = compare_results(json.loads(args.baseline.read_text()), json.loads(args.current.read_text()),
+                                  threshold=args.threshold, noise_ms=args.noise,
+                                  log=lambda message: print(message, flush=True))
+    if regressions:
+        print(f"{len(regressions)} regressions of more than {args.threshold}%.", flush=True)
+        raise SystemExit(1)
+
+
+def variants(args: argparse.Namespace):
+    catalog = catalog_of(args)
+    context = ComparisonContext(catalog, requests=args.requests, warmup=args.warmup, concurrency=args.concurrency,
+                                duration=args.duration, log=lambda message: print(message, flush=True))
+    results = new_results(catalog, args.scale, {"requests": args.requests, "warmup": args.warmup,
+                                                "concurrency": args.concurrency, "duration": args.duration})
+    results["comparisons"] = run_comparisons(context, select_comparisons(args.comparisons))
+    print(f"Wrote {write_results(results, args.output, suffix='-variants')}.", flush=True)
+
+
+def main():
+    """
+    Entry point of `python -m benchmarks` (in micromap-api). The database of the load command is configured by the PG*
+    environment variables, like the API.
+    """
+    parser = argparse.ArgumentParser(prog="python -m benchmarks",
+                                     description="Benchmarks of the MicroMap API on a synthetic pollen catalog.")
+    commands = parser.add_subparsers(required=True, metavar="command")
+
+    def add_catalog_arguments(command_parser: argparse.ArgumentParser):
+        command_parser.add_argument("--scale", choices=SCALES, default="small",
+                                    help="Size of the synthetic catalog (default: small).")
+        command_parser.add_argument("--items", type=int, help="Number of items, instead of that of the scale.")
+        command_parser.add_argument("--seed", type=int, default=0,
+                                    help="Seed of the catalog. Load and run must use the same scale and seed.")
+
+    load_parser = commands.add_parser(
+        "load", help="Generate a synthetic catalog and insert it into the database. Run it again to resume.")
+    add_catalog_arguments(load_parser)
+    load_parser.add_argument("--batch-size", type=int, default=1000, help="Rows per database transaction.")
+    load_parser.add_argument("--stacks", type=Path, default=os.getenv("STACK_PATH"),
+                             help="Directory for the stack files and tile pyramids of the first items of the catalog "
+                                  "(default: STACK_PATH). Not written if unset.")
+    load_parser.set_defaults(func=load)
+
+    run_parser = commands.add_parser("run", help="Measure the latency (and throughput) of the public endpoints.")
+    add_catalog_arguments(run_parser)
+    run_parser.add_argument("--url", default="http://localhost:8000", help="URL of the API (default: %(default)s).")
+    run_parser.add_argument("--scenarios", nargs="+", metavar="NAME",
+                            help="Scenarios (or name prefixes) to run, default all: "
+                                 + ", ".join(scenario.name for scenario in SCENARIOS) + ".")
+    run_parser.add_argument("--requests", type=int, default=200, help="Measured requests per scenario.")
+    run_parser.add_argument("--warmup", type=int, default=20, help="Unmeasured requests per scenario, sent first.")
+    run_parser.add_argument("--concurrency", type=int, default=0,
+                            help="Concurrent connections of the throughput measurement, or 0 to skip it.")
+    run_parser.add_argument("--duration", type=float, default=10.0,
+                            help="Seconds of the throughput measurement per scenario.")
+    run_parser.add_argument("--accept-encoding", default="br, gzip",
+                            help="Accept-Encoding header, or empty for uncompressed responses (default: %(default)s).")
+    run_parser.add_argument("--output", type=Path, default=RESULTS_PATH,
+                            help="Directory of the JSON results (default: benchmarks/results).")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser(
+        "compare", help="Compare two results. Exits with status 1 if a measure regressed more than the threshold.")
+    compare_parser.add_argument("baseline", type=Path, help="Results of the baseline, e.g. of the main branch.")
+    compare_parser.add_argument("current", type=Path, help="Results to compare with the baseline.")
+    compare_parser.add_argument("--threshold", type=float, default=10.0,
+                                help="Percentage by which a measure may get worse (default: %(default)s).")
+    compare_parser.add_argument("--noise", type=float, default=1.0,
+                                help="Milliseconds by which a latency may get worse regardless of the threshold "
+                                     "(default: %(default)s).")
+    compare_parser.set_defaults(func=compare)
+
+    variants_parser = commands.add_parser(
+        "variants", help="Compare the variants of an optimization, like the implementations before and after it, on "
+                         "the loaded catalog.")
+    add_catalog_arguments(variants_parser)
+    variants_parser.add_argument("--comparisons", nargs="+", metavar="NAME",
+                                 help="Comparisons to run, default all: "
+                                      + ", ".join(comparison.name for comparison in COMPARISONS) + ".")
+    variants_parser.add_argument("--requests", type=int, default=200, help="Measured calls per case and variant.")
+    variants_parser.add_argument("--warmup", type=int, default=20, help="Unmeasured calls per case and variant.")
+    variants_parser.add_argument("--concurrency", type=int, default=16,
+                                 help="Concurrent connections of the comparisons under load.")
+    variants_parser.add_argument("--duration", type=float, default=10.0,
+                                 help="Seconds of the measurements under load, per case and variant.")
+    variants_parser.add_argument("--output", type=Path, default=RESULTS_PATH,
+                                 help="Directory of the JSON results (default: benchmarks/results).")
+    variants_parser.set_defaults(func=variants)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
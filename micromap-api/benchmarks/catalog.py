@@ -0,0 +1,242 @@
+import random
+import struct
+import zlib
+from base64 import b64encode
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from itertools import accumulate
+from math import atan2, cos, sin, pi
+from typing import Callable, Dict, Iterator, List, Optional, Set
+from uuid import UUID, NAMESPACE_URL, uuid5
+
+from micromap_api.models import Catalog, Family, Genus, Species, Study, SampleCreateDTO, SlideCreateDTO, ItemCreateDTO
+
+
+@dataclass(frozen=True)
+class Scale:
+    """The size and the distributions of a synthetic catalog."""
+    families: int
+    genera_per_family: float  # Mean, the counts are geometrically distributed.
+    species_per_genus: float  # Mean, the counts are geometrically distributed.
+    items: int
+    studies: int
+    samples_per_study: int
+    slides_per_sample: int
+    type_fraction: float = 0.1  # Fraction of the genera and species that are pollen types (is_type).
+    reference_fraction: float = 0.3  # Fraction of the studies that are reference collections (is_reference).
+    genus_item_fraction: float = 0.15  # Fraction of the items identified to the genus only.
+    family_item_fraction: float = 0.05  # Fraction of the items identified to the family only.
+    abundance_exponent: float = 1.1  # Zipf exponent of the number of items per taxon.
+    thumbnail_size: int = 128
+    thumbnail_variants: int = 64  # Distinct thumbnails, shared by the items.
+    stack_items: int = 10  # Items with a stack file and tile pyramid, see loader.write_stacks.
+    stack_size: int = 512
+    stack_depth: int = 9
+
+
+SCALES: Dict[str, Scale] = {
+    "tiny": Scale(families=5, genera_per_family=3, species_per_genus=3, items=500,
+                  studies=2, samples_per_study=2, slides_per_sample=2, stack_items=3),
+    "small": Scale(families=40, genera_per_family=5, species_per_genus=4, items=20000,
+                   studies=6, samples_per_study=5, slides_per_sample=4),
+    "medium": Scale(families=150, genera_per_family=8, species_per_genus=5, items=250000,
+                    studies=20, samples_per_study=10, slides_per_sample=5, stack_items=25),
+    "large": Scale(families=400, genera_per_family=10, species_per_genus=6, items=2000000,
+                   studies=60, samples_per_study=20, slides_per_sample=8, stack_items=50),
+}
+
+ONSETS = ["b", "c", "d", "f", "g", "l", "m", "n", "p", "r", "s", "t", "v", "br", "cl", "cr", "gl", "ph", "pl", "pr",
+          "st", "th", "tr"]
+VOWELS = ["a", "e", "i", "o", "u", "ae", "ia", "io"]
+CODAS = ["", "", "", "l", "n", "r", "s", "x", "nth", "rb"]
+GENUS_ENDINGS = ["a", "us", "um", "ia", "is", "on", "ella", "opsis", "anthus", "ago"]
+EPITHET_ENDINGS = ["alis", "ata", "ensis", "ifolia", "oides", "ina", "osa", "icus", "ella", "iflora"]
+LOCATIONS = ["Lake sediment core", "Peat bog", "Herbarium", "Coastal marsh", "Alpine lake", "River delta", "Cave"]
+
+
+@dataclass
+class SyntheticCatalog:
+    """
+    A generated catalog: its taxonomy, studies, samples and slides, and a description of its items. The items are
+    generated on the fly (see items), since the large scales do not fit in memory as DTOs.
+    """
+    name: str
+    scale: Scale
+    seed: int
+    catalog: Catalog
+    families: List[Family] = field(default_factory=list)
+    genera: List[Genus] = field(default_factory=list)
+    species: List[Species] = field(default_factory=list)
+    studies: List[Study] = field(default_factory=list)
+    samples: List[SampleCreateDTO] = field(default_factory=list)
+    slides: List[SlideCreateDTO] = field(default_factory=list)
+    thumbnails: List[bytes] = field(default_factory=list)
+
+    def item_id(self, index: int) -> UUID:
+        return _uuid(self.seed, "item", index)
+
+    def items(self, start: int = 0, stop: Optional[int] = None) -> Iterator[ItemCreateDTO]:
+        """
+        Yields the items start to stop (default: all), with their thumbnails. The same seed always yields the same
+        items, so a loader can resume and a benchmark can refer to items by index.
+        """
+        scale = self.scale
+        rng = random.Random(f"{self.seed}:items")
+        studies = {study.id: study for study in self.studies}
+        study_of_sample = {sample.id: studies[sample.study_id] for sample in self.samples}
+        slides = [(slide.id, study_of_sample[slide.sample_id].is_reference) for slide in self.slides]
+        # Reference collections are identified down to the species, and never to pollen types.
+        taxa = self._abundance(rng, [species for species in self.species if not species.is_type] or self.species)
+        type_taxa = self._abundance(rng, self.species)
+        genera = self._abundance(rng, self.genera)
+        families = self._abundance(rng, self.families)
+        thumbnails = [b64encode(thumbnail).decode() for thumbnail in self.thumbnails]
+
+        stop = scale.items if stop is None else min(stop, scale.items)
+        for index in range(stop):
+            slide_id, reference = rng.choice(slides)
+            level = rng.random()
+            taxon = {}
+            if reference or level >= scale.genus_item_fraction + scale.family_item_fraction:
+                taxon["species_id"] = _choose(rng, taxa if reference else type_taxa).id
+            elif level >= scale.family_item_fraction:
+                taxon["genus_id"] = _choose(rng, genera).id
+            else:
+                taxon["family_id"] = _choose(rng, families).id
+            thumbnail = rng.randrange(len(thumbnails))
+            voxel_width = rng.choice((0.1, 0.125, 0.25))
+            if index < start:
+                continue
+            yield ItemCreateDTO(
+                id=self.item_id(index),
+                key_image=thumbnails[thumbnail],
+                slide_id=slide_id,
+                voxel_width=voxel_width,
+                comment=None,
+                **taxon)
+
+    def _abundance(self, rng: random.Random, taxa: List) -> "_Weighted":
+        """Gives the taxa, in random order, Zipf distributed weights: few taxa are common, most are rare."""
+        taxa = list(taxa)
+        rng.shuffle(taxa)
+        weights = [1 / (rank + 1) ** self.scale.abundance_exponent for rank in range(len(taxa))]
+        return _Weighted(taxa, list(accumulate(weights)))
+
+
+@dataclass
+class _Weighted:
+    values: List
+    cumulative_weights: List[float]
+
+
+def _choose(rng: random.Random, weighted: _Weighted):
+    point = rng.random() * weighted.cumulative_weights[-1]
+    return weighted.values[min(bisect_left(weighted.cumulative_weights, point), len(weighted.values) - 1)]
+
+
+def _uuid(seed: int, kind: str, index: int) -> UUID:
+    return uuid5(NAMESPACE_URL, f"micromap:benchmark:{seed}:{kind}:{index}")
+
+
+def _count(rng: random.Random, mean: float) -> int:
+    """Returns a geometrically distributed count of at least 1 with the given mean."""
+    if mean <= 1:
+        return 1
+    count = 1
+    while rng.random() > 1 / mean:
+        count += 1
+    return count
+
+
+def _root(rng: random.Random) -> str:
+    return "".join(rng.choice(ONSETS) + rng.choice(VOWELS) for _ in range(rng.randint(1, 3))) + rng.choice(CODAS)
+
+
+def _unique(used: Set[str], make: Callable[[], str]) -> str:
+    while True:
+        name = make()
+        if name not in used and len(name) <= 100:
+            used.add(name)
+            return name
+
+
+def generate_catalog(scale: Scale, seed: int = 0) -> SyntheticCatalog:
+    """
+    Generates a catalog with Latin-like taxon names. Names are unique in the database, so load a catalog into a
+    database of its own, or give each catalog another seed.
+    """
+    rng = random.Random(seed)
+    used: Set[str] = set()
+    name = f"Synthetic pollen {seed}"
+    result = SyntheticCatalog(name=name, scale=scale, seed=seed,
+                              catalog=Catalog(id=_uuid(seed, "catalog", 0), name=name))
+
+    for family_index in range(scale.families):
+        family = Family(id=_uuid(seed, "family", family_index), catalog_id=result.catalog.id,
+                        name=_unique(used, lambda: f"{_root(rng).capitalize()}aceae"))
+        result.families.append(family)
+        for _ in range(_count(rng, scale.genera_per_family)):
+            is_type = rng.random() < scale.type_fraction
+            genus_name = _unique(used, lambda: _root(rng).capitalize() + rng.choice(GENUS_ENDINGS))
+            genus = Genus(id=_uuid(seed, "genus", len(result.genera)), family_id=family.id, is_type=is_type,
+                          name=f"{genus_name}-type" if is_type else genus_name)
+            result.genera.append(genus)
+            for _ in range(_count(rng, scale.species_per_genus)):
+                is_type = genus.is_type or rng.random() < scale.type_fraction
+                species_name = _unique(used, lambda: f"{genus_name} {_root(rng)}{rng.choice(EPITHET_ENDINGS)}")
+                result.species.append(Species(id=_uuid(seed, "species", len(result.species)), genus_id=genus.id,
+                                              is_type=is_type,
+                                              name=f"{species_name}-type" if is_type else species_name))
+
+    for study_index in range(scale.studies):
+        is_reference = study_index == 0 or rng.random() < scale.reference_fraction
+        study = Study(id=_uuid(seed, "study", study_index), catalog_id=result.catalog.id, is_reference=is_reference,
+                      description=f"{'Reference collection' if is_reference else 'Study'} {study_index + 1}",
+                      location=rng.choice(LOCATIONS), remarks=None)
+        result.studies.append(study)
+        for sample_index in range(scale.samples_per_study):
+            sample = SampleCreateDTO(id=_uuid(seed, "sample", len(result.samples)), study_id=study.id,
+                                     description=f"Sample {sample_index + 1}", location=study.location,
+                                     age=None if is_reference else f"{rng.randrange(100, 15000)} BP", remarks=None)
+            result.samples.append(sample)
+            for slide_index in range(scale.slides_per_sample):
+                result.slides.append(SlideCreateDTO(id=_uuid(seed, "slide", len(result.slides)), sample_id=sample.id,
+                                                    description=f"Slide {slide_index + 1}", remarks=None))
+
+    result.thumbnails = [pollen_png(random.Random(f"{seed}:thumbnail:{variant}"), scale.thumbnail_size)
+                         for variant in range(scale.thumbnail_variants)]
+    return result
+
+
+def pollen_png(rng: random.Random, size: int, focus: float = 0.0) -> bytes:
+    """
+    Draws a grayscale pollen grain: a lobed, textured disc on a noisy background. focus (-1 to 1) is the distance of
+    a focus level to the middle of the grain, which blurs the texture.
+    """
+    lobes = rng.randint(0, 4)
+    phase = rng.random() * 2 * pi
+    radius = size * rng.uniform(0.3, 0.42)
+    texture = rng.uniform(0.15, 0.35) * 128 / size  # Grains of any size have the same pattern.
+    sharpness = 1 - min(abs(focus), 1) * 0.8
+    center = size / 2
+    rows = []
+    for y in range(size):
+        row = bytearray(size + 1)  # Starts with filter type 0 (none).
+        for x in range(size):
+            dx, dy = x - center, y - center
+            distance = (dx * dx + dy * dy) ** 0.5
+            edge = radius * (1 + 0.08 * cos(lobes * atan2(dy, dx) + phase))
+            noise = rng.randint(-6, 6)
+            if distance < edge:
+                value = 150 - 40 * distance / edge + 35 * sharpness * sin(x * texture) * sin(y * texture) + noise
+            else:
+                value = 215 + noise
+            row[x + 1] = max(0, min(255, int(value)))
+        rows.append(bytes(row))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 0, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(b"".join(rows), 6)) + chunk(b"IEND", b""))
+
@@ -0,0 +1,74 @@
+import http.client
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+from urllib.parse import urlencode, urlsplit
+
+
+@dataclass
+class Request:
+    path: str
+    params: Dict[str, str] = field(default_factory=dict)
+    headers: Dict[str, str] = field(default_factory=dict)
+
+    def target(self) -> str:
+        return f"{self.path}?{urlencode(self.params)}" if self.params else self.path
+
+
+@dataclass
+class Response:
+    status: int
+    headers: Dict[str, str]  # With lower case names.
+    body: bytes
+    duration: float  # Seconds from sending the request until the whole body was read.
+
+
+class Client:
+    """
+    HTTP client with a persistent connection per thread, so the benchmarks measure the requests and not the TCP
+    handshakes. Response bodies are read as they are sent, without decompressing them.
+    """
+    def __init__(self, url: str, headers: Optional[Dict[str, str]] = None, timeout: float = 60.0):
+        self.url = url
+        parts = urlsplit(url)
+        self.https = parts.scheme == "https"
+        self.host = parts.hostname
+        self.port = parts.port
+        self.prefix = parts.path.rstrip("/")  # E.g. /api behind the web server.
+        self.headers = headers or {}
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection_class = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            connection = self._local.connection = connection_class(self.host, self.port, timeout=self.timeout)
+        return connection
+
+    def get(self, request: Request) -> Response:
+        """Sends a GET request. Retries once on a new connection if the server closed the persistent one."""
+        for attempt in range(2):
+            connection = self._connection()
+            start = time.perf_counter()
+            try:
+                connection.request("GET", self.prefix + request.target(), headers={**self.headers, **request.headers})
+                response = connection.getresponse()
+                body = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.close()
+                if attempt:
+                    raise
+                continue
+            duration = time.perf_counter() - start
+            if response.will_close:
+                self.close()
+            return Response(response.status, {name.lower(): value for name, value in response.getheaders()}, body,
+                            duration)
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
@@ -0,0 +1,346 @@
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from uuid import uuid4
+
+from sqlalchemy import ColumnElement, Select, delete, select
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import or_
+
+from micromap_api.models import SampleCreateDTO, SlideCreateDTO, Study
+from micromap_api.notifications import bump_data_versions
+from micromap_api.ormmodels import (ORMGenus, ORMItem, ORMItemStatistic, ORMSample, ORMSlide, ORMSpecies,
+                                    ORMStudy)
+from micromap_api.postgresqldatarepository import PostgresqlDataRepository
+
+from .catalog import SyntheticCatalog
+from .client import Client, Request
+from .runner import _summary, check_catalog, measure_latency, measure_throughput
+from .scenarios import SCENARIOS, Context
+
+
+@dataclass
+class ComparisonContext:
+    """The loaded catalog and the settings of a comparison. The database is configured by the PG* variables."""
+    catalog: SyntheticCatalog
+    requests: int = 200
+    warmup: int = 20
+    concurrency: int = 16
+    duration: float = 10.0
+    log: Callable[[str], None] = print
+
+
+# The measures of the variants of each case of a comparison: {case: {variant: summary}}.
+Measures = Dict[str, Dict[str, Dict[str, Any]]]
+
+
+@dataclass
+class Comparison:
+    """
+    Measures the variants of the same work, like the implementations before and after an optimization, on the same
+    database. The first variant is the baseline. measure is the summary value that is compared, in unit.
+    """
+    name: str
+    description: str
+    variants: Tuple[str, ...]
+    run: Callable[[ComparisonContext], Measures]
+    measure: str = "p50_ms"
+    unit: str = "ms"
+    higher_is_better: bool = False
+    secondary: Optional[Tuple[str, str]] = None  # Another summary value and its unit that is shown with the measure.
+
+
+def measure_calls(calls: Sequence[Callable[[], Any]], warmup: int) -> Dict[str, Any]:
+    """Calls the functions one by one, after warmup unmeasured ones, and returns their latencies like the requests."""
+    for call in calls[:warmup]:
+        call()
+    durations = []
+    for call in calls[warmup:]:
+        start = time.perf_counter()
+        call()
+        durations.append(time.perf_counter() - start)
+    return _summary(durations, [], Counter(), 0)
+
+
+@contextmanager
+def serve(environment: Dict[str, str], timeout: float = 60.0) -> Iterator[Client]:
+    """
+    Runs the API in a uvicorn process with one worker, with the PG* and other variables of this process and the given
+    ones, and yields a client of it. The process is stopped afterwards.
+    """
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    process = subprocess.Popen([sys.executable, "-m", "uvicorn", "micromap_api.main:app", "--host", "127.0.0.1",
+                                "--port", str(port), "--log-level", "warning", "--no-access-log"],
+                               env={**os.environ, **environment})
+    client = Client(f"http://127.0.0.1:{port}")
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"The API exited with status {process.returncode}.")
+            try:
+                if client.get(Request("/")).status == 200:
+                    break
+            except OSError:
+                client.close()
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"The API did not start within {timeout} seconds.")
+            time.sleep(0.2)
+        yield client
+    finally:
+        client.close()
+        process.terminate()
+        process.wait(timeout)
+
+
+def _speedup(comparison: Comparison, baseline: Optional[float], value: Optional[float]) -> str:
+    if not baseline or not value:
+        return ""
+    ratio = value / baseline if comparison.higher_is_better else baseline / value
+    if comparison.unit == "bytes":
+        return f"  {ratio:6.2f}x {'smaller' if ratio >= 1 else 'larger'}"
+    return f"  {ratio:6.2f}x {'faster' if ratio >= 1 else 'slower'}"
+
+
+def run_comparisons(context: ComparisonContext, comparisons: Sequence[Comparison]) -> Dict[str, Any]:
+    """Runs the comparisons, logs the measure of every variant and its speedup over the baseline, and returns all."""
+    results = {}
+    for comparison in comparisons:
+        context.log(f"{comparison.name}: {comparison.description}")
+        measures = comparison.run(context)
+        for case, variants in measures.items():
+            baseline = variants.get(comparison.variants[0], {}).get(comparison.measure)
+            for variant in comparison.variants:
+                value = variants.get(variant, {}).get(comparison.measure)
+                shown = "no measurements" if value is None else f"{value:10.2f} {comparison.unit}"
+                speedup = "" if variant == comparison.variants[0] else _speedup(comparison, baseline, value)
+                if comparison.secondary is not None:
+                    secondary, unit = comparison.secondary
+                    secondary_value = variants.get(variant, {}).get(secondary)
+                    if secondary_value is not None:
+                        speedup += f"  ({secondary_value:.2f} {unit})"
+                context.log(f"  {case:<20} {variant:<12} {shown}{speedup}")
+        results[comparison.name] = {"description": comparison.description, "variants": list(comparison.variants),
+                                    "measure": comparison.measure, "cases": measures}
+    return results
+
+
+def select_comparisons(names: Optional[List[str]]) -> List[Comparison]:
+    """Returns the comparisons with the given names, or all if None."""
+    if not names:
+        return COMPARISONS
+    unknown = set(names) - {comparison.name for comparison in COMPARISONS}
+    if unknown:
+        raise ValueError(f"Unknown comparisons: {', '.join(sorted(unknown))}.")
+    return [comparison for comparison in COMPARISONS if comparison.name in names]
+
+
+# Database bound scenarios, whose requests wait for the database most of the time.
+ASYNC_DB_SCENARIOS = ("families", "search_typo", "items_family", "items_genus_name", "thumbnail")
+
+
+def _async_db(context: ComparisonContext) -> Measures:
+    """The requests per second of one worker with the synchronous and with the async repository."""
+    measures: Measures = {}
+    for variant, async_db in (("sync", "0"), ("async", "1")):
+        with serve({"ASYNC_DB": async_db}) as client:
+            check_catalog(client, context.catalog)
+            scenario_context = Context(context.catalog, client)
+            for scenario in [scenario for scenario in SCENARIOS if scenario.name in ASYNC_DB_SCENARIOS]:
+                rng = random.Random(f"{context.catalog.seed}:{scenario.name}")
+                requests = [scenario.make(scenario_context, rng) for _ in range(context.warmup + context.requests)]
+                for request in requests[:context.warmup]:
+                    client.get(request)
+                measures.setdefault(scenario.name, {})[variant] = measure_throughput(
+                    client, scenario, requests[context.warmup:], context.concurrency, context.duration)
+    return measures
+
+
+def _joined_taxon_filter(level: str, taxon_id) -> ColumnElement:
+    """The items of a taxon by their own taxon and the subqueries of its descendants, as before the resolved columns."""
+    if level == "species":
+        return ORMItem.species_id == taxon_id
+    if level == "genus":
+        species = select(ORMSpecies.id).where(ORMSpecies.genus_id == taxon_id)
+        return or_(ORMItem.genus_id == taxon_id, ORMItem.species_id.in_(species))
+    genera = select(ORMGenus.id).where(ORMGenus.family_id == taxon_id)
+    species = select(ORMSpecies.id).where(ORMSpecies.genus_id.in_(genera))
+    return or_(ORMItem.family_id == taxon_id, ORMItem.genus_id.in_(genera), ORMItem.species_id.in_(species))
+
+
+def _resolved_taxon_filter(level: str, taxon_id) -> ColumnElement:
+    """The items of a taxon by the resolved column of its level, like get_items."""
+    return getattr(ORMItem, f"resolved_{level}_id") == taxon_id
+
+
+def _taxon_filters(context: ComparisonContext) -> Measures:
+    """The latency of the first page of the items of a taxon, by id, with either filter."""
+    repository = PostgresqlDataRepository()
+    catalog = context.catalog
+
+    def page(query: Select):
+        with Session(repository.engine) as session:
+            session.scalars(query).all()
+
+    measures: Measures = {}
+    for level, taxa in (("family", catalog.families), ("genus", catalog.genera), ("species", catalog.species)):
+        rng = random.Random(f"{catalog.seed}:taxon_filters:{level}")
+        taxon_ids = [rng.choice(taxa).id for _ in range(context.warmup + context.requests)]
+        for variant, taxon_filter in (("join", _joined_taxon_filter), ("resolved", _resolved_taxon_filter)):
+            calls = [partial(page, select(ORMItem.id).where(taxon_filter(level, taxon_id)).order_by(ORMItem.id)
+                             .limit(100))
+                     for taxon_id in taxon_ids]
+            measures.setdefault(level, {})[variant] = measure_calls(calls, context.warmup)
+    repository.engine.dispose()
+    return measures
+
+
+# The list routes whose responses are serialized by json_list (items, studies) and cached_json_list (taxonomy).
+SERIALIZATION_SCENARIOS = ("families", "species_catalog", "studies", "items_family", "items_study")
+
+
+def _serialization(context: ComparisonContext) -> Measures:
+    """
+    The latency of the list routes of one idle worker, with the rows serialized like FastAPI (JSONABLE_ENCODER=1) and
+    by TypeAdapters with the cached JSON fragments of the taxonomy. The responses are not compressed.
+    """
+    measures: Measures = {}
+    for variant, jsonable in (("jsonable", "1"), ("adapter", "0")):
+        with serve({"JSONABLE_ENCODER": jsonable}) as client:
+            check_catalog(client, context.catalog)
+            scenario_context = Context(context.catalog, client)
+            for scenario in [scenario for scenario in SCENARIOS if scenario.name in SERIALIZATION_SCENARIOS]:
+                rng = random.Random(f"{context.catalog.seed}:{scenario.name}")
+                requests = [scenario.make(scenario_context, rng) for _ in range(context.warmup + context.requests)]
+                measures.setdefault(scenario.name, {})[variant] = measure_latency(client, scenario, requests,
+                                                                                  context.warmup)
+    return measures
+
+
+# The taxonomy and item list routes, whose JSON responses are compressed.
+COMPRESSION_SCENARIOS = ("families", "genera", "species_catalog", "items_family", "items_study")
+
+
+def _compression(context: ComparisonContext) -> Measures:
+    """
+    The size and latency of the responses of the list routes of one idle worker, requested uncompressed (identity),
+    with gzip and with brotli (br). The same requests are sent with each Accept-Encoding.
+    """
+    measures: Measures = {}
+    with serve({}) as client:
+        check_catalog(client, context.catalog)
+        scenario_context = Context(context.catalog, client)
+        for scenario in [scenario for scenario in SCENARIOS if scenario.name in COMPRESSION_SCENARIOS]:
+            rng = random.Random(f"{context.catalog.seed}:{scenario.name}")
+            requests = [scenario.make(scenario_context, rng) for _ in range(context.warmup + context.requests)]
+            for encoding in ("identity", "gzip", "br"):
+                encoded = [Request(request.path, request.params, {**request.headers, "Accept-Encoding": encoding})
+                           for request in requests]
+                measures.setdefault(scenario.name, {})[encoding] = measure_latency(client, scenario, encoded,
+                                                                                   context.warmup)
+    return measures
+
+
+# The batch sizes of the bulk inserts, the cases of the bulk_insert comparison.
+BULK_INSERT_BATCHES = (100, 1000)
+
+
+@contextmanager
+def scratch_slide(repository: PostgresqlDataRepository, catalog: SyntheticCatalog) -> Iterator[SlideCreateDTO]:
+    """
+    Adds a study, sample and slide to the catalog to insert items into, and deletes them with their items and item
+    statistics afterwards.
+    """
+    study = Study(id=uuid4(), catalog_id=catalog.catalog.id, is_reference=False, description="Benchmark scratch study",
+                  location=None, remarks=None)
+    sample = SampleCreateDTO(id=uuid4(), study_id=study.id, description="Scratch", location=None, age=None,
+                             remarks=None)
+    slide = SlideCreateDTO(id=uuid4(), sample_id=sample.id, description="Scratch", remarks=None)
+    repository.add_study(study)
+    repository.bulk_add_samples([sample])
+    repository.bulk_add_slides([slide])
+    try:
+        yield slide
+    finally:
+        with Session(repository.engine) as session:
+            session.execute(delete(ORMItem).where(ORMItem.slide_id == slide.id))
+            session.execute(delete(ORMItemStatistic).where(ORMItemStatistic.study_id == study.id))
+            session.execute(delete(ORMSlide).where(ORMSlide.id == slide.id))
+            session.execute(delete(ORMSample).where(ORMSample.id == sample.id))
+            session.execute(delete(ORMStudy).where(ORMStudy.id == study.id))
+            bump_data_versions(session, [catalog.catalog.id])
+            session.commit()
+
+
+def _insert_rate(insert: Callable[[], Any], rows: int) -> Dict[str, Any]:
+    start = time.perf_counter()
+    insert()
+    seconds = time.perf_counter() - start
+    return {"rows": rows, "seconds": round(seconds, 3), "rows_per_second": round(rows / seconds, 1)}
+
+
+def _bulk_insert(context: ComparisonContext) -> Measures:
+    """
+    The rows per second of inserting items one by one (add_item, a transaction each) and in batches (bulk_add_items, a
+    transaction per batch), each committed like the POST routes.
+    """
+    repository = PostgresqlDataRepository()
+    measures: Measures = {}
+    with scratch_slide(repository, context.catalog) as slide:
+        for batch in BULK_INSERT_BATCHES:
+            count = max(batch, context.requests)
+            warmup = list(context.catalog.items(0, context.warmup))
+            template = list(context.catalog.items(0, count))
+
+            def new_items(templates):
+                return [item.model_copy(update={"id": uuid4(), "slide_id": slide.id}) for item in templates]
+
+            def single(items):
+                for item in items:
+                    repository.add_item(item)
+
+            def bulk(items):
+                for start in range(0, len(items), batch):
+                    repository.bulk_add_items(items[start:start + batch])
+
+            for variant, insert in (("single", single), ("bulk", bulk)):
+                insert(new_items(warmup))
+                measures.setdefault(f"batch_{batch}", {})[variant] = _insert_rate(
+                    partial(insert, new_items(template)), count)
+    repository.engine.dispose()
+    return measures
+
+
+COMPARISONS: List[Comparison] = [
+    Comparison("async_db",
+               "Requests per second of one worker under concurrent load, with the synchronous repository in the "
+               "thread pool (ASYNC_DB=0) and with the asyncpg repository (ASYNC_DB=1).",
+               ("sync", "async"), _async_db, measure="requests_per_second", unit="req/s", higher_is_better=True),
+    Comparison("taxon_filters",
+               "Latency of the first page of the items of a family, genus or species, filtered by the item's own "
+               "taxon and subqueries of the descendants (join), and by the resolved ancestry columns (resolved).",
+               ("join", "resolved"), _taxon_filters),
+    Comparison("bulk_insert",
+               "Rows per second of inserting items one by one (add_item) and in batches of 100 and 1000 rows "
+               "(bulk_add_items), with a transaction per call.",
+               ("single", "bulk"), _bulk_insert, measure="rows_per_second", unit="rows/s", higher_is_better=True),
+    Comparison("serialization",
+               "Latency of the list routes with the rows serialized like FastAPI, by the response model, "
+               "jsonable_encoder and json.dumps (jsonable), and by TypeAdapters with cached taxonomy JSON (adapter).",
+               ("jsonable", "adapter"), _serialization),
+    Comparison("compression",
+               "Bytes on the wire of the taxonomy and item list routes, uncompressed (identity), with gzip and with "
+               "brotli (br), and their median latency, which includes the compression time.",
+               ("identity", "gzip", "br"), _compression, measure="mean_bytes", unit="bytes",
+               secondary=("p50_ms", "ms")),
+]
@@ -0,0 +1,87 @@
+import random
+from io import BytesIO
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Iterable, Sequence
+
+from micromap_api.exceptions import KeyViolationException
+from micromap_api.postgresqldatarepository import PostgresqlDataRepository
+from micromap_api.pyramid import pyramid_path, write_pyramid
+from micromap_api.stackfile import stack_path, write_stack
+
+from .catalog import SyntheticCatalog, pollen_png
+
+
+def _batches(values: Iterable, size: int) -> Iterable[Sequence]:
+    values = iter(values)
+    while batch := list(islice(values, size)):
+        yield batch
+
+
+def load_catalog(repository: PostgresqlDataRepository,
+                 catalog: SyntheticCatalog,
+                 batch_size: int = 1000,
+                 log: Callable[[str], None] = print):
+    """
+    Inserts a synthetic catalog through the bulk methods of the repository, like the importer. Rows that exist are
+    skipped, so an interrupted load can be resumed by loading the same scale and seed again.
+    """
+    for migration in repository.create_database():
+        log(f"Applied migration {migration.version}: {migration.description}")
+
+    try:
+        repository.add_catalog(catalog.catalog)
+    except KeyViolationException:
+        log(f"Catalog {catalog.name} exists, adding the missing rows.")
+    for add, rows, kind in ((repository.bulk_add_families, catalog.families, "families"),
+                            (repository.bulk_add_genera, catalog.genera, "genera"),
+                            (repository.bulk_add_species, catalog.species, "species")):
+        inserted = sum(len(add(batch, skip_existing=True).ids) for batch in _batches(rows, batch_size))
+        log(f"Inserted {inserted} of {len(rows)} {kind}.")
+
+    existing = {study.id for study in repository.get_studies(str(catalog.catalog.id))}
+    for study in catalog.studies:
+        if study.id not in existing:
+            repository.add_study(study)
+    log(f"Inserted {len(set(study.id for study in catalog.studies) - existing)} of {len(catalog.studies)} studies.")
+    for add, rows, kind in ((repository.bulk_add_samples, catalog.samples, "samples"),
+                            (repository.bulk_add_slides, catalog.slides, "slides")):
+        inserted = sum(len(add(batch, skip_existing=True).ids) for batch in _batches(rows, batch_size))
+        log(f"Inserted {inserted} of {len(rows)} {kind}.")
+
+    inserted = 0
+    for number, batch in enumerate(_batches(catalog.items(), batch_size), start=1):
+        inserted += len(repository.bulk_add_items(batch, skip_existing=True).ids)
+        if number % 20 == 0:
+            log(f"Inserted {inserted} items, {min(number * batch_size, catalog.scale.items)} of {catalog.scale.items} "
+                f"processed.")
+    log(f"Inserted {inserted} of {catalog.scale.items} items.")
+
+
+def write_stacks(catalog: SyntheticCatalog, stacks: Path, log: Callable[[str], None] = print):
+    """
+    Writes a stack file for the first stack_items items of the catalog, and a tile pyramid if Pillow (the optional
+    'import' dependencies) is installed.
+    """
+    scale = catalog.scale
+    rng = random.Random(f"{catalog.seed}:stack")
+    state = rng.getstate()
+    slices = []
+    for z in range(scale.stack_depth):
+        rng.setstate(state)  # The same grain on every focus level, only the sharpness differs.
+        slices.append(pollen_png(rng, scale.stack_size, focus=2 * z / max(scale.stack_depth - 1, 1) - 1))
+
+    try:
+        from PIL import Image
+        layers = [Image.open(BytesIO(image)) for image in slices]
+    except ImportError:
+        log("Pillow is not installed, so no tile pyramids are written.")
+        layers = None
+
+    stacks.mkdir(parents=True, exist_ok=True)
+    for index in range(min(scale.stack_items, scale.items)):
+        item_id = catalog.item_id(index)
+        write_stack(stack_path(stacks, item_id), slices, scale.stack_size, scale.stack_size)
+        if layers is not None:
+            write_pyramid(pyramid_path(stacks, item_id), layers)
+    log(f"Wrote the stack files of {min(scale.stack_items, scale.items)} items to {stacks}.")
@@ -0,0 +1,215 @@
+import json
+import os
+import platform
+import random
+import subprocess
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from datetime import datetime, timezone
+from pathlib import Path
+from statistics import mean, quantiles
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .catalog import SyntheticCatalog
+from .client import Client, Request
+from .scenarios import Context, Scenario, SkipScenario
+
+RESULTS_FORMAT = 1
+
+
+def _summary(durations: Sequence[float], sizes: Sequence[int], statuses: Counter, errors: int) -> Dict[str, Any]:
+    """Returns the latency percentiles (in milliseconds) and the response sizes (if any) of the measured requests."""
+    milliseconds = sorted(duration * 1000 for duration in durations)
+    summary: Dict[str, Any] = {"requests": len(milliseconds), "errors": errors,
+                               "statuses": {str(status): count for status, count in sorted(statuses.items())}}
+    if len(milliseconds) >= 2:
+        percentiles = quantiles(milliseconds, n=100, method="inclusive")
+        summary.update(mean_ms=mean(milliseconds), min_ms=milliseconds[0], p50_ms=percentiles[49],
+                       p90_ms=percentiles[89], p95_ms=percentiles[94], p99_ms=percentiles[98],
+                       max_ms=milliseconds[-1])
+        if sizes:
+            summary["mean_bytes"] = mean(sizes)
+    return summary
+
+
+def measure_latency(client: Client, scenario: Scenario, requests: Sequence[Request], warmup: int) -> Dict[str, Any]:
+    """Sends the requests one by one, after warmup unmeasured ones, so each latency is that of an idle server."""
+    for request in requests[:warmup]:
+        client.get(request)
+    durations, sizes, statuses, errors = [], [], Counter(), 0
+    for request in requests[warmup:]:
+        response = client.get(request)
+        statuses[response.status] += 1
+        if response.status not in scenario.expected:
+            errors += 1
+        durations.append(response.duration)
+        sizes.append(len(response.body))
+    return _summary(durations, sizes, statuses, errors)
+
+
+def measure_throughput(client: Client,
+                       scenario: Scenario,
+                       requests: Sequence[Request],
+                       concurrency: int,
+                       duration: float) -> Dict[str, Any]:
+    """
+    Sends the requests (repeatedly) from concurrency threads for duration seconds, and returns the number of
+    requests per second, and the latencies under this load.
+    """
+    lock = threading.Lock()
+    durations, sizes, statuses, errors = [], [], Counter(), 0
+    stop_at = time.perf_counter() + duration
+
+    def send(worker: int):
+        nonlocal errors
+        index = worker * len(requests) // concurrency  # Every thread starts elsewhere in the requests.
+        while time.perf_counter() < stop_at:
+            response = client.get(requests[index % len(requests)])
+            index += 1
+            with lock:
+                statuses[response.status] += 1
+                if response.status not in scenario.expected:
+                    errors += 1
+                durations.append(response.duration)
+                sizes.append(len(response.body))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        for result in [executor.submit(send, worker) for worker in range(concurrency)]:
+            result.result()
+    elapsed = time.perf_counter() - start
+    summary = _summary(durations, sizes, statuses, errors)
+    summary.update(concurrency=concurrency, seconds=elapsed, requests_per_second=len(durations) / elapsed)
+    return summary
+
+
+def _commit() -> Dict[str, Any]:
+    """Returns the git commit of the working tree, and whether it has uncommitted changes."""
+    def git(*args: str) -> Optional[str]:
+        try:
+            return subprocess.run(["git", *args], capture_output=True, text=True, check=True,
+                                  cwd=Path(__file__).parent).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    return {"commit": git("rev-parse", "HEAD"), "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+
+def new_results(catalog: SyntheticCatalog, scale_name: str, settings: Dict[str, Any]) -> Dict[str, Any]:
+    """Returns the results of a new run, with what is needed to reproduce and compare it, see write_results."""
+    return {
+        "format": RESULTS_FORMAT,
+        **_commit(),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "catalog": {"name": catalog.name, "scale": scale_name, "seed": catalog.seed, **asdict(catalog.scale)},
+        "settings": settings,
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpus": os.cpu_count()},
+    }
+
+
+def check_catalog(client: Client, catalog: SyntheticCatalog):
+    """Exits if the server does not have the catalog, since the scenarios would measure requests for nothing."""
+    if not any(response["id"] == str(catalog.catalog.id)
+               for response in json.loads(client.get(Request("/catalogs/")).body)):
+        raise SystemExit(f"The server has no catalog {catalog.name}. Load it with the same --scale and --seed first.")
+
+
+def run_benchmarks(context: Context,
+                   scenarios: Sequence[Scenario],
+                   scale_name: str,
+                   requests: int = 200,
+                   warmup: int = 20,
+                   concurrency: int = 0,
+                   duration: float = 10.0,
+                   log: Callable[[str], None] = print) -> Dict[str, Any]:
+    """
+    Runs the scenarios and returns the results, see write_results. Each scenario draws its requests from a random
+    generator seeded with the catalog seed and its name, so every run sends the same requests. The throughput is only
+    measured if concurrency is set.
+    """
+    catalog = context.catalog
+    check_catalog(context.client, catalog)
+
+    results = new_results(catalog, scale_name, {"requests": requests, "warmup": warmup, "concurrency": concurrency,
+                                                "duration": duration, "headers": context.client.headers})
+    results.update(url=context.client.url, scenarios={})
+    for scenario in scenarios:
+        rng = random.Random(f"{catalog.seed}:{scenario.name}")
+        result: Dict[str, Any] = {"route": scenario.route, "description": scenario.description}
+        try:
+            drawn = [scenario.make(context, rng) for _ in range(warmup + requests)]
+        except SkipScenario as e:
+            log(f"{scenario.name:<22} skipped: {e}")
+            results["scenarios"][scenario.name] = {**result, "skipped": str(e)}
+            continue
+
+        result["latency"] = measure_latency(context.client, scenario, drawn, warmup)
+        line = _line(result["latency"])
+        if concurrency:
+            result["throughput"] = measure_throughput(context.client, scenario, drawn, concurrency, duration)
+            line += f"  {result['throughput']['requests_per_second']:8.1f} req/s"
+        log(f"{scenario.name:<22} {line}")
+        results["scenarios"][scenario.name] = result
+    return results
+
+
+def _line(latency: Dict[str, Any]) -> str:
+    if "p50_ms" not in latency:
+        return "no measurements"
+    errors = f"  {latency['errors']} errors" if latency["errors"] else ""
+    return (f"p50 {latency['p50_ms']:8.2f} ms  p95 {latency['p95_ms']:8.2f} ms  p99 {latency['p99_ms']:8.2f} ms  "
+            f"{latency['mean_bytes']:9.0f} B{errors}")
+
+
+def write_results(results: Dict[str, Any], directory: Path, suffix: str = "") -> Path:
+    """Writes the results to <directory>/<time>-<scale>-<commit><suffix>.json, and returns its path."""
+    directory.mkdir(parents=True, exist_ok=True)
+    started_at = datetime.fromisoformat(results["started_at"]).strftime("%Y%m%dT%H%M%SZ")
+    commit = (results["commit"] or "unknown")[:10] + ("-dirty" if results["dirty"] else "")
+    path = directory / f"{started_at}-{results['catalog']['scale']}-{commit}{suffix}.json"
+    path.write_text(json.dumps(results, indent=2))
+    return path
+
+
+# The measures that are compared, and whether a higher value is better.
+MEASURES: List[Tuple[str, str, bool]] = [
+    ("latency", "p50_ms", False),
+    ("latency", "p95_ms", False),
+    ("throughput", "requests_per_second", True),
+]
+
+
+def compare_results(baseline: Dict[str, Any],
+                    current: Dict[str, Any],
+                    threshold: float = 10.0,
+                    noise_ms: float = 1.0,
+                    log: Callable[[str], None] = print) -> List[str]:
+    """
+    Prints the change of every measure of the scenarios in both results, and returns the regressions: the measures
+    that got more than threshold percent worse. Latencies must also get noise_ms worse, since the fast endpoints vary
+    by more than the threshold from run to run.
+    """
+    if baseline["catalog"] != current["catalog"]:
+        log("Warning: the results are of different catalogs, so they may not be comparable.")
+    log(f"{'scenario':<22} {'measure':<20} {'baseline':>10} {'current':>10} {'change':>8}")
+    regressions = []
+    for name, scenario in current["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if before is None:
+            continue
+        for kind, measure, higher_is_better in MEASURES:
+            old = before.get(kind, {}).get(measure)
+            new = scenario.get(kind, {}).get(measure)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            worse = -change if higher_is_better else change
+            noise = kind == "latency" and new - old < noise_ms
+            flag = " regression" if worse > threshold and not noise else ""
+            if flag:
+                regressions.append(f"{name} {measure}")
+            log(f"{name:<22} {measure:<20} {old:10.2f} {new:10.2f} {change:+7.1f}%{flag}")
+    return regressions
@@ -0,0 +1,181 @@
+import json
+import random
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .catalog import SyntheticCatalog
+from .client import Client, Request
+
+
+class SkipScenario(Exception):
+    """Raised while preparing a scenario that cannot run against this server, e.g. without stack files."""
+
+
+@dataclass
+class Context:
+    """What the scenarios draw their requests from: the loaded catalog, and the server for requests of their own."""
+    catalog: SyntheticCatalog
+    client: Client
+    _cache: Dict[str, object] = field(default_factory=dict)
+
+    def fetch(self, request: Request, expected: Tuple[int, ...] = (200,)):
+        """Sends a request that is not measured, e.g. for the cursor of a next page."""
+        response = self.client.get(request)
+        if response.status not in expected:
+            raise SkipScenario(f"GET {request.target()} returned {response.status}.")
+        return response
+
+    def stack_item(self, rng: random.Random, pyramid: bool = False) -> str:
+        """Returns a random item with a stack file (and a tile pyramid), see loader.write_stacks."""
+        key = "pyramids" if pyramid else "stacks"
+        if key not in self._cache:
+            items = [str(self.catalog.item_id(index))
+                     for index in range(min(self.catalog.scale.stack_items, self.catalog.scale.items))]
+            path = "/items/{}/stack" if pyramid else "/items/{}/stack/0"
+            self._cache[key] = [item_id for item_id in items
+                                if self.client.get(Request(path.format(item_id))).status in (200, 206)]
+        if not self._cache[key]:
+            raise SkipScenario(f"No {'tile pyramids' if pyramid else 'stack files'}: load the catalog with --stacks "
+                               f"and run the API with STACK_PATH set to that directory.")
+        return rng.choice(self._cache[key])
+
+
+@dataclass
+class Scenario:
+    """A kind of request to a public endpoint. make draws a request; it runs before the measurements start."""
+    name: str
+    route: str
+    description: str
+    make: Callable[[Context, random.Random], Request]
+    expected: Tuple[int, ...] = (200,)
+
+
+def _typo(rng: random.Random, name: str) -> str:
+    position = rng.randrange(1, len(name))
+    return name[:position] + rng.choice("aeiourst") + name[position + 1:]
+
+
+def _cursor_page(context: Context, rng: random.Random) -> Request:
+    """The second page of the items of a family, by the cursor of the first page."""
+    for _ in range(20):
+        params = {"family_id": str(rng.choice(context.catalog.families).id), "order": "id", "max_results": "100"}
+        cursor = context.fetch(Request("/items/", params)).headers.get("x-next-cursor")
+        if cursor:
+            return Request("/items/", {**params, "cursor": cursor})
+    raise SkipScenario("No family has more than one page of items.")
+
+
+def _not_modified(context: Context, rng: random.Random) -> Request:
+    """A revalidation of the items of a genus, with the ETag of an earlier response."""
+    request = Request("/items/", {"genus_id": str(rng.choice(context.catalog.genera).id)})
+    etag = context.fetch(request).headers.get("etag")
+    if etag is None:
+        raise SkipScenario("The items have no ETag.")
+    return Request(request.path, request.params, {"If-None-Match": etag})
+
+
+def _tile(context: Context, rng: random.Random) -> Request:
+    item_id = context.stack_item(rng, pyramid=True)
+    info = json.loads(context.fetch(Request(f"/items/{item_id}/stack")).body)
+    level = rng.randrange(info["levels"])
+    size = info["tile_size"] << level  # Full resolution pixels per tile at this level.
+    return Request(f"/items/{item_id}/stack/{rng.randrange(info['depth'])}/{level}/"
+                   f"{rng.randrange(-(-info['width'] // size))}/{rng.randrange(-(-info['height'] // size))}")
+
+
+def _catalog_id(context: Context) -> Dict[str, str]:
+    return {"catalog_id": str(context.catalog.catalog.id)}
+
+
+def _item(context: Context, rng: random.Random) -> str:
+    return str(context.catalog.item_id(rng.randrange(context.catalog.scale.items)))
+
+
+SCENARIOS: List[Scenario] = [
+    Scenario("root", "/", "The root of the API, a baseline of the framework overhead.",
+             lambda context, rng: Request("/")),
+    Scenario("catalogs", "/catalogs/", "All catalogs.",
+             lambda context, rng: Request("/catalogs/")),
+    Scenario("families", "/families/", "The families of the catalog.",
+             lambda context, rng: Request("/families/", _catalog_id(context))),
+    Scenario("families_count", "/families/count/", "The number of families.",
+             lambda context, rng: Request("/families/count/")),
+    Scenario("genera", "/genera/", "The genera of a family, with or without the pollen types.",
+             lambda context, rng: Request("/genera/", {"family_id": str(rng.choice(context.catalog.families).id),
+                                                       "include_type": rng.choice(("true", "false"))})),
+    Scenario("genera_letter", "/genera/letter/{letter}", "The genera by their first letter.",
+             lambda context, rng: Request(f"/genera/letter/{rng.choice(context.catalog.genera).name[0]}")),
+    Scenario("genera_count", "/genera/count/", "The number of genera.",
+             lambda context, rng: Request("/genera/count/")),
+    Scenario("species", "/species/", "The species of a genus.",
+             lambda context, rng: Request("/species/", {"genus_id": str(rng.choice(context.catalog.genera).id)})),
+    Scenario("species_catalog", "/species/", "All species of the catalog.",
+             lambda context, rng: Request("/species/", _catalog_id(context))),
+    Scenario("species_count", "/species/count/", "The number of species.",
+             lambda context, rng: Request("/species/count/")),
+    Scenario("search_prefix", "/search/", "Search by the first letters of a species name.",
+             lambda context, rng: Request("/search/", {
+                 "q": rng.choice(context.catalog.species).name[:rng.randint(3, 6)], **_catalog_id(context)})),
+    Scenario("search_typo", "/search/", "Search for a genus name with a typo.",
+             lambda context, rng: Request("/search/", {
+                 "q": _typo(rng, rng.choice(context.catalog.genera).name), **_catalog_id(context)})),
+    Scenario("studies", "/studies/", "The studies of the catalog.",
+             lambda context, rng: Request("/studies/", _catalog_id(context))),
+    Scenario("samples", "/samples/", "The samples of a study.",
+             lambda context, rng: Request("/samples/", {"study_id": str(rng.choice(context.catalog.studies).id)})),
+    Scenario("slides", "/slides/", "The slides of a sample.",
+             lambda context, rng: Request("/slides/", {"sample_id": str(rng.choice(context.catalog.samples).id)})),
+    Scenario("items_family", "/items/", "The first page of the items of a family, by abundance.",
+             lambda context, rng: Request("/items/", {"family_id": str(rng.choice(context.catalog.families).id),
+                                                      "order": "abundance"})),
+    Scenario("items_genus_name", "/items/", "The first page of the items of a genus, by name.",
+             lambda context, rng: Request("/items/", {"genus_id": str(rng.choice(context.catalog.genera).id),
+                                                      "order": "name"})),
+    Scenario("items_species_random", "/items/", "The items of a species in a seeded random order.",
+             lambda context, rng: Request("/items/", {"species_id": str(rng.choice(context.catalog.species).id),
+                                                      "order": "random", "seed": str(rng.randrange(1000))})),
+    Scenario("items_without_types", "/items/", "The items of a family, without the pollen types.",
+             lambda context, rng: Request("/items/", {"family_id": str(rng.choice(context.catalog.families).id),
+                                                      "include_genus_type": "false",
+                                                      "include_species_type": "false"})),
+    Scenario("items_reference", "/items/", "The items of a family in the reference collections.",
+             lambda context, rng: Request("/items/", {"family_id": str(rng.choice(context.catalog.families).id),
+                                                      "reference_only": "true"})),
+    Scenario("items_study", "/items/", "The items of a study.",
+             lambda context, rng: Request("/items/", {"study": str(rng.choice(context.catalog.studies).id)})),
+    Scenario("items_sample", "/items/", "The items of a sample.",
+             lambda context, rng: Request("/items/", {"sample": str(rng.choice(context.catalog.samples).id)})),
+    Scenario("items_slide", "/items/", "The items of a slide.",
+             lambda context, rng: Request("/items/", {"slide": str(rng.choice(context.catalog.slides).id)})),
+    Scenario("items_deep_page", "/items/", "A deep page (by offset) of the items of a study, by id.",
+             lambda context, rng: Request("/items/", {"study": str(rng.choice(context.catalog.studies).id),
+                                                      "order": "id", "page": str(rng.randint(5, 20))})),
+    Scenario("items_cursor", "/items/", "The next page of the items of a family, by cursor.", _cursor_page),
+    Scenario("items_not_modified", "/items/", "A revalidation of the items of a genus with If-None-Match.",
+             _not_modified, expected=(304,)),
+    Scenario("items_count", "/items/count/", "The number of items of a genus.",
+             lambda context, rng: Request("/items/count/", {"genus_id": str(rng.choice(context.catalog.genera).id)})),
+    Scenario("items_count_study", "/items/count/", "The number of items of a study, or its reference items.",
+             lambda context, rng: Request("/items/count/", {"study": str(rng.choice(context.catalog.studies).id),
+                                                            "reference_only": rng.choice(("true", "false"))})),
+    Scenario("thumbnail", "/items/{item_id}/thumbnail", "The thumbnail of an item.",
+             lambda context, rng: Request(f"/items/{_item(context, rng)}/thumbnail")),
+    Scenario("stack_info", "/items/{item_id}/stack", "The size and levels of the tile pyramid of an item.",
+             lambda context, rng: Request(f"/items/{context.stack_item(rng, pyramid=True)}/stack")),
+    Scenario("stack_stream", "/items/{item_id}/stack/stream", "All focus levels of an item, as multipart/mixed.",
+             lambda context, rng: Request(f"/items/{context.stack_item(rng)}/stack/stream")),
+    Scenario("stack_slice", "/items/{item_id}/stack/{z}", "A full resolution focus level of an item.",
+             lambda context, rng: Request(f"/items/{context.stack_item(rng)}/stack/"
+                                          f"{rng.randrange(context.catalog.scale.stack_depth)}")),
+    Scenario("stack_tile", "/items/{item_id}/stack/{z}/{level}/{x}/{y}", "A tile of the pyramid of an item.", _tile),
+]
+
+
+def select(names: Optional[List[str]]) -> List[Scenario]:
+    """Returns the scenarios with the given names (or name prefixes, like items_), or all if None."""
+    if not names:
+        return SCENARIOS
+    selected = [scenario for scenario in SCENARIOS if any(scenario.name.startswith(name) for name in names)]
+    if not selected:
+        raise ValueError(f"No scenarios match {', '.join(names)}.")
+    return selected
@@ -0,0 +1,53 @@
+import os
+from functools import wraps
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.util import greenlet_spawn
+
+from .metrics import instrument
+from .profiling import profile_statements
+from .pooling import engine_options, pooled_url, set_statement_timeout
+from .postgresqldatarepository import PostgresqlDataRepository, database_url, replica_set
+
+
+class AsyncPostgresqlDataRepository:
+    """
+    Non-blocking version of PostgresqlDataRepository, built on SQLAlchemy's asyncio extension and the asyncpg driver.
+
+    Every public method of PostgresqlDataRepository is available here as a coroutine with the same arguments. The
+    queries themselves are shared: they run on the synchronous facade of the async engine inside a greenlet, which
+    hands control back to the event loop whenever the driver waits for the database.
+    """
+    def __init__(self):
+        echo = bool(os.getenv("BUILD_MODE", False))  # Suppress logging all statements in production mode.
+        self.async_engines = []
+
+        def create(url: str) -> Engine:
+            async_engine = create_async_engine(pooled_url(url, async_driver=True),
+                                               echo=echo, **engine_options(async_driver=True))
+            set_statement_timeout(async_engine.sync_engine)
+            instrument(async_engine.sync_engine)
+            profile_statements(async_engine.sync_engine)
+            self.async_engines.append(async_engine)
+            return async_engine.sync_engine
+
+        engine = create(database_url("postgresql+asyncpg"))
+        self.async_engine = self.async_engines[0]
+        self.repository = PostgresqlDataRepository(engine, replica_set("postgresql+asyncpg", create))
+
+    def __getattr__(self, name):
+        attribute = getattr(self.repository, name)
+        if name.startswith("_") or not callable(attribute):
+            return attribute
+
+        @wraps(attribute)
+        async def method(*args, **kwargs):
+            return await greenlet_spawn(attribute, *args, **kwargs)
+
+        return method
+
+    async def dispose(self):
+        """Closes all pooled connections, of the primary and the replicas."""
+        for async_engine in self.async_engines:
+            await async_engine.dispose()
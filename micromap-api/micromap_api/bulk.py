@@ -0,0 +1,76 @@
+from typing import Annotated, Dict, List, Type, TypeVar
+
+from fastapi import HTTPException, Request
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+
+NDJSON_MEDIA_TYPES = {"application/x-ndjson", "application/jsonl", "application/jsonlines"}
+
+M = TypeVar("M", bound=BaseModel)
+
+
+def _summary(errors: List[dict], skip: int = 0) -> str:
+    """Returns validation error details on one line, leaving out the first `skip` items of each location."""
+    return "; ".join(f"{'.'.join(map(str, details['loc'][skip:])) or 'row'}: {details['msg']}" for details in errors)
+
+
+def _raise_row_errors(errors: Dict[int, str]):
+    raise HTTPException(status_code=422,
+                        detail=[{"row": index, "detail": detail} for index, detail in sorted(errors.items())])
+
+
+def _check_row_count(count: int, max_rows: int):
+    if count > max_rows:
+        raise HTTPException(status_code=413, detail=f"Too many rows, the maximum is {max_rows}.")
+
+
+async def read_rows(request: Request, model: Type[M], max_rows: int) -> List[M]:
+    """
+    Reads and validates the rows of a bulk request, either a JSON array or NDJSON (one JSON object per line). NDJSON is
+    validated while it streams in. Raises a 422 that reports the errors of every invalid row (by 0-based index), or a
+    413 if there are more than max_rows rows.
+    """
+    media_type = request.headers.get("content-type", "application/json").split(";")[0].strip().lower()
+    if media_type in NDJSON_MEDIA_TYPES:
+        return await _read_ndjson(request, model, max_rows)
+
+    body = await request.body()
+    try:
+        return TypeAdapter(Annotated[List[model], Field(max_length=max_rows)]).validate_json(body)
+    except ValidationError as e:
+        errors: Dict[int, List[dict]] = {}
+        for details in e.errors():
+            if details["type"] == "too_long" and not details["loc"]:
+                _check_row_count(max_rows + 1, max_rows)
+            if not details["loc"] or not isinstance(details["loc"][0], int):
+                raise HTTPException(status_code=422, detail=f"Expected a JSON array of rows: {details['msg']}")
+            errors.setdefault(details["loc"][0], []).append(details)
+        _raise_row_errors({index: _summary(row_errors, skip=1) for index, row_errors in errors.items()})
+
+
+async def _read_ndjson(request: Request, model: Type[M], max_rows: int) -> List[M]:
+    rows: List[M] = []
+    errors: Dict[int, str] = {}
+    index = 0
+
+    def validate(line: bytes):
+        nonlocal index
+        if not line.strip():
+            return  # Allows blank lines, e.g. a trailing newline.
+        _check_row_count(index + 1, max_rows)
+        try:
+            rows.append(model.model_validate_json(line))
+        except ValidationError as e:
+            errors[index] = _summary(e.errors())
+        index += 1
+
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            validate(line)
+    validate(buffer)
+
+    if errors:
+        _raise_row_errors(errors)
+    return rows
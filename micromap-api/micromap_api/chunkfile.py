@@ -0,0 +1,98 @@
+import json
+import mmap
+import os
+import struct
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterable, Tuple
+
+# Layout of a chunk file, all integers little-endian:
+#   magic (8 bytes), header length (uint32), chunk count (uint32),
+#   header (UTF-8 JSON object),
+#   index (per chunk: offset and length, both uint64, offsets from the start of the file),
+#   chunk data.
+# Readers memory-map the file, so reading a chunk is a slice of the mapping, and a chunk can also be served directly
+# from its byte range in the file.
+MAGIC = b"MMCHUNK1"
+_PREAMBLE = struct.Struct("<8sII")
+_INDEX_ENTRY = struct.Struct("<QQ")
+
+
+class InvalidChunkFileException(Exception):
+    pass
+
+
+def write_chunk_file(path: Path, header: Dict[str, Any], chunks: Iterable[bytes]):
+    """
+    Writes a chunk file with a JSON header and the given chunks. The file is written to a temporary file and renamed
+    when complete, so readers never see a partially written file.
+    """
+    chunks = list(chunks)
+    header_bytes = json.dumps(header, separators=(",", ":")).encode()
+    offset = _PREAMBLE.size + len(header_bytes) + _INDEX_ENTRY.size * len(chunks)
+
+    index = bytearray()
+    for chunk in chunks:
+        index += _INDEX_ENTRY.pack(offset, len(chunk))
+        offset += len(chunk)
+
+    temporary = path.with_name(path.name + ".tmp")
+    with open(temporary, "wb") as file:
+        file.write(_PREAMBLE.pack(MAGIC, len(header_bytes), len(chunks)))
+        file.write(header_bytes)
+        file.write(index)
+        for chunk in chunks:
+            file.write(chunk)
+    os.replace(temporary, path)
+
+
+class ChunkFile:
+    """Read-only, memory-mapped chunk file. Chunks are returned as memoryviews of the mapping, without copying."""
+
+    def __init__(self, path: Path):
+        with open(path, "rb") as file:
+            try:
+                self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise InvalidChunkFileException(f"{path} is empty.")
+
+        try:
+            magic, header_length, self.chunk_count = _PREAMBLE.unpack_from(self._mmap, 0)
+        except struct.error:
+            raise InvalidChunkFileException(f"{path} is too short to be a chunk file.")
+        if magic != MAGIC:
+            raise InvalidChunkFileException(f"{path} is not a chunk file.")
+
+        try:
+            self.header: Dict[str, Any] = json.loads(self._mmap[_PREAMBLE.size:_PREAMBLE.size + header_length])
+        except ValueError:
+            raise InvalidChunkFileException(f"{path} has an invalid header.")
+        self._index_offset = _PREAMBLE.size + header_length
+        self.size = len(self._mmap)
+        if self._index_offset + _INDEX_ENTRY.size * self.chunk_count > self.size:
+            raise InvalidChunkFileException(f"{path} is truncated.")
+
+    def byte_range(self, index: int) -> Tuple[int, int]:
+        """Returns the offset and length of a chunk in the file."""
+        if not 0 <= index < self.chunk_count:
+            raise IndexError(index)
+        return _INDEX_ENTRY.unpack_from(self._mmap, self._index_offset + _INDEX_ENTRY.size * index)
+
+    def chunk(self, index: int) -> memoryview:
+        offset, length = self.byte_range(index)
+        if offset + length > self.size:
+            raise InvalidChunkFileException(f"Chunk {index} ends after the end of the file.")
+        return memoryview(self._mmap)[offset:offset + length]
+
+
+@lru_cache(maxsize=int(os.getenv("CHUNK_FILE_CACHE_SIZE", "256")))
+def _open_chunk_file(path: Path, modified: int) -> ChunkFile:
+    return ChunkFile(path)
+
+
+def open_chunk_file(path: Path) -> ChunkFile:
+    """
+    Returns a (cached) reader of a chunk file, or raises FileNotFoundError. A file that is replaced, e.g. by
+    regenerating it, is mapped again.
+    """
+    return _open_chunk_file(path, os.stat(path).st_mtime_ns)
@@ -0,0 +1,147 @@
+import argparse
+import os
+from pathlib import Path
+
+from .ormmodels import ORMDerivativeJob
+from .postgresqldatarepository import PostgresqlDataRepository
+from .pyramid import TILE_SIZE
+
+
+def migrate(args: argparse.Namespace):
+    repository = PostgresqlDataRepository()
+    for migration in repository.create_database():
+        print(f"Applied migration {migration.version}: {migration.description}", flush=True)
+
+    if args.thumbnails:
+        print(f"Migrated {repository.migrate_thumbnails()} thumbnails.", flush=True)
+
+
+def run_import(args: argparse.Namespace):
+    from .importer import import_stacks  # Requires the optional 'import' dependencies.
+
+    imported, failed = import_stacks(
+        PostgresqlDataRepository(),
+        manifest=args.manifest,
+        prepared=args.prepared,
+        stacks=args.stacks,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        thumbnail_size=args.thumbnail_size,
+        log=lambda message: print(message, flush=True))
+    print(f"Imported {imported} items, {failed} failed.", flush=True)
+    if failed:
+        raise SystemExit(1)
+
+
+def write_stacks(args: argparse.Namespace):
+    from .importer import write_all_stack_files  # Requires the optional 'import' dependencies.
+
+    args.stacks.mkdir(parents=True, exist_ok=True)
+    processed, failed = write_all_stack_files(
+        args.prepared, args.stacks, workers=args.workers, log=lambda message: print(message, flush=True))
+    print(f"Processed {processed} items, {failed} failed.", flush=True)
+    if failed:
+        raise SystemExit(1)
+
+
+def enqueue_derivatives(args: argparse.Namespace):
+    repository = PostgresqlDataRepository()
+    queued = repository.enqueue_derivatives(ORMDerivativeJob.THUMBNAIL, args.thumbnail_size)
+    print(f"Queued {queued} thumbnails.", flush=True)
+    if args.pyramids:
+        queued = repository.enqueue_derivatives(ORMDerivativeJob.PYRAMID, args.tile_size)
+        print(f"Queued {queued} tile pyramids.", flush=True)
+
+
+def run_worker(args: argparse.Namespace):
+    from .derivatives import run_worker  # Requires the optional 'import' dependencies.
+
+    done, failed = run_worker(
+        PostgresqlDataRepository(),
+        stacks=args.stacks,
+        workers=args.workers,
+        poll_interval=args.poll_interval,
+        once=args.once,
+        log=lambda message: print(message, flush=True))
+    print(f"Made {done} derivatives, {failed} failed.", flush=True)
+
+
+def rebuild_statistics(args: argparse.Namespace):
+    rows, catalogs = PostgresqlDataRepository().rebuild_statistics()
+    print(f"Rebuilt the statistics: {rows} taxon and study counts, {catalogs} catalogs.", flush=True)
+
+
+def main():
+    """Entry point of the micromap-api command. The database is configured by the PG* environment variables."""
+    parser = argparse.ArgumentParser(prog="micromap-api", description="MicroMap API management commands.")
+    commands = parser.add_subparsers(required=True, metavar="command")
+
+    migrate_parser = commands.add_parser("migrate", help="Create missing tables and apply pending schema migrations.")
+    migrate_parser.add_argument("--thumbnails", action="store_true",
+                                help="Also move base64 key images to the binary thumbnail column.")
+    migrate_parser.set_defaults(func=migrate)
+
+    import_parser = commands.add_parser(
+        "import",
+        help="Import image stacks described by a CSV or JSON manifest. Run it again to resume an interrupted import.")
+    import_parser.add_argument("manifest", type=Path,
+                               help="Manifest with one row per image stack. Stack paths are relative to its directory.")
+    import_parser.add_argument("--prepared", type=Path, required=True,
+                               help="Directory for the prepared stacks (o_<id>/<id>_<n>.png) served by the website.")
+    import_parser.add_argument("--stacks", type=Path, default=os.getenv("STACK_PATH"),
+                               help="Directory for the stack files and tile pyramids served by the API "
+                                    "(default: STACK_PATH). Not written if unset.")
+    import_parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                               help="Number of processes converting images (default: number of CPUs).")
+    import_parser.add_argument("--batch-size", type=int, default=500, help="Items per database transaction.")
+    import_parser.add_argument("--thumbnail-size", type=int, default=128, help="Maximum thumbnail width and height.")
+    import_parser.set_defaults(func=run_import)
+
+    stacks_parser = commands.add_parser(
+        "stacks", help="Convert the image stacks in the prepared layout to stack files and tile pyramids, if missing.")
+    stacks_parser.add_argument("--prepared", type=Path, required=True,
+                               help="Directory with the prepared stacks (o_<id>/<id>_<n>.png).")
+    stacks_parser.add_argument("--stacks", type=Path, default=os.getenv("STACK_PATH"),
+                               required=os.getenv("STACK_PATH") is None,
+                               help="Directory for the stack files and tile pyramids served by the API "
+                                    "(default: STACK_PATH).")
+    stacks_parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                               help="Number of processes converting images (default: number of CPUs).")
+    stacks_parser.set_defaults(func=write_stacks)
+
+    derivatives_parser = commands.add_parser(
+        "derivatives",
+        help="Queue deriving thumbnails (and tile pyramids) from the stack files of all items that do not have them in "
+             "the given size yet. The queue is processed by `micromap-api worker`.")
+    derivatives_parser.add_argument("--thumbnail-size", type=int, default=int(os.getenv("THUMBNAIL_SIZE", "128")),
+                                    help="Maximum thumbnail width and height (default: THUMBNAIL_SIZE or 128).")
+    derivatives_parser.add_argument("--pyramids", action="store_true", help="Also queue the tile pyramids.")
+    derivatives_parser.add_argument("--tile-size", type=int, default=TILE_SIZE,
+                                    help=f"Tile size of the pyramids (default: {TILE_SIZE}).")
+    derivatives_parser.set_defaults(func=enqueue_derivatives)
+
+    worker_parser = commands.add_parser("worker",
+                                        help="Process the queued derivatives, see `micromap-api derivatives`.")
+    worker_parser.add_argument("--stacks", type=Path, default=os.getenv("STACK_PATH"),
+                               required=os.getenv("STACK_PATH") is None,
+                               help="Directory with the stack files, where the tile pyramids are written too "
+                                    "(default: STACK_PATH).")
+    worker_parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                               help="Number of processes converting images (default: number of CPUs).")
+    worker_parser.add_argument("--poll-interval", type=float, default=5.0,
+                               help="Seconds between checking for new jobs when the queue is empty.")
+    worker_parser.add_argument("--once", action="store_true", help="Stop when the queue is empty.")
+    worker_parser.set_defaults(func=run_worker)
+
+    statistics_parser = commands.add_parser(
+        "statistics",
+        help="Rebuild the item and taxon statistics from scratch. They are kept up-to-date by the API, so this is only "
+             "needed after changing the items or taxa in the database directly.")
+    statistics_parser.set_defaults(func=rebuild_statistics)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
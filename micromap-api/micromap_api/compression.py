@@ -0,0 +1,147 @@
+import zlib
+from typing import Callable, Iterable, List, Optional, Tuple
+
+import brotli
+
+# Media types worth compressing. Images and focus stacks are compressed already.
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "application/javascript", "text/")
+
+
+def accepted_encoding(accept_encoding: str, encodings: Iterable[str]) -> Optional[str]:
+    """Returns the first of the given encodings that the Accept-Encoding header accepts, or None."""
+    accepted, rejected = set(), set()
+    for coding in accept_encoding.lower().split(","):
+        name, _, parameters = coding.partition(";")
+        if parameters.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            rejected.add(name.strip())
+        else:
+            accepted.add(name.strip())
+    return next((encoding for encoding in encodings
+                 if encoding not in rejected and (encoding in accepted or "*" in accepted)), None)
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware that compresses text responses (like JSON) of at least minimum_size bytes with brotli or gzip,
+    preferring brotli. Streamed responses are compressed chunk by chunk, and flushed after each chunk, so the client
+    receives every chunk as soon as it is sent.
+
+    The ETag of a compressed response is made weak, since the compressed bytes are not the same as those of another
+    encoding. If-None-Match uses weak comparison, so the ETags of the encodings still match each other.
+    """
+    def __init__(self, app, minimum_size: int = 1000, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.compressors = {
+            "br": lambda: _BrotliCompressor(brotli_quality),
+            "gzip": lambda: _GzipCompressor(gzip_level),
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = dict(scope["headers"]).get(b"accept-encoding", b"").decode("latin-1")
+        encoding = accepted_encoding(accept_encoding, self.compressors)
+        compressor = self.compressors.get(encoding)
+        await _CompressingResponder(self.app, encoding, compressor, self.minimum_size)(scope, receive, send)
+
+
+class _GzipCompressor:
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # With a gzip header.
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class _BrotliCompressor:
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class _CompressingResponder:
+    """
+    Compresses the response of one request, if its type is compressible and it is not encoded already. Compressible
+    responses always vary by Accept-Encoding, also if they are not compressed, so that caches keep them apart.
+    """
+
+    def __init__(self, app, encoding: Optional[str], compressor: Optional[Callable], minimum_size: int):
+        self.app = app
+        self.encoding = encoding
+        self.make_compressor = compressor
+        self.minimum_size = minimum_size
+        self.start = None
+        self.compressor = None  # Set while compressing a streamed response.
+        self.passthrough = False
+
+    def headers(self, start, compressed: bool, length: Optional[int] = None) -> List[Tuple[bytes, bytes]]:
+        """Returns the headers of the response start, with those of the (un)compressed response."""
+        headers = []
+        vary = []
+        for name, value in start.get("headers", []):
+            name = name.lower()
+            if name == b"vary":
+                vary.append(value)
+            elif name == b"content-length" and compressed:
+                continue
+            elif name == b"etag" and compressed and not value.startswith(b"W/"):
+                headers.append((name, b"W/" + value))
+            else:
+                headers.append((name, value))
+        headers.append((b"vary", b", ".join([*vary, b"Accept-Encoding"])))
+        if compressed:
+            headers.append((b"content-encoding", self.encoding.encode()))
+            if length is not None:
+                headers.append((b"content-length", str(length).encode()))
+        return headers
+
+    async def __call__(self, scope, receive, send):
+        async def send_compressed(message):
+            if message["type"] == "http.response.start":
+                headers = dict((name.lower(), value) for name, value in message.get("headers", []))
+                media_type = headers.get(b"content-type", b"").decode("latin-1")
+                self.passthrough = b"content-encoding" in headers or not media_type.startswith(COMPRESSIBLE_TYPES)
+                if self.passthrough:
+                    await send(message)
+                else:
+                    self.start = message  # Sent with the first part of the body, when its size is known.
+                return
+
+            if self.passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body, more_body = message.get("body", b""), message.get("more_body", False)
+            start, self.start = self.start, None
+            if start is not None:
+                if self.make_compressor is None or (not more_body and len(body) < self.minimum_size):
+                    self.passthrough = True
+                    await send({**start, "headers": self.headers(start, compressed=False)})
+                    await send(message)
+                    return
+
+                self.compressor = self.make_compressor()
+                if not more_body:
+                    body = self.compressor.compress(body) + self.compressor.finish()
+                    await send({**start, "headers": self.headers(start, compressed=True, length=len(body))})
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                await send({**start, "headers": self.headers(start, compressed=True)})
+
+            body = self.compressor.compress(body)
+            if not more_body:
+                body += self.compressor.finish()
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,121 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from io import BytesIO
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+from uuid import UUID
+
+from PIL import Image  # Requires the optional 'import' dependencies.
+from sqlalchemy import Row
+
+from .ormmodels import ORMDerivativeJob
+from .postgresqldatarepository import PostgresqlDataRepository
+from .pyramid import pyramid_path, write_pyramid
+from .stackfile import open_stack
+
+
+class _Stopwatch:
+    """Measures the milliseconds between successive laps."""
+
+    def __init__(self):
+        self.start = self.last = time.perf_counter()
+
+    def lap(self) -> float:
+        now = time.perf_counter()
+        elapsed, self.last = (now - self.last) * 1000, now
+        return elapsed
+
+    def total(self) -> float:
+        return (time.perf_counter() - self.start) * 1000
+
+
+def make_thumbnail(stacks: Path, item_id: UUID, size: int) -> Tuple[bytes, Dict[str, float]]:
+    """Returns a PNG thumbnail of the middle focus level, of at most size x size pixels, and its timings."""
+    stopwatch = _Stopwatch()
+    stack = open_stack(stacks, item_id)
+    with Image.open(BytesIO(stack.slice(stack.depth // 2))) as image:
+        image.load()
+        decode_ms = stopwatch.lap()
+        image.thumbnail((size, size))
+        resize_ms = stopwatch.lap()
+        thumbnail = BytesIO()
+        image.save(thumbnail, format="PNG")
+        encode_ms = stopwatch.lap()
+    return thumbnail.getvalue(), {"decode_ms": decode_ms, "resize_ms": resize_ms, "encode_ms": encode_ms,
+                                  "total_ms": stopwatch.total()}
+
+
+def make_pyramid(stacks: Path, item_id: UUID, tile_size: int) -> Dict[str, float]:
+    """Writes the tile pyramid of an item from its stack file, and returns its timings."""
+    stopwatch = _Stopwatch()
+    stack = open_stack(stacks, item_id)
+    images = [Image.open(BytesIO(stack.slice(z))) for z in range(stack.depth)]
+    try:
+        for image in images:
+            image.load()
+        decode_ms = stopwatch.lap()
+        write_pyramid(pyramid_path(stacks, item_id), images, tile_size)
+        encode_ms = stopwatch.lap()  # Includes downsampling the resolution levels.
+    finally:
+        for image in images:
+            image.close()
+    return {"decode_ms": decode_ms, "encode_ms": encode_ms, "total_ms": stopwatch.total()}
+
+
+def derive(stacks: Path, kind: str, item_id: UUID, size: int) -> Tuple[Optional[bytes], Dict[str, float]]:
+    """Makes a derivative from the stack file of an item. Returns the thumbnail, if any, and the timings."""
+    if kind == ORMDerivativeJob.THUMBNAIL:
+        return make_thumbnail(stacks, item_id, size)
+    if kind == ORMDerivativeJob.PYRAMID:
+        return None, make_pyramid(stacks, item_id, size)
+    raise ValueError(f"Unknown derivative: {kind}")
+
+
+def run_worker(repository: PostgresqlDataRepository,
+               stacks: Path,
+               workers: Optional[int] = None,
+               poll_interval: float = 5.0,
+               once: bool = False,
+               log: Callable[[str], None] = print) -> Tuple[int, int]:
+    """
+    Processes the queued derivative jobs in a pool of worker processes. Jobs are claimed while fewer are in progress
+    than there are workers, so the pool is kept busy without claiming more jobs than it can start soon. Polls for new
+    jobs every poll_interval seconds, or returns when the queue is empty if once is set.
+
+    Returns the number of done and failed jobs.
+    """
+    workers = workers or os.cpu_count() or 1
+    timeout = float(os.getenv("DERIVATIVE_JOB_TIMEOUT", "600"))
+    max_attempts = int(os.getenv("DERIVATIVE_MAX_ATTEMPTS", "3"))
+
+    done = failed = 0
+    in_progress: Dict[Future, Row] = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while True:
+            if len(in_progress) < workers:
+                for job in repository.claim_derivative_jobs(2 * workers - len(in_progress), timeout):
+                    in_progress[executor.submit(derive, stacks, job.kind, job.item_id, job.size)] = job
+
+            if not in_progress:
+                if once:
+                    return done, failed
+                time.sleep(poll_interval)
+                continue
+
+            finished, _ = wait(in_progress, return_when=FIRST_COMPLETED)
+            for future in finished:
+                job = in_progress.pop(future)
+                try:
+                    thumbnail, timings = future.result()
+                except Exception as exc:
+                    repository.fail_derivative_job(job, f"{exc.__class__.__name__}: {exc}", max_attempts)
+                    failed += 1
+                    log(f"Failed to make the {job.kind} of item {job.item_id}: {exc}")
+                    continue
+
+                if repository.complete_derivative_job(job, thumbnail, timings):
+                    done += 1
+                    log(f"Made the {job.kind} of item {job.item_id} in {timings['total_ms']:.0f} ms (" +
+                        ", ".join(f"{name[:-3]} {ms:.0f} ms" for name, ms in timings.items() if name != "total_ms") +
+                        ").")
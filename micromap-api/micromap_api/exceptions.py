@@ -1,3 +1,6 @@
+from typing import Dict
+
+
 class KeyViolationException(Exception):
 
     def __init__(self, message: str, detailed_message: str = None):
@@ -5,5 +8,15 @@ class KeyViolationException(Exception):
         self.detailed_message= detailed_message
         super().__init__(message)
 
+class BulkKeyViolationException(KeyViolationException):
+    """Raised when rows of a bulk insert violate keys. Maps the (0-based) index of each offending row to its error."""
+
+    def __init__(self, errors: Dict[int, str]):
+        self.errors = errors
+        super().__init__('IntegrityError', f"{len(errors)} rows violate keys.")
+
 class EntityDoesNotExistException(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class InvalidCursorException(Exception):
+    pass
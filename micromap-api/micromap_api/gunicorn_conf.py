@@ -0,0 +1,20 @@
+import os
+import shutil
+
+# Gunicorn settings, see the ENTRYPOINT of the Dockerfile. The worker processes write their Prometheus metrics to
+# PROMETHEUS_MULTIPROC_DIR (see metrics.py). It must be set before prometheus_client is imported.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/micromap-metrics")
+
+from prometheus_client import multiprocess  # noqa: E402
+
+
+def on_starting(server):
+    """Removes the metrics of a previous run."""
+    directory = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+
+def child_exit(server, worker):
+    """Drops the live gauges (like the pooled connections) of a worker that exited."""
+    multiprocess.mark_process_dead(worker.pid)
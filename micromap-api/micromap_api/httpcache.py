@@ -0,0 +1,110 @@
+import threading
+from hashlib import sha256
+from typing import Callable, Dict, Iterable, Optional
+from urllib.parse import parse_qs
+from uuid import UUID
+
+from .notifications import ALL_CATALOGS_ID
+
+
+class DataVersions:
+    """
+    Thread-safe, in-process copy of the data versions (see notifications.bump_data_versions). It is updated by the
+    writes of this process and by the ChangeListener for the writes of other processes. Versions only increase, so a
+    notification that arrives late is ignored.
+
+    The versions are only known while the ChangeListener listens: before it loaded the versions of the database, and
+    while it is disconnected, the writes of other processes are missed.
+    """
+    def __init__(self):
+        self._versions: Dict[UUID, int] = {}
+        self._known = False
+        self._lock = threading.Lock()
+
+    def get(self, catalog_id: Optional[UUID] = None) -> int:
+        """Returns the version of a catalog, or of all catalogs if catalog_id is None. Unknown versions are 0."""
+        return self._versions.get(ALL_CATALOGS_ID if catalog_id is None else catalog_id, 0)
+
+    def current(self, catalog_id: Optional[UUID] = None) -> Optional[int]:
+        """Returns the version like get, or None while the listener is not listening, since it may be outdated."""
+        return self.get(catalog_id) if self._known else None
+
+    def update(self, versions: Dict[UUID, int]):
+        with self._lock:
+            for catalog_id, version in versions.items():
+                if version > self._versions.get(catalog_id, 0):
+                    self._versions[catalog_id] = version
+
+    def set_known(self, known: bool):
+        """Marks the versions as known once the listener loaded them, or as unknown when it lost its connection."""
+        self._known = known
+
+
+class ETagMiddleware:
+    """
+    ASGI middleware that validates the responses of read-only GET routes by data version, instead of by content. The
+    ETag of a response is a hash of its URL and the data version it depends on, so a request with a matching
+    If-None-Match header is answered with 304 Not Modified without running the route, or touching the database.
+
+    A response of the catalog_paths, the routes that only read the catalog in their catalog_id query parameter, depends
+    on the version of that catalog. Every other response depends on the version of all catalogs, since the writes of
+    studies, samples, slides and items only bump that one. Paths are matched exactly, or by prefix if they end with
+    "*". Responses get no ETag while the version is None (unknown), so a client never revalidates a response against an
+    outdated version.
+    """
+    def __init__(self,
+                 app,
+                 version: Callable[[Optional[UUID]], Optional[int]],
+                 paths: Iterable[str],
+                 cache_control: str,
+                 catalog_paths: Iterable[str] = ()):
+        self.app = app
+        self.version = version
+        self.paths = frozenset(path for path in paths if not path.endswith("*"))
+        self.prefixes = tuple(path[:-1] for path in paths if path.endswith("*"))
+        self.catalog_paths = frozenset(catalog_paths)
+        self.cache_control = cache_control.encode()
+
+    def cached(self, path: str) -> bool:
+        return path in self.paths or path.startswith(self.prefixes)
+
+    def etag(self, scope) -> Optional[bytes]:
+        catalog_id = None
+        catalog_ids = None
+        if scope["path"] in self.catalog_paths:
+            catalog_ids = parse_qs(scope["query_string"].decode("latin-1")).get("catalog_id")
+        if catalog_ids:
+            try:
+                catalog_id = UUID(catalog_ids[0])
+            except ValueError:
+                pass  # The route rejects it.
+
+        url = scope["path"].encode() + b"?" + scope["query_string"]
+        version = self.version(catalog_id)
+        if version is None:
+            return None
+        return b'"%s"' % sha256(url + b":%d" % version).hexdigest()[:32].encode()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET" or not self.cached(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        etag = self.etag(scope)
+        if etag is None:
+            await self.app(scope, receive, send)
+            return
+
+        validator_headers = [(b"etag", etag), (b"cache-control", self.cache_control)]
+        if_none_match = dict(scope["headers"]).get(b"if-none-match")
+        if if_none_match is not None and etag in (tag.strip().removeprefix(b"W/") for tag in if_none_match.split(b",")):
+            await send({"type": "http.response.start", "status": 304, "headers": validator_headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def send_with_etag(message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                message = {**message, "headers": [*message.get("headers", []), *validator_headers]}
+            await send(message)
+
+        await self.app(scope, receive, send_with_etag)
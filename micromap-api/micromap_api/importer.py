@@ -0,0 +1,349 @@
+import csv
+import json
+import os
+from base64 import b64encode
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from io import BytesIO
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Type
+from uuid import UUID, NAMESPACE_URL, uuid4, uuid5
+
+from PIL import Image  # Optional dependency, see the 'import' extra in setup.py.
+from pydantic import BaseModel, ValidationError, model_validator
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import Session
+
+from .models import (Catalog, Family, Genus, Species, Study, SampleCreateDTO, SlideCreateDTO, ItemCreateDTO,
+                     BulkInsertResult)
+from .ormmodels import ORMBase, ORMCatalog, ORMFamily, ORMGenus, ORMSpecies, ORMStudy, ORMSample, ORMSlide, ORMItem
+from .postgresqldatarepository import PostgresqlDataRepository
+from .pyramid import pyramid_path, write_pyramid
+from .stackfile import stack_path, write_stack
+
+IMAGE_EXTENSIONS = {".png", ".tif", ".tiff", ".jpg", ".jpeg", ".bmp"}
+LOOKUP_SIZE = 10000  # Maximum number of keys per lookup query.
+
+
+class ManifestRow(BaseModel):
+    """One item in the import manifest: an image stack and the names of the catalog entries it belongs to."""
+    stack: str  # Directory with the focus layers of the stack (sorted by file name), relative to the manifest.
+    id: Optional[UUID] = None  # Derived from the stack path if not set, so a re-run imports the same item.
+    catalog: str
+    family: str
+    genus: Optional[str] = None
+    genus_is_type: bool = False
+    species: Optional[str] = None
+    species_is_type: bool = False
+    study: str  # Study description.
+    study_location: Optional[str] = None
+    study_remarks: Optional[str] = None
+    study_is_reference: bool = False
+    sample: str  # Sample description.
+    sample_location: Optional[str] = None
+    sample_age: Optional[str] = None
+    sample_remarks: Optional[str] = None
+    slide: str  # Slide description.
+    slide_remarks: Optional[str] = None
+    voxel_width: float
+    comment: Optional[str] = None
+
+    @model_validator(mode="after")
+    def check_taxonomy(self):
+        if self.species and not self.genus:
+            raise ValueError("A species requires a genus.")
+        return self
+
+    def item_id(self) -> UUID:
+        return self.id or uuid5(NAMESPACE_URL, f"micromap:stack:{self.stack}")
+
+
+def read_manifest(path: Path) -> List[ManifestRow]:
+    """Reads a CSV (with a header row) or JSON (an array of objects) manifest. Empty CSV cells are treated as unset."""
+    with open(path, newline="") as file:
+        if path.suffix.lower() == ".json":
+            rows = json.load(file)
+        else:
+            rows = [{key: value for key, value in row.items() if value not in ("", None)}
+                    for row in csv.DictReader(file)]
+
+    manifest = []
+    for index, row in enumerate(rows, start=1):
+        try:
+            manifest.append(ManifestRow.model_validate(row))
+        except ValidationError as e:
+            raise ValueError(f"Invalid row {index} in {path}: {e}")
+    return manifest
+
+
+def prepared_layers(prepared: Path, item_id: UUID) -> List[Path]:
+    """Returns the focus layers of an item in the prepared layout, ordered by n."""
+    layers = {}
+    for path in (prepared / f"o_{item_id}").glob(f"{item_id}_*.png"):
+        n = path.stem.rsplit("_", 1)[1]
+        if n.isdigit():
+            layers[int(n)] = path
+    return [layers[n] for n in sorted(layers)]
+
+
+def write_stack_files(prepared: Path, stacks: Path, item_id: UUID):
+    """
+    Writes the files derived from the prepared focus layers of an item, unless present: its stack file, which holds the
+    prepared PNGs as they are, and its tile pyramid.
+    """
+    layers = prepared_layers(prepared, item_id)
+    if not layers:
+        raise ValueError(f"No prepared focus layers for item {item_id}")
+
+    path = stack_path(stacks, item_id)
+    if not path.exists():
+        with Image.open(layers[0]) as image:
+            width, height = image.size
+        write_stack(path, [layer.read_bytes() for layer in layers], width, height)
+
+    path = pyramid_path(stacks, item_id)
+    if not path.exists():
+        images = [Image.open(layer) for layer in layers]
+        try:
+            write_pyramid(path, images)
+        finally:
+            for image in images:
+                image.close()
+
+
+def prepare_stack(source: Path, prepared: Path, stacks: Optional[Path], item_id: UUID, thumbnail_size: int) -> str:
+    """
+    Converts the focus layers in the source directory to prepared/o_<id>/<id>_<n>.png (n starting at 1), the layout
+    the web client reads, and returns the base64 PNG thumbnail of the middle layer. Also writes the derived stack
+    files to the stacks directory, if set. Runs in a worker process.
+
+    Layers are written to a temporary file and renamed when complete, so layers that are present were fully written
+    before an interruption, and are not converted again.
+    """
+    layers = sorted(path for path in source.iterdir() if path.suffix.lower() in IMAGE_EXTENSIONS)
+    if not layers:
+        raise ValueError(f"No images in {source}")
+
+    target = prepared / f"o_{item_id}"
+    target.mkdir(parents=True, exist_ok=True)
+    for n, layer in enumerate(layers, start=1):
+        path = target / f"{item_id}_{n}.png"
+        if path.exists():
+            continue
+        temporary = path.with_name(path.name + ".tmp")
+        with Image.open(layer) as image:
+            image.save(temporary, format="PNG")
+        os.replace(temporary, path)
+
+    if stacks is not None:
+        write_stack_files(prepared, stacks, item_id)
+
+    with Image.open(layers[len(layers) // 2]) as image:
+        image.thumbnail((thumbnail_size, thumbnail_size))
+        thumbnail = BytesIO()
+        image.save(thumbnail, format="PNG")
+    return b64encode(thumbnail.getvalue()).decode()
+
+
+def _chunks(values: Sequence, size: int) -> Iterable[Sequence]:
+    return (values[start:start + size] for start in range(0, len(values), size))
+
+
+def _existing_ids(repository: PostgresqlDataRepository,
+                  orm_class: Type[ORMBase],
+                  key_columns: Sequence,
+                  keys: Iterable[tuple],
+                  joins: Sequence[tuple] = ()) -> Dict[tuple, UUID]:
+    """
+    Looks up the ids of existing rows by the values of their key columns, which may be columns of the joined tables
+    (joins holds the arguments of each Select.join).
+    """
+    ids = {}
+    with Session(repository.engine) as session:
+        for chunk in _chunks(list(keys), LOOKUP_SIZE):
+            query = select(orm_class.id, *key_columns)
+            for join in joins:
+                query = query.join(*join)
+            query = query.where(tuple_(*key_columns).in_(chunk))
+            ids.update({tuple(key): row_id for row_id, *key in session.execute(query)})
+    return ids
+
+
+def _ensure(repository: PostgresqlDataRepository,
+            orm_class: Type[ORMBase],
+            key_columns: Sequence,
+            new_rows: Dict[tuple, Callable[[UUID], BaseModel]],
+            add: Callable[[List[BaseModel]], object],
+            joins: Sequence[tuple] = (),
+            check: Optional[Callable[[List[tuple]], None]] = None) -> Dict[tuple, UUID]:
+    """
+    Returns the ids of the rows with the given keys (see _existing_ids). Rows that do not exist yet are created by
+    their factory in new_rows, and inserted with add, after check (if set) accepted their keys.
+    """
+    ids = _existing_ids(repository, orm_class, key_columns, new_rows, joins)
+    missing = {key: make(uuid4()) for key, make in new_rows.items() if key not in ids}
+    if missing:
+        if check is not None:
+            check(list(missing))
+        add(list(missing.values()))
+    ids.update({key: new_row.id for key, new_row in missing.items()})
+    return ids
+
+
+def _ensure_taxa(repository: PostgresqlDataRepository,
+                 orm_class: Type[ORMBase],
+                 new_taxa: Dict[Tuple[UUID, str], Callable[[UUID], BaseModel]],
+                 add: Callable[[List[BaseModel]], object],
+                 joins: Sequence[tuple] = ()) -> Dict[Tuple[UUID, str], UUID]:
+    """
+    Like _ensure, for families, genera or species keyed by (catalog id, name), like studies. The catalog id of genera
+    and species is that of their family, see joins. Taxon names are unique across all catalogs, so a missing taxon
+    whose name is used in another catalog is reported, rather than failing the insert of all taxa.
+    """
+    def check(keys: List[Tuple[UUID, str]]):
+        elsewhere = _existing_ids(repository, orm_class, [orm_class.name], {(name,) for _, name in keys})
+        if elsewhere:
+            raise ValueError(f"These {orm_class.__tablename__} names belong to another catalog: "
+                             f"{', '.join(sorted(name for name, in elsewhere))}")
+
+    return _ensure(repository, orm_class, [ORMFamily.catalog_id, orm_class.name], new_taxa, add, joins, check)
+
+
+def _add_each(add: Callable[[BaseModel], UUID]) -> Callable[[List[BaseModel]], None]:
+    """Adapts a single-row add method, for entries of which there are only a few, like catalogs and studies."""
+    return lambda new_rows: [add(new_row) for new_row in new_rows]
+
+
+def import_stacks(repository: PostgresqlDataRepository,
+                  manifest: Path,
+                  prepared: Path,
+                  stacks: Optional[Path] = None,
+                  workers: Optional[int] = None,
+                  batch_size: int = 500,
+                  thumbnail_size: int = 128,
+                  log: Callable[[str], None] = print) -> Tuple[int, int]:
+    """
+    Imports the image stacks in a manifest. Creates the missing catalogs, taxa, studies, samples and slides (catalogs
+    matched by name, taxa by name within their catalog, the others by description within their parent), converts the
+    stacks in a pool of worker processes and inserts the items in batches. Items that already exist are skipped, so an
+    interrupted import can simply be run again.
+    If stacks is set, the tile pyramids of the items are written there too, see write_stack_files.
+
+    Returns the number of imported and failed items.
+    """
+    rows = read_manifest(manifest)
+    source = manifest.parent
+    if stacks is not None:
+        stacks.mkdir(parents=True, exist_ok=True)
+
+    catalogs = _ensure(repository, ORMCatalog, [ORMCatalog.name], {
+        (row.catalog,): lambda new_id, row=row: Catalog(id=new_id, name=row.catalog)
+        for row in rows}, _add_each(repository.add_catalog))
+
+    def catalog_of(row: ManifestRow) -> UUID:
+        return catalogs[(row.catalog,)]
+
+    families = _ensure_taxa(repository, ORMFamily, {
+        (catalog_of(row), row.family): lambda new_id, row=row: Family(
+            id=new_id, name=row.family, catalog_id=catalog_of(row))
+        for row in rows}, repository.bulk_add_families)
+    genera = _ensure_taxa(repository, ORMGenus, {
+        (catalog_of(row), row.genus): lambda new_id, row=row: Genus(
+            id=new_id, name=row.genus, family_id=families[(catalog_of(row), row.family)], is_type=row.genus_is_type)
+        for row in rows if row.genus}, repository.bulk_add_genera,
+        joins=[(ORMFamily, ORMGenus.family_id == ORMFamily.id)])
+    species = _ensure_taxa(repository, ORMSpecies, {
+        (catalog_of(row), row.species): lambda new_id, row=row: Species(
+            id=new_id, name=row.species, genus_id=genera[(catalog_of(row), row.genus)], is_type=row.species_is_type)
+        for row in rows if row.species}, repository.bulk_add_species,
+        joins=[(ORMGenus, ORMSpecies.genus_id == ORMGenus.id), (ORMFamily, ORMGenus.family_id == ORMFamily.id)])
+
+    studies = _ensure(repository, ORMStudy, [ORMStudy.catalog_id, ORMStudy.description], {
+        (catalog_of(row), row.study): lambda new_id, row=row: Study(
+            id=new_id, description=row.study, location=row.study_location, remarks=row.study_remarks,
+            catalog_id=catalog_of(row), is_reference=row.study_is_reference)
+        for row in rows}, _add_each(repository.add_study))
+
+    def study_of(row: ManifestRow) -> UUID:
+        return studies[(catalog_of(row), row.study)]
+
+    samples = _ensure(repository, ORMSample, [ORMSample.study_id, ORMSample.description], {
+        (study_of(row), row.sample): lambda new_id, row=row: SampleCreateDTO(
+            id=new_id, description=row.sample, location=row.sample_location, age=row.sample_age,
+            remarks=row.sample_remarks, study_id=study_of(row))
+        for row in rows}, repository.bulk_add_samples)
+
+    def sample_of(row: ManifestRow) -> UUID:
+        return samples[(study_of(row), row.sample)]
+
+    slides = _ensure(repository, ORMSlide, [ORMSlide.sample_id, ORMSlide.description], {
+        (sample_of(row), row.slide): lambda new_id, row=row: SlideCreateDTO(
+            id=new_id, description=row.slide, remarks=row.slide_remarks, sample_id=sample_of(row))
+        for row in rows}, repository.bulk_add_slides)
+
+    existing = _existing_ids(repository, ORMItem, [ORMItem.id], [(row.item_id(),) for row in rows])
+    pending = {row.item_id(): row for row in rows if (row.item_id(),) not in existing}
+    log(f"Importing {len(pending)} of {len(rows)} items, {len(existing)} were imported before.")
+
+    imported, failed = 0, 0
+    batch: List[ItemCreateDTO] = []
+
+    def flush():
+        nonlocal imported
+        result: BulkInsertResult = repository.bulk_add_items(batch, skip_existing=True)
+        imported += len(result.ids)
+        batch.clear()
+        log(f"Imported {imported} items.")
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(prepare_stack, source / row.stack, prepared, stacks, item_id, thumbnail_size): item_id
+            for item_id, row in pending.items()}
+        for future in as_completed(futures):
+            item_id = futures[future]
+            row = pending[item_id]
+            try:
+                key_image = future.result()
+            except Exception as exc:
+                failed += 1
+                log(f"Failed to prepare {row.stack}: {exc}")
+                continue
+
+            batch.append(ItemCreateDTO(
+                id=item_id,
+                key_image=key_image,
+                family_id=None if row.genus else families[(catalog_of(row), row.family)],
+                genus_id=None if row.species or not row.genus else genera[(catalog_of(row), row.genus)],
+                species_id=species[(catalog_of(row), row.species)] if row.species else None,
+                comment=row.comment,
+                slide_id=slides[(sample_of(row), row.slide)],
+                voxel_width=row.voxel_width))
+            if len(batch) >= batch_size:
+                flush()
+
+    if batch:
+        flush()
+    return imported, failed
+
+
+def write_all_stack_files(prepared: Path,
+                          stacks: Path,
+                          workers: Optional[int] = None,
+                          log: Callable[[str], None] = print) -> Tuple[int, int]:
+    """
+    Writes the missing derived stack files of all items in the prepared layout, in a pool of worker processes.
+    Returns the number of processed and failed items.
+    """
+    item_ids = [UUID(directory.name[2:]) for directory in prepared.glob("o_*") if directory.is_dir()]
+    processed, failed = 0, 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(write_stack_files, prepared, stacks, item_id): item_id for item_id in item_ids}
+        for future in as_completed(futures):
+            try:
+                future.result()
+                processed += 1
+            except Exception as exc:
+                failed += 1
+                log(f"Failed to write the stack files of item {futures[future]}: {exc}")
+            if (processed + failed) % 100 == 0:
+                log(f"Processed {processed + failed} of {len(item_ids)} items, {failed} failed.")
+    return processed, failed
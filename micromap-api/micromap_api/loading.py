@@ -0,0 +1,47 @@
+from functools import lru_cache
+from typing import Optional, Tuple, Type, get_args, get_origin
+
+from pydantic import BaseModel
+from sqlalchemy import inspect
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm.interfaces import LoaderOption
+
+
+def _nested_model(annotation) -> Optional[Type[BaseModel]]:
+    """Returns the model in a field annotation like Slide, Optional[Slide] or List[Slide], or None if it has none."""
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return annotation
+    if get_origin(annotation) is not None:
+        for argument in get_args(annotation):
+            model = _nested_model(argument)
+            if model is not None:
+                return model
+    return None
+
+
+@lru_cache
+def load_options(orm_class: type, response_model: Optional[Type[BaseModel]]) -> Tuple[LoaderOption, ...]:
+    """
+    Returns the loading profile of a response model: the loader options that eagerly load exactly the relationships of
+    orm_class that are serialized by the response model, recursively. Many-to-one relationships are joined into the
+    same statement, collections are loaded with one extra SELECT ... IN per level. Without a response model, nothing
+    is loaded.
+    """
+    if response_model is None:
+        return ()
+
+    relationships = inspect(orm_class).relationships
+    options = []
+    for name, field in response_model.model_fields.items():
+        model = _nested_model(field.annotation)
+        if model is None or name not in relationships:
+            continue
+
+        relationship = relationships[name]
+        loader = selectinload if relationship.uselist else joinedload
+        option = loader(getattr(orm_class, name))
+        nested_options = load_options(relationship.mapper.class_, model)
+        options.append(option.options(*nested_options) if nested_options else option)
+
+    return tuple(options)
+
@@ -1,26 +1,48 @@
 import os
 from hashlib import sha256
-from typing import Optional, List, Sequence, Dict
-from uuid import UUID
+from pathlib import Path
+from inspect import iscoroutinefunction
+from typing import Optional, List, Literal, Sequence, Dict, Tuple, Union
+from uuid import UUID, uuid4
 
-from fastapi import FastAPI, Query, HTTPException, Depends, Security
+from fastapi import FastAPI, Query, HTTPException, Depends, Security, Response, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.routing import APIRoute, APIRouter
 from fastapi.security import APIKeyHeader
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.exc import OperationalError
 from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
 
-from .exceptions import KeyViolationException, EntityDoesNotExistException
+from .bulk import read_rows, NDJSON_MEDIA_TYPES
+from .exceptions import (KeyViolationException, BulkKeyViolationException, EntityDoesNotExistException,
+                         InvalidCursorException)
+from .pagination import encode_cursor, decode_cursor
+from .serialization import json_list, cached_json_list, json_response
+from .chunkfile import InvalidChunkFileException
+from .pyramid import open_pyramid
+from .stackfile import open_stack
 from .ormmodels import ORMItem, ORMFamily, ORMGenus, ORMSpecies, ORMStudy, ORMSample, ORMSlide, ORMCatalog
-from .postgresqldatarepository import PostgresqlDataRepository
+from .postgresqldatarepository import PostgresqlDataRepository, database_url, ITEM_ORDERS
+from .notifications import ChangeListener
+from .httpcache import ETagMiddleware
+from .replicas import ReplicaRoutingMiddleware, current_replica
+from .compression import CompressionMiddleware
+from .metrics import MetricsMiddleware, label_queries, render as render_metrics
+from .profiling import ProfileBuffer, ProfilingMiddleware, section
+from .asyncpostgresqldatarepository import AsyncPostgresqlDataRepository
 from .models import (Catalog, Family, Genus, Species, ItemCreateDTO, Item, Study, SampleCreateDTO, Sample,
-                     SlideCreateDTO, Slide)
+                     SlideCreateDTO, Slide, BulkInsertResult, StackInfo, DerivativeMetrics, TaxonSearchResult,
+                     PoolMetrics, RequestProfile)
 
 
 def generate_unique_id(route: APIRoute):
     return f"{route.name}"
 
+def valid_api_key(api_key: str) -> bool:
+    """Checks if the hash of the API key matches the one stored in the .env file."""
+    return sha256(api_key.encode()).hexdigest() == os.getenv("API_KEY_HASH")
+
 async def check_api_key(api_key: str = Security(APIKeyHeader(name='x-api-key', auto_error=False))):
     """
     Checks if the hash of the provided API key matches the one stored in the .env file.
@@ -29,7 +51,7 @@ async def check_api_key(api_key: str = Security(APIKeyHeader(name='x-api-key', a
     if api_key is None:
         raise HTTPException(status_code=401, detail="Missing API Key")
 
-    if sha256(api_key.encode()).hexdigest() != os.getenv("API_KEY_HASH"):
+    if not valid_api_key(api_key):
         raise HTTPException(status_code=401, detail="Invalid API Key")
 
 # Define a public and secure route. The secure route checks the API key with check_api_key.
@@ -41,28 +63,162 @@ app = FastAPI(
     generate_unique_id_function=generate_unique_id,
 )
 
+def data_version(catalog_id: Optional[UUID]) -> Optional[int]:
+    """
+    Returns the data version of the database that serves the reads of this request: a replica or the primary. The
+    version of the primary is None while the change listener does not listen, since it may miss changes.
+    """
+    replica = current_replica.get()
+    if replica is not None:
+        return replica.version(catalog_id)
+    return repository.data_versions.current(catalog_id)
+
+
+# The read-only GET routes, which are validated by data version and may read from a replica.
+READ_ONLY_PATHS = ["/catalogs/", "/families/", "/families/count/", "/genera/", "/genera/letter/*", "/genera/count/",
+                   "/species/", "/species/count/", "/studies/", "/samples/", "/slides/", "/items/", "/items/count/",
+                   "/search/"]
+# The routes that read only the catalog of their catalog_id parameter, validated by the data version of that catalog.
+CATALOG_PATHS = ["/families/", "/species/", "/studies/", "/search/"]
+
+# Added before the CORS middleware, which must also add its headers to the 304 responses.
+app.add_middleware(
+    ETagMiddleware,
+    version=data_version,
+    paths=READ_ONLY_PATHS,
+    catalog_paths=CATALOG_PATHS,
+    cache_control=os.getenv("API_CACHE_CONTROL", "public, no-cache"),
+)
+# Added after the ETag middleware, whose ETags depend on the replica chosen by this one.
+app.add_middleware(
+    ReplicaRoutingMiddleware,
+    replicas=lambda: None if repository is None else repository.replicas,
+    paths=READ_ONLY_PATHS,
+    version=lambda: repository.data_versions.get(None),
+    cookie_max_age=int(os.getenv("DB_REPLICA_COOKIE_MAX_AGE", "300")),
+)
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1000")),
+    gzip_level=int(os.getenv("GZIP_LEVEL", "6")),
+    brotli_quality=int(os.getenv("BROTLI_QUALITY", "4")),
+)
+# Added after the compression middleware, so it measures the size of the responses as sent.
+app.add_middleware(MetricsMiddleware, routes=lambda: app.routes)
+# Profiles the requests with an X-Profile header that carries the API key, or all requests if PROFILE_REQUESTS is set.
+slow_requests = ProfileBuffer(size=int(os.getenv("PROFILE_BUFFER_SIZE", "100")))
+app.add_middleware(
+    ProfilingMiddleware,
+    buffer=slow_requests,
+    authorized=valid_api_key,
+    profile_all=bool(int(os.getenv("PROFILE_REQUESTS", "0"))),
+    slow_request_ms=float(os.getenv("PROFILE_SLOW_REQUEST_MS", "500")),
+    slow_statement_ms=float(os.getenv("PROFILE_SLOW_STATEMENT_MS", "100")),
+    explain=bool(int(os.getenv("PROFILE_EXPLAIN", "1"))),
+    explain_all=bool(int(os.getenv("PROFILE_EXPLAIN_ALL", "0"))),
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=os.getenv("CORS_ORIGINS", "").split(", "),
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Focus-Levels"],
 )
 app.add_middleware(ProxyHeadersMiddleware, trusted_hosts=os.getenv("PROXY_SERVER", ""))
 
 
 # Try to connect to the database. Allow the API to run without a database connection in BUILD_MODE, since we only
 # require the API to serve the OpenAPI JSON specification.
+# The async repository (ASYNC_DB=1) does not block the event loop while waiting for the database. Its tables are
+# created on startup, since that requires a running event loop.
 try:
-    repository = PostgresqlDataRepository()
-    repository.create_database()  # Create all tables. Will not attempt to recreate tables already present.
+    if int(os.getenv("ASYNC_DB", "0")):
+        repository = AsyncPostgresqlDataRepository()
+    else:
+        repository = PostgresqlDataRepository()
+        repository.create_database()  # Create all tables. Will not attempt to recreate tables already present.
 except OperationalError as exc:
     if int(os.getenv("BUILD_MODE", "0")):
         print("Error connecting to the database: ", exc, flush=True)
+        repository = None
     else:
         raise exc
 
 
+# Every worker listens for the changes made by other workers and containers, to keep its caches and data versions
+# consistent.
+change_listener = None
+if repository is not None:
+    change_listener = ChangeListener(
+        database_url(direct=True),
+        on_change=lambda catalog_id: repository.taxonomy_cache.invalidate(catalog_id),
+        on_version=lambda catalog_id, version: repository.data_versions.update({catalog_id: version}),
+        on_listening=lambda listening: repository.data_versions.set_known(listening))
+
+
+@app.on_event("startup")
+async def startup():
+    if repository is None:
+        return
+    if isinstance(repository, AsyncPostgresqlDataRepository):
+        await repository.create_database()  # Create all tables. Will not attempt to recreate tables already present.
+    change_listener.start()
+    if repository.replicas is not None:
+        repository.replicas.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    if repository is None:
+        return
+    change_listener.stop()
+    if repository.replicas is not None:
+        repository.replicas.stop()
+    if isinstance(repository, AsyncPostgresqlDataRepository):
+        await repository.dispose()
+
+
+async def run(method, *args, **kwargs):
+    """
+    Calls a repository method without blocking the event loop: methods of the async repository are awaited, blocking
+    methods of the synchronous repository are run in the thread pool. Its SQL statements are measured by method name.
+    """
+    label_queries(method.__name__)
+    with section("repository"):
+        if iscoroutinefunction(method):
+            return await method(*args, **kwargs)
+        return await run_in_threadpool(method, *args, **kwargs)
+
+
+def bulk_request_body(model) -> dict:
+    """Documents the body of a bulk route, which reads its rows itself (see read_rows), in the OpenAPI specification."""
+    schema = {"type": "array", "items": {"$ref": f"#/components/schemas/{model.__name__}"}}
+    content = {"application/json": {"schema": schema}}
+    content.update({media_type: {"schema": schema["items"]} for media_type in sorted(NDJSON_MEDIA_TYPES)})
+    return {"requestBody": {"required": True, "content": content}}
+
+
+async def bulk_insert(request: Request, model, method, skip_existing: bool) -> BulkInsertResult:
+    """
+    Inserts the rows of a bulk request in one transaction with a bulk repository method. Reports the errors of every
+    offending row, so the client can fix them and retry the whole request.
+    """
+    rows = await read_rows(request, model, int(os.getenv("BULK_MAX_ROWS", "10000")))
+    try:
+        return await run(method, rows, skip_existing)
+    except BulkKeyViolationException as e:
+        raise HTTPException(status_code=409,
+                            detail=[{"row": index, "detail": detail} for index, detail in sorted(e.errors.items())])
+    except KeyViolationException as e:
+        raise HTTPException(status_code=409, detail=e.detailed_message)
+
+
+BULK_DESCRIPTION = ("The body is a JSON array or NDJSON (one row per line), inserted in one transaction. Rows with "
+                    "an existing id or name are skipped with skip_existing, otherwise nothing is inserted and the "
+                    "409 response lists the offending rows by their 0-based index.")
+
+
 @app.exception_handler(Exception)
 async def global_exception_handler(request_, e: Exception):
     error_type = f"{e.__class__.__module__}.{e.__class__.__name__}"
@@ -76,7 +232,9 @@ async def get_root():
 
 @public.get("/items/",
             response_model=List[Item],
-            description="Gets all items for the specified family, genus or species.")
+            description="Gets all items for the specified family, genus or species, and/or study, sample or slide. If "
+                        "there may be more results, the X-Next-Cursor response header contains the cursor for the next "
+                        "page.")
 async def get_items(
         family_id: Optional[str] = Query(default=None),
         genus_id: Optional[str] = Query(default=None),
@@ -87,10 +245,12 @@ async def get_items(
         study: Optional[str] = Query(default=None),
         sample: Optional[str] = Query(default=None),
         slide: Optional[str] = Query(default=None),
-        order: str = os.environ.get('DEFAULT_ORDER', 'abundance'),
+        order: Literal[ITEM_ORDERS] = os.environ.get('DEFAULT_ORDER', 'abundance'),
         max_results: int = Query(default=100),
-        page: int = Query(default=1)
-) -> List[ORMItem]:
+        page: int = Query(default=1),
+        cursor: Optional[str] = Query(default=None, description="Cursor from X-Next-Cursor. Overrides page."),
+        seed: int = Query(default=0, description="Seed of the random order.")
+) -> Response:
     """
     Use:
     This function get the items we use to show the thumbnails
@@ -111,12 +271,15 @@ async def get_items(
     :param include_genus_type: Include genus types.
     :param include_species_type: Include species types.
     :param reference_only: Only include items from reference studies.
-    :param study: A specific study. - TODO: not used yet
-    :param sample: A specific sample in a study. - TODO: not used yet
-    :param slide: A specific slide in a sample. - TODO: not used yet
-    :param order: The order in which the results are returned. - TODO: not used yet
+    :param study: A specific study.
+    :param sample: A specific sample in a study.
+    :param slide: A specific slide in a sample.
+    :param order: The order in which the results are returned: by the most abundant taxon, by taxon name, in a seeded
+                  random order, or by id.
     :param max_results: Maximum number of results returned.
     :param page: The page number of the results.
+    :param cursor: The X-Next-Cursor header value of the previous page. Deep pages cost the same as the first one.
+    :param seed: The seed of the random order. Pages of the same seed are in the same order.
     :return: A dictionary with matches.
     """
     # Build search query
@@ -125,89 +288,303 @@ async def get_items(
     # Calculate offset
     offset = (page - 1) * max_results
 
-    # Fetch results based on available filters
-    if species_id:
-        return repository.get_items(
-            species_id=species_id,
-            include_species_type=include_species_type,
-            reference_only=reference_only,
-            max_results=max_results,
-            offset=offset)
-    elif genus_id:
-        return repository.get_items(
+    try:
+        after = decode_cursor(cursor) if cursor else None
+
+        items = await run(
+            repository.get_items,
+            family_id=family_id,
             genus_id=genus_id,
+            species_id=species_id,
             include_genus_type=include_genus_type,
+            include_species_type=include_species_type,
             reference_only=reference_only,
+            study_id=study,
+            sample_id=sample,
+            slide_id=slide,
+            order=order,
+            seed=seed,
             max_results=max_results,
-            offset=offset)
-    elif family_id:
-        return repository.get_items(
-            family_id=family_id,
-            reference_only=reference_only,
-            max_results=max_results,
-            offset=offset)
-    else:
-        # TODO: Search on database level.
-        pass
+            offset=offset,
+            after=after,
+            response_model=Item)
+    except InvalidCursorException:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+    # A full page means there may be more results.
+    headers = {}
+    if items and len(items) == max_results:
+        headers["X-Next-Cursor"] = encode_cursor(*PostgresqlDataRepository.get_item_sort_key(items[-1]))
+
+    return json_response(json_list(Item, items), headers)
+
+@public.get("/items/count/",
+            description="Counts the items of a family, genus or species (including those of its descendants), and/or "
+                        "study, from the precomputed statistics.")
+async def get_item_count(
+        family_id: Optional[str] = None,
+        genus_id: Optional[str] = None,
+        species_id: Optional[str] = None,
+        study: Optional[str] = None,
+        reference_only: bool = False) -> Dict[str, int]:
+    count = await run(repository.get_item_count, family_id, genus_id, species_id, study, reference_only)
+    return {"count": count}
+
+def byte_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Returns the start and (exclusive) end of a single byte range (bytes=start-end, bytes=start- or bytes=-suffix), or
+    None to send the whole content, e.g. for multiple ranges. Raises a 416 if the range is not satisfiable.
+    """
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start, _, end = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if start:
+            first, last = int(start), int(end) if end else size - 1
+        else:
+            first, last = max(size - int(end), 0), size - 1
+    except ValueError:
+        return None
+    if first >= size or last < first:
+        raise HTTPException(status_code=416, detail="Range not satisfiable.",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return first, min(last, size - 1) + 1
+
+class BufferResponse(Response):
+    """A response whose body may be a memoryview, e.g. of a memory-mapped file, which is sent without copying it."""
+    def render(self, content) -> bytes:
+        return content if isinstance(content, memoryview) else super().render(content)
+
+def image_response(image: Union[bytes, memoryview],
+                   if_none_match: Optional[str],
+                   range_header: Optional[str] = None,
+                   media_type: str = "image/png",
+                   digest: Optional[str] = None) -> Response:
+    """
+    Returns a cacheable image response, or 304 Not Modified if the request's If-None-Match matches. The ETag is a
+    strong validator of the image itself, so browsers and proxies can cache every image separately: its SHA-256
+    digest, computed here unless given. Sends 206 Partial Content if a single byte range is requested.
+    """
+    etag = f'"{digest or sha256(image).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={os.getenv('THUMBNAIL_MAX_AGE', '86400')}",
+               "Accept-Ranges": "bytes"}
+    if if_none_match and (if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+
+    requested = byte_range(range_header, len(image))
+    if requested is not None:
+        start, end = requested
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{len(image)}"
+        return BufferResponse(content=image[start:end], status_code=206, media_type=media_type, headers=headers)
+    return BufferResponse(content=image, media_type=media_type, headers=headers)
+
+@public.get("/items/{item_id}/thumbnail",
+            response_class=Response,
+            responses={200: {"content": {"image/png": {}}}, 304: {"description": "Not modified."}},
+            description="Gets the PNG thumbnail of an item. Supports conditional requests with If-None-Match.")
+async def get_item_thumbnail(item_id: UUID, if_none_match: Optional[str] = Header(default=None)):
+    try:
+        thumbnail = await run(repository.get_thumbnail, item_id)
+    except EntityDoesNotExistException:
+        raise HTTPException(status_code=404, detail="Item does not exist.")
+    if thumbnail is None:
+        raise HTTPException(status_code=404, detail="Item has no thumbnail.")
 
-    return []
+    return image_response(thumbnail, if_none_match)
+
+
+# Stack files and tile pyramids of the focus stacks, written by `micromap-api import --stacks` or `micromap-api stacks`.
+STACK_PATH = Path(os.getenv("STACK_PATH", "stacks"))
+
+@public.get("/items/{item_id}/stack",
+            response_model=StackInfo,
+            description="Gets the size, focus levels and resolution levels of the tile pyramid of an item.")
+async def get_item_stack(item_id: UUID):
+    try:
+        pyramid = await run_in_threadpool(open_pyramid, STACK_PATH, item_id)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Item has no tile pyramid.")
+    except InvalidChunkFileException:
+        raise HTTPException(status_code=500, detail="The tile pyramid of the item is invalid.")
+    return pyramid.info()
+
+@public.get("/items/{item_id}/stack/stream",
+            response_class=StreamingResponse,
+            responses={200: {"content": {"multipart/mixed": {}}}},
+            description="Streams all focus levels from the stack file of an item as multipart/mixed, starting with "
+                        "level `first` (default: the middle level), followed by the others in order of their distance "
+                        "to it. Each part has Content-Length and X-Focus-Level headers, and the X-Focus-Levels "
+                        "response header holds the number of focus levels.")
+async def get_item_stack_stream(item_id: UUID, first: Optional[int] = Query(default=None)):
+    try:
+        stack = await run_in_threadpool(open_stack, STACK_PATH, item_id)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Item has no stack file.")
+    except InvalidChunkFileException:
+        raise HTTPException(status_code=500, detail="The stack file of the item is invalid.")
+
+    boundary = uuid4().hex
+
+    async def parts():
+        for z in stack.nearest_first(stack.depth // 2 if first is None else first):
+            image = stack.slice(z)
+            yield (f"--{boundary}\r\nContent-Type: {stack.media_type}\r\nContent-Length: {len(image)}\r\n"
+                   f"X-Focus-Level: {z}\r\n\r\n").encode()
+            yield bytes(image) + b"\r\n"
+        yield f"--{boundary}--\r\n".encode()
+
+    return StreamingResponse(parts(), media_type=f"multipart/mixed; boundary={boundary}", headers={
+        "X-Focus-Levels": str(stack.depth),
+        "Cache-Control": f"public, max-age={os.getenv('THUMBNAIL_MAX_AGE', '86400')}"})
+
+# Registered after /items/{item_id}/stack/stream, which would otherwise match as an invalid focus level.
+@public.get("/items/{item_id}/stack/{z}",
+            response_class=Response,
+            responses={200: {"content": {"image/png": {}}},
+                       206: {"description": "Partial content."},
+                       304: {"description": "Not modified."}},
+            description="Gets the full resolution image of focus level z from the stack file of an item. Supports "
+                        "conditional requests with If-None-Match and single byte ranges.")
+async def get_item_stack_slice(item_id: UUID, z: int,
+                               if_none_match: Optional[str] = Header(default=None),
+                               range_header: Optional[str] = Header(default=None, alias="Range")):
+    try:
+        stack = await run_in_threadpool(open_stack, STACK_PATH, item_id)
+        image = stack.slice(z)
+        digest = stack.digest(z)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Item has no stack file.")
+    except InvalidChunkFileException:
+        raise HTTPException(status_code=500, detail="The stack file of the item is invalid.")
+    except IndexError:
+        raise HTTPException(status_code=404, detail="Focus level does not exist.")
+
+    # Served from the memory-mapped file, without copying the image or hashing it again.
+    return image_response(image, if_none_match, range_header, stack.media_type, digest)
+
+@public.get("/items/{item_id}/stack/{z}/{level}/{x}/{y}",
+            response_class=Response,
+            responses={200: {"content": {"image/png": {}}}, 304: {"description": "Not modified."}},
+            description="Gets a PNG tile of focus level z. Resolution level 0 is the full resolution, every next level "
+                        "halves the size. x and y are the tile column and row.")
+async def get_item_stack_tile(item_id: UUID, z: int, level: int, x: int, y: int,
+                              if_none_match: Optional[str] = Header(default=None)):
+    try:
+        pyramid = await run_in_threadpool(open_pyramid, STACK_PATH, item_id)
+        tile = bytes(pyramid.tile(z, level, x, y))
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Item has no tile pyramid.")
+    except InvalidChunkFileException:
+        raise HTTPException(status_code=500, detail="The tile pyramid of the item is invalid.")
+    except IndexError:
+        raise HTTPException(status_code=404, detail="Tile does not exist.")
+
+    return image_response(tile, if_none_match)
 
 @secure.post("/items/",
              status_code=201,
-             description="Adds a new item. The id can either be set or generated if null.")
+             description="Adds a new item. The id can either be set or generated if null. If the key image is null, "
+                         "the thumbnail is derived from the item's stack file by `micromap-api worker`.")
 async def post_item(item: ItemCreateDTO) -> Dict[str, UUID]:
     try:
-        return {"id": repository.add_item(item)}
+        return {"id": await run(repository.add_item, item)}
     except KeyViolationException as e:
         raise HTTPException(status_code=409, detail=e.detailed_message)
 
+@secure.post("/items/bulk",
+             status_code=201,
+             openapi_extra=bulk_request_body(ItemCreateDTO),
+             description="Adds many items. " + BULK_DESCRIPTION)
+async def post_items_bulk(request: Request, skip_existing: bool = Query(default=False)) -> BulkInsertResult:
+    return await bulk_insert(request, ItemCreateDTO, repository.bulk_add_items, skip_existing)
+
+@secure.get("/derivatives/metrics",
+            response_model=List[DerivativeMetrics],
+            description="Gets the number of queued, running, done and failed derivative jobs per kind (thumbnail or "
+                        "pyramid), and the timings of the done jobs in milliseconds.")
+async def get_derivative_metrics() -> List[DerivativeMetrics]:
+    return await run(repository.get_derivative_metrics)
+
+@secure.get("/pool/metrics",
+            response_model=List[PoolMetrics],
+            description="Gets the state of the database connection pools of the worker process that handles the "
+                        "request, of the primary first and then of the read replicas, and how long their connection "
+                        "checkouts waited, in milliseconds. Every worker has its own pools.")
+async def get_pool_metrics() -> List[PoolMetrics]:
+    return await run(repository.get_pool_metrics)
+
+@secure.get("/metrics",
+            response_class=Response,
+            responses={200: {"content": {"text/plain": {}}}},
+            description="Gets the Prometheus metrics of all worker processes: request durations and response sizes per "
+                        "route, SQL statement durations per repository method, the connection pools and the cache "
+                        "hits and misses.")
+async def get_metrics() -> Response:
+    content, media_type = await run_in_threadpool(render_metrics)  # Reads the files of all processes.
+    return Response(content, headers={"Content-Type": media_type})
+
+@secure.get("/debug/slow",
+            response_model=List[RequestProfile],
+            description="Gets the most recent profiled requests of the worker process that handles the request, most "
+                        "recent first: those profiled with an X-Profile header carrying the API key, and the slow ones "
+                        "if PROFILE_REQUESTS is set. Durations are in milliseconds.")
+async def get_slow_requests() -> List[RequestProfile]:
+    return slow_requests.recent()
+
 
 @public.get("/catalogs/", response_model=Sequence[Catalog], description="Gets all catalogs.")
-async def get_catalogs() -> Sequence[ORMCatalog]:
-    return repository.get_catalogs()
+async def get_catalogs() -> Response:
+    return json_response(json_list(Catalog, await run(repository.get_catalogs)))
 
 @secure.post("/catalogs/",
              status_code=201,
              description="Adds a new catalog. The id can either be set or generated if null.")
 async def post_catalog(catalog: Catalog) -> Dict[str, UUID]:
     try:
-        return {"id": repository.add_catalog(catalog)}
+        return {"id": await run(repository.add_catalog, catalog)}
     except KeyViolationException as e:
         raise HTTPException(status_code=409, detail=e.detailed_message)
 
 @secure.put("/catalogs/", status_code=200)
 async def put_catalog(catalog: Catalog):
     try:
-        repository.update_catalog(catalog)
+        await run(repository.update_catalog, catalog)
     except EntityDoesNotExistException:
         return HTTPException(status_code=404, detail="Catalog does not exist.")
     return
 
 
 @public.get("/families/", response_model=Sequence[Family], description="Gets all families in a catalog.")
-async def get_families(catalog_id: str) -> Sequence[ORMFamily]:
-    return repository.get_families(catalog_id)
+async def get_families(catalog_id: str) -> Response:
+    return json_response(cached_json_list(Family, await run(repository.get_families, catalog_id)))
 
 @secure.post("/families/",
              status_code=201,
              description="Adds a new family to a catalog. The id can either be set or generated if null.")
 async def post_family(family: Family) -> Dict[str, UUID]:
     try:
-        return {"id": repository.add_family(family)}
+        return {"id": await run(repository.add_family, family)}
     except KeyViolationException as e:
         raise HTTPException(status_code=409, detail=e.detailed_message)
 
+@secure.post("/families/bulk",
+             status_code=201,
+             openapi_extra=bulk_request_body(Family),
+             description="Adds many families. " + BULK_DESCRIPTION)
+async def post_families_bulk(request: Request, skip_existing: bool = Query(default=False)) -> BulkInsertResult:
+    return await bulk_insert(request, Family, repository.bulk_add_families, skip_existing)
+
 @secure.put("/families/", status_code=200)
 async def put_family(family: Family):
     try:
-        repository.update_family(family)
+        await run(repository.update_family, family)
     except EntityDoesNotExistException:
         return HTTPException(status_code=404, detail="Family does not exist.")
     return
 
 @public.get("/families/count/")
 async def get_family_count():
-    num =  repository.get_family_count()
+    num =  await run(repository.get_family_count)
     return {"count": num}
 
 # #not used
@@ -221,8 +598,8 @@ async def get_family_count():
 @public.get("/genera/", response_model=Sequence[Genus], description="Gets all genera in a family.")
 async def get_genera(
         family_id: str,
-        include_type: bool = Query(True, description="Include -type genera.")) -> Sequence[ORMGenus]:
-    return repository.get_genera(family_id, include_type)
+        include_type: bool = Query(True, description="Include -type genera.")) -> Response:
+    return json_response(cached_json_list(Genus, await run(repository.get_genera, family_id, include_type)))
 
 # @public.get("/genera_for_alphabetical/")
 # def get_genera_for_alphabetical():
@@ -234,14 +611,21 @@ async def get_genera(
              description="Adds a new genus to a family. The id can either be set or generated if null.")
 async def post_genus(genus: Genus) -> Dict[str, UUID]:
     try:
-        return {"id": repository.add_genus(genus)}
+        return {"id": await run(repository.add_genus, genus)}
     except KeyViolationException as e:
         raise HTTPException(status_code=409, detail=e.detailed_message)
 
+@secure.post("/genera/bulk",
+             status_code=201,
+             openapi_extra=bulk_request_body(Genus),
+             description="Adds many genera. " + BULK_DESCRIPTION)
+async def post_genera_bulk(request: Request, skip_existing: bool = Query(default=False)) -> BulkInsertResult:
+    return await bulk_insert(request, Genus, repository.bulk_add_genera, skip_existing)
+
 @secure.put("/genera/", status_code=200)
 async def put_genus(genus: Genus):
     try:
-        repository.update_genus(genus)
+        await run(repository.update_genus, genus)
     except EntityDoesNotExistException:
         return HTTPException(status_code=404, detail="Genus does not exist.")
     return
@@ -249,91 +633,123 @@ async def put_genus(genus: Genus):
 @public.get("/genera/letter/{letter}")
 async def get_genera_by_letter(letter: str, include_genus_type: bool = True):
     """Return GENERA by capital first letter, for alphabetical search, removes if_genus_is_type"""
-    genera_list = repository.get_genera_by_letter(letter, include_genus_type)
+    genera_list = await run(repository.get_genera_by_letter, letter, include_genus_type)
     return genera_list
 
+@public.get("/search/",
+            response_model=Sequence[TaxonSearchResult],
+            description="Searches families, genera and species by name, with prefix and typo-tolerant matching, best "
+                        "match first.")
+async def search(
+        q: str = Query(min_length=2, max_length=100, description="(Part of) a taxon name."),
+        catalog_id: Optional[UUID] = None,
+        max_results: int = Query(20, ge=1, le=100)) -> Response:
+    return json_response(json_list(TaxonSearchResult, await run(repository.search_taxa, q, catalog_id, max_results)))
+
 @public.get("/genera/count/")
 async def get_genera_count():
-    num =  repository.get_genera_count()
+    num =  await run(repository.get_genera_count)
     return {"count": num}
 
 
 @public.get("/species/",
             response_model=Sequence[Species],
             description="Gets all species in a genus or all species in the catalog.")
-async def get_species(genus_id: Optional[str] = None, catalog_id: Optional[str] = None) -> Sequence[ORMSpecies]:
+async def get_species(genus_id: Optional[str] = None, catalog_id: Optional[str] = None) -> Response:
     """ returns species according to genus_id used in species drop down and alphabetical search"""
     if genus_id:
-        return repository.get_species(genus_id)
-    if catalog_id:
-        return repository.get_species_in_catalog(catalog_id)
+        species = await run(repository.get_species, genus_id)
+    elif catalog_id:
+        species = await run(repository.get_species_in_catalog, catalog_id)
     else:
-        return []
+        species = []
+    return json_response(cached_json_list(Species, species))
 
 @secure.post("/species/",
              status_code=201,
              description="Adds a new species to a genus. The id can either be set or generated if null.")
 async def post_species(species: Species) -> Dict[str, UUID]:
     try:
-        return {"id": repository.add_species(species)}
+        return {"id": await run(repository.add_species, species)}
     except KeyViolationException as e:
         raise HTTPException(status_code=409, detail=e.detailed_message)
 
+@secure.post("/species/bulk",
+             status_code=201,
+             openapi_extra=bulk_request_body(Species),
+             description="Adds many species. " + BULK_DESCRIPTION)
+async def post_species_bulk(request: Request, skip_existing: bool = Query(default=False)) -> BulkInsertResult:
+    return await bulk_insert(request, Species, repository.bulk_add_species, skip_existing)
+
 @secure.put("/species/", status_code=200)
 async def put_species(species: Species):
     try:
-        repository.update_species(species)
+        await run(repository.update_species, species)
     except EntityDoesNotExistException:
         return HTTPException(status_code=404, detail="Species does not exist.")
     return
 
 @public.get("/species/count/")
 async def get_species_count():
-    num =  repository.get_species_count()
+    num =  await run(repository.get_species_count)
     return {"count": num}
 
 
 @public.get("/studies/", response_model=Sequence[Study], description="Gets all studies in the catalog.")
-async def get_studies(catalog_id: str) -> Sequence[ORMStudy]:
-    return repository.get_studies(catalog_id)
+async def get_studies(catalog_id: str) -> Response:
+    return json_response(json_list(Study, await run(repository.get_studies, catalog_id)))
 
 @secure.post("/studies/",
              status_code=201,
              description="Adds a new study to a catalog. The id can either be set or generated if null.")
 async def post_study(study: Study) -> Dict[str, UUID]:
     try:
-        return {"id": repository.add_study(study)}
+        return {"id": await run(repository.add_study, study)}
     except KeyViolationException as e:
         raise HTTPException(status_code=409, detail=e.detailed_message)
 
 
 @public.get("/samples/", response_model=Sequence[Sample], description="Gets all samples in a study.")
-async def get_samples(study_id: str) -> Sequence[ORMSample]:
-    return repository.get_samples(study_id)
+async def get_samples(study_id: str) -> Response:
+    return json_response(json_list(Sample, await run(repository.get_samples, study_id, Sample)))
 
 @secure.post("/samples/",
              status_code=201,
              description="Adds a new sample to a study. The id can either be set or generated if null.")
 async def post_sample(sample: SampleCreateDTO) -> Dict[str, UUID]:
     try:
-        return {"id": repository.add_sample(sample)}
+        return {"id": await run(repository.add_sample, sample)}
     except KeyViolationException as e:
         raise HTTPException(status_code=409, detail=e.detailed_message)
 
+@secure.post("/samples/bulk",
+             status_code=201,
+             openapi_extra=bulk_request_body(SampleCreateDTO),
+             description="Adds many samples. " + BULK_DESCRIPTION)
+async def post_samples_bulk(request: Request, skip_existing: bool = Query(default=False)) -> BulkInsertResult:
+    return await bulk_insert(request, SampleCreateDTO, repository.bulk_add_samples, skip_existing)
+
 
 @public.get("/slides/", response_model=Sequence[Slide], description="Gets all slides in a sample.")
-async def get_slides(sample_id: str) -> Sequence[ORMSlide]:
-    return repository.get_slides(sample_id)
+async def get_slides(sample_id: str) -> Response:
+    return json_response(json_list(Slide, await run(repository.get_slides, sample_id, Slide)))
 
 @secure.post("/slides/",
              status_code=201,
              description="Adds a new slide to a sample. The id can either be set or generated if null.")
 async def post_slide(slide: SlideCreateDTO) -> Dict[str, UUID]:
     try:
-        return {"id": repository.add_slide(slide)}
+        return {"id": await run(repository.add_slide, slide)}
     except KeyViolationException as e:
         raise HTTPException(status_code=409, detail=e.detailed_message)
 
+@secure.post("/slides/bulk",
+             status_code=201,
+             openapi_extra=bulk_request_body(SlideCreateDTO),
+             description="Adds many slides. " + BULK_DESCRIPTION)
+async def post_slides_bulk(request: Request, skip_existing: bool = Query(default=False)) -> BulkInsertResult:
+    return await bulk_insert(request, SlideCreateDTO, repository.bulk_add_slides, skip_existing)
+
 
 app.include_router(public)
 app.include_router(secure)
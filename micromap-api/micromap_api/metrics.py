@@ -0,0 +1,118 @@
+import os
+import time
+from contextvars import ContextVar
+from typing import Callable, Sequence, Tuple
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.routing import BaseRoute, Match
+
+# Prometheus metrics of this process. With several worker processes (gunicorn), PROMETHEUS_MULTIPROC_DIR must be set to
+# an empty directory before the workers start, where every process writes its metrics. GET /metrics then aggregates
+# the metrics of all processes, see render.
+
+# What the SQL statements of the current request are measured as: the repository method that runs them (see
+# main.run), or a finer label set by the method itself, like the branch of get_items.
+query_label: ContextVar[str] = ContextVar("query_label", default="other")
+
+REQUEST_DURATION = Histogram(
+    "micromap_request_duration_seconds", "Duration of the HTTP requests, by route.", ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+RESPONSE_SIZE = Histogram(
+    "micromap_response_size_bytes", "Size of the response bodies as sent, so after compression, by route.",
+    ["method", "route"], buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216))
+SQL_DURATION = Histogram(
+    "micromap_sql_duration_seconds", "Duration of the SQL statements, by repository method or query.", ["query"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+SQL_ERRORS = Counter("micromap_sql_errors", "SQL statements that failed, by repository method or query.", ["query"])
+POOL_CONNECTIONS = Gauge(
+    "micromap_pool_connections", "Database connections of the pools, by server and state (open or checked_out).",
+    ["server", "state"], multiprocess_mode="livesum")
+POOL_WAIT = Histogram(
+    "micromap_pool_wait_seconds", "Time spent waiting for a pooled database connection.",
+    buckets=(0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0))
+POOL_TIMEOUTS = Counter("micromap_pool_timeouts", "Checkouts that gave up waiting for a database connection.")
+CACHE_REQUESTS = Counter(
+    "micromap_cache_requests", "Lookups of the in-process taxonomy cache, by kind of entry and result (hit or miss).",
+    ["cache", "result"])
+
+
+def label_queries(label: str):
+    """Measures the following SQL statements of this request (or thread) as the given query."""
+    query_label.set(label)
+
+
+def instrument(engine: Engine):
+    """Measures the duration of the SQL statements of an engine, and the state of its connection pool."""
+    server = f"{engine.url.host}:{engine.url.port or 5432}"
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        context.metrics_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        SQL_DURATION.labels(query_label.get()).observe(time.perf_counter() - context.metrics_start)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        SQL_ERRORS.labels(query_label.get()).inc()
+
+    open_connections = POOL_CONNECTIONS.labels(server, "open")
+    checked_out = POOL_CONNECTIONS.labels(server, "checked_out")
+    event.listen(engine, "connect", lambda *args: open_connections.inc())
+    event.listen(engine, "close", lambda *args: open_connections.dec())
+    event.listen(engine, "checkout", lambda *args: checked_out.inc())
+    event.listen(engine, "checkin", lambda *args: checked_out.dec())
+
+
+def render() -> Tuple[bytes, str]:
+    """Returns the metrics (of all worker processes) in the Prometheus text format, and its media type."""
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that measures the duration and the response size of each request, by the path (template) of its
+    route. Responses that did not reach the router, like 304 Not Modified of the ETagMiddleware, are matched with the
+    given routes.
+    """
+    def __init__(self, app, routes: Callable[[], Sequence[BaseRoute]]):
+        self.app = app
+        self.routes = routes
+
+    def route(self, scope) -> str:
+        route = scope.get("route")
+        if route is None:
+            route = next((route for route in self.routes() if route.matches(scope)[0] != Match.NONE), None)
+        return getattr(route, "path", "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+        size = 0
+
+        async def send_measured(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_measured)
+        finally:
+            route = self.route(scope)
+            REQUEST_DURATION.labels(scope["method"], route, str(status)).observe(time.perf_counter() - start)
+            RESPONSE_SIZE.labels(scope["method"], route).observe(size)
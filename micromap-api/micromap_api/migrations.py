@@ -0,0 +1,140 @@
+from typing import List, NamedTuple, Sequence
+
+from sqlalchemy import Connection, Engine, text
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    statements: Sequence[str]
+
+
+# Schema changes to existing databases, in order. New databases get the current schema from the ORM models (create_all),
+# so every statement must also be harmless on a schema that is already up-to-date. Never change a released migration;
+# add a new one instead.
+MIGRATIONS: List[Migration] = [
+    Migration(1, "Binary item thumbnails", [
+        "ALTER TABLE item ADD COLUMN IF NOT EXISTS thumbnail bytea",
+    ]),
+    Migration(2, "Resolved item taxonomy", [
+        "ALTER TABLE item ADD COLUMN IF NOT EXISTS resolved_species_id uuid",
+        "ALTER TABLE item ADD COLUMN IF NOT EXISTS resolved_genus_id uuid",
+        "ALTER TABLE item ADD COLUMN IF NOT EXISTS resolved_family_id uuid",
+        # Resolve the ancestry of all existing items, from the lowest taxonomic level up.
+        "UPDATE item SET resolved_species_id = COALESCE(item.species_id, "
+        "(SELECT species_id FROM subspecies WHERE subspecies.id = item.subspecies_id))",
+        "UPDATE item SET resolved_genus_id = COALESCE(item.genus_id, "
+        "(SELECT genus_id FROM species WHERE species.id = item.resolved_species_id))",
+        "UPDATE item SET resolved_family_id = COALESCE(item.family_id, "
+        "(SELECT family_id FROM genus WHERE genus.id = item.resolved_genus_id))",
+    ]),
+    Migration(3, "Indexes on foreign keys and hot filters", [
+        "CREATE INDEX IF NOT EXISTS ix_family_catalog_id_name ON family (catalog_id, name)",
+        "CREATE INDEX IF NOT EXISTS ix_genus_family_id_name ON genus (family_id, name)",
+        "CREATE INDEX IF NOT EXISTS ix_genus_family_id_name_not_type ON genus (family_id, name) WHERE NOT is_type",
+        "CREATE INDEX IF NOT EXISTS ix_genus_lower_name ON genus (lower(name) varchar_pattern_ops)",
+        "CREATE INDEX IF NOT EXISTS ix_species_genus_id_name ON species (genus_id, name)",
+        "CREATE INDEX IF NOT EXISTS ix_subspecies_species_id ON subspecies (species_id)",
+        "CREATE INDEX IF NOT EXISTS ix_study_catalog_id ON study (catalog_id)",
+        "CREATE INDEX IF NOT EXISTS ix_study_id_reference ON study (id) WHERE is_reference",
+        # The covering indexes of migration 6 right away, instead of single column indexes that it would replace.
+        "CREATE INDEX IF NOT EXISTS ix_sample_study_id_id ON sample (study_id, id)",
+        "CREATE INDEX IF NOT EXISTS ix_slide_sample_id_id ON slide (sample_id, id)",
+        "CREATE INDEX IF NOT EXISTS ix_item_subspecies_id ON item (subspecies_id)",
+        "CREATE INDEX IF NOT EXISTS ix_item_species_id ON item (species_id)",
+        "CREATE INDEX IF NOT EXISTS ix_item_genus_id ON item (genus_id)",
+        "CREATE INDEX IF NOT EXISTS ix_item_family_id ON item (family_id)",
+        "CREATE INDEX IF NOT EXISTS ix_item_slide_id_id ON item (slide_id, id)",
+        # Covering the keyset pagination order, replacing the single column indexes.
+        "CREATE INDEX IF NOT EXISTS ix_item_resolved_species_id_id ON item (resolved_species_id, id)",
+        "CREATE INDEX IF NOT EXISTS ix_item_resolved_genus_id_id ON item (resolved_genus_id, id)",
+        "CREATE INDEX IF NOT EXISTS ix_item_resolved_family_id_id ON item (resolved_family_id, id)",
+        "DROP INDEX IF EXISTS ix_item_resolved_species_id",
+        "DROP INDEX IF EXISTS ix_item_resolved_genus_id",
+        "DROP INDEX IF EXISTS ix_item_resolved_family_id",
+        "ANALYZE",
+    ]),
+    # The derivative_job table itself is created by create_all.
+    Migration(4, "Derived thumbnail size", [
+        "ALTER TABLE item ADD COLUMN IF NOT EXISTS thumbnail_size integer",
+    ]),
+    Migration(5, "Trigram indexes for taxon search", [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX IF NOT EXISTS ix_family_lower_name_trgm ON family USING gin (lower(name) gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS ix_genus_lower_name_trgm ON genus USING gin (lower(name) gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS ix_species_lower_name_trgm ON species USING gin (lower(name) gin_trgm_ops)",
+    ]),
+    # Replaces the single column indexes that migration 3 created before it created the covering ones itself.
+    Migration(6, "Covering indexes on the slide, sample and study chain", [
+        "CREATE INDEX IF NOT EXISTS ix_sample_study_id_id ON sample (study_id, id)",
+        "CREATE INDEX IF NOT EXISTS ix_slide_sample_id_id ON slide (sample_id, id)",
+        "CREATE INDEX IF NOT EXISTS ix_item_slide_id_id ON item (slide_id, id)",
+        "DROP INDEX IF EXISTS ix_sample_study_id",
+        "DROP INDEX IF EXISTS ix_slide_sample_id",
+        "DROP INDEX IF EXISTS ix_item_slide_id",
+    ]),
+    # The statistics tables themselves are created by create_all. Later changes are counted by the repository.
+    Migration(7, "Item and catalog statistics", [
+        "INSERT INTO item_statistic "
+        "(id, taxon_id, species_id, genus_id, family_id, study_id, is_reference, item_count) "
+        "SELECT gen_random_uuid(), "
+        "coalesce(item.resolved_species_id, item.resolved_genus_id, item.resolved_family_id), "
+        "item.resolved_species_id, item.resolved_genus_id, item.resolved_family_id, "
+        "sample.study_id, study.is_reference, count(*) "
+        "FROM item "
+        "JOIN slide ON item.slide_id = slide.id "
+        "JOIN sample ON slide.sample_id = sample.id "
+        "JOIN study ON sample.study_id = study.id "
+        "GROUP BY 2, 3, 4, 5, 6, 7 "
+        "ON CONFLICT (taxon_id, study_id) DO NOTHING",
+        "INSERT INTO catalog_statistic (id, family_count, genus_count, species_count) "
+        "SELECT catalog.id, "
+        "(SELECT count(*) FROM family WHERE family.catalog_id = catalog.id), "
+        "(SELECT count(*) FROM genus JOIN family ON genus.family_id = family.id "
+        "WHERE family.catalog_id = catalog.id), "
+        "(SELECT count(*) FROM species JOIN genus ON species.genus_id = genus.id "
+        "JOIN family ON genus.family_id = family.id WHERE family.catalog_id = catalog.id) "
+        "FROM catalog "
+        "ON CONFLICT (id) DO NOTHING",
+    ]),
+]
+
+LOCK_KEY = 0x6d6d6170  # Advisory lock that serializes migrations, e.g. of several workers starting at once.
+
+
+def _lock(connection: Connection):
+    connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": LOCK_KEY})
+    connection.execute(text("SET LOCAL statement_timeout = 0"))  # Migrations may take longer than DB_STATEMENT_TIMEOUT.
+
+
+def current_version(connection: Connection) -> int:
+    """Returns the version of the most recently applied migration, or 0 if none was applied."""
+    return connection.scalar(text("SELECT coalesce(max(version), 0) FROM schema_version"))
+
+
+def upgrade(engine: Engine) -> List[Migration]:
+    """Applies all pending migrations in order, each in its own transaction. Returns the applied migrations."""
+    applied = []
+    with engine.connect() as connection:
+        with connection.begin():
+            _lock(connection)
+            connection.execute(text(
+                "CREATE TABLE IF NOT EXISTS schema_version ("
+                "version integer PRIMARY KEY, "
+                "description varchar NOT NULL, "
+                "applied_at timestamp with time zone NOT NULL DEFAULT now())"))
+
+        for migration in MIGRATIONS:
+            with connection.begin():
+                _lock(connection)
+                if migration.version <= current_version(connection):
+                    continue
+
+                for statement in migration.statements:
+                    connection.execute(text(statement))
+                connection.execute(
+                    text("INSERT INTO schema_version (version, description) VALUES (:version, :description)"),
+                    {"version": migration.version, "description": migration.description})
+            applied.append(migration)
+
+    return applied
@@ -1,4 +1,5 @@
-from typing import Optional
+from datetime import datetime
+from typing import List, Optional
 from pydantic import BaseModel
 from uuid import UUID
 
@@ -70,8 +71,7 @@ class SlideCreateDTO(MicromapBaseModel):  # Contains sample_id instead of Sample
     sample_id: UUID
 
 
-class Item(MicromapBaseModel):
-    key_image: str
+class Item(MicromapBaseModel):  # The thumbnail is served separately, see GET /items/{item_id}/thumbnail.
     family_id: Optional[UUID] = None
     genus_id: Optional[UUID] = None
     species_id: Optional[UUID] = None
@@ -80,8 +80,15 @@ class Item(MicromapBaseModel):
     slide: Slide = None
     voxel_width: float = None
 
+class StackInfo(BaseModel):  # The tile pyramid of an item's focus stack, see GET /items/{item_id}/stack.
+    width: int
+    height: int
+    depth: int  # Number of focus levels.
+    tile_size: int
+    levels: int  # Number of resolution levels, level 0 being the full resolution.
+
 class ItemCreateDTO(MicromapBaseModel):  # Contains slide_id instead of Slide
-    key_image: str
+    key_image: Optional[str] = None  # Base64 encoded PNG thumbnail, or None to derive it from the item's stack file.
     family_id: Optional[UUID] = None
     genus_id: Optional[UUID] = None
     species_id: Optional[UUID] = None
@@ -89,3 +96,74 @@ class ItemCreateDTO(MicromapBaseModel):  # Contains slide_id instead of Slide
     comment: Optional[str] = None
     slide_id: UUID
     voxel_width: float = None
+
+
+class TaxonSearchResult(BaseModel):  # A family, genus or species matching a search, see GET /search/.
+    level: str  # "family", "genus" or "species".
+    id: UUID
+    name: str
+    is_type: bool = False
+    genus_id: Optional[UUID] = None  # The ancestors of the taxon.
+    genus_name: Optional[str] = None
+    family_id: Optional[UUID] = None
+    family_name: Optional[str] = None
+    # 3 for an exact match, 2 to 3 for a prefix of the name, 1 to 2 for a prefix of a word, or the word similarity.
+    score: float
+
+
+class BulkInsertResult(BaseModel):
+    ids: List[UUID]  # The inserted rows, in request order.
+    skipped: List[UUID] = []  # The rows that already existed, if skip_existing was set.
+
+
+class DerivativeMetrics(BaseModel):  # The derivative jobs of one kind, see GET /derivatives/metrics.
+    kind: str
+    pending: int = 0
+    running: int = 0
+    done: int = 0
+    failed: int = 0
+    # Timings of the done jobs, in milliseconds.
+    mean_ms: Optional[float] = None
+    p95_ms: Optional[float] = None
+    max_ms: Optional[float] = None
+    mean_decode_ms: Optional[float] = None
+    mean_resize_ms: Optional[float] = None
+    mean_encode_ms: Optional[float] = None
+
+
+class StatementProfile(BaseModel):  # A slow SQL statement of a profiled request.
+    sql: str
+    duration_ms: float
+    plan: Optional[str] = None  # EXPLAIN ANALYZE, of SELECT statements.
+
+
+class RequestProfile(BaseModel):  # A profiled request, see GET /debug/slow. Durations are in milliseconds.
+    method: str
+    path: str
+    query: str
+    status: int
+    started_at: datetime
+    total_ms: float
+    pool_ms: float
+    sql_ms: float
+    sql_statements: int
+    orm_ms: float  # In the repository, outside SQL statements: mostly ORM hydration.
+    serialization_ms: float
+    explain_ms: float  # Spent by the profiler itself.
+    statements: List[StatementProfile]
+
+
+class PoolMetrics(BaseModel):  # A database connection pool of one worker process, see GET /pool/metrics.
+    pid: int
+    server: str  # host:port of the primary or a replica.
+    replica: bool = False
+    pool: str
+    size: int = 0
+    checked_out: int = 0
+    checked_in: int = 0
+    overflow: int = 0
+    # Checkouts since the process started, and how long they waited for a connection, in milliseconds.
+    checkouts: int = 0
+    timeouts: int = 0
+    mean_wait_ms: Optional[float] = None
+    max_wait_ms: float = 0.0
@@ -0,0 +1,123 @@
+import logging
+import select
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional
+from uuid import UUID
+
+import psycopg2
+from sqlalchemy import func, select as sql_select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from .ormmodels import ORMDataVersion
+
+CHANNEL = "micromap_changes"
+ALL_CATALOGS = "*"
+VERSION_CHANNEL = "micromap_versions"
+ALL_CATALOGS_ID = UUID(int=0)  # The version of the data of all catalogs.
+
+logger = logging.getLogger(__name__)
+
+
+def notify_changes(session: Session, catalog_ids: Optional[Iterable[UUID]]):
+    """
+    Queues a change notification for each of the given catalogs, or for all catalogs if catalog_ids is None. Postgres
+    delivers the notifications to all listeners when (and only if) the session's transaction commits.
+    """
+    payloads = [ALL_CATALOGS] if catalog_ids is None else sorted({str(catalog_id) for catalog_id in catalog_ids})
+    for payload in payloads:
+        session.execute(sql_select(func.pg_notify(CHANNEL, payload)))
+
+
+def bump_data_versions(session: Session, catalog_ids: Iterable[UUID] = ()) -> Dict[UUID, int]:
+    """
+    Increments the data versions of the given catalogs and of all catalogs in the session's transaction, and queues a
+    notification with each new version. Returns the new versions, to update the versions of this process after
+    committing. Versions are timestamps in microseconds that only increase, so they are not reused when the database
+    is recreated.
+    """
+    now = int(time.time() * 1000000)
+    # Sorted, so concurrent writes lock the rows in the same order.
+    rows = [{"id": catalog_id, "version": now} for catalog_id in sorted({ALL_CATALOGS_ID, *catalog_ids})]
+    statement = insert(ORMDataVersion).values(rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=["id"],
+        set_={"version": func.greatest(ORMDataVersion.version + 1, statement.excluded.version)})
+    versions = dict(session.execute(statement.returning(ORMDataVersion.id, ORMDataVersion.version)).all())
+
+    for catalog_id, version in versions.items():
+        session.execute(sql_select(func.pg_notify(VERSION_CHANNEL, f"{catalog_id}:{version}")))
+    return versions
+
+
+class ChangeListener(threading.Thread):
+    """
+    Listens for the change notifications of all API workers and containers, and calls on_change with the catalog id of
+    each change, or None if all catalogs may have changed. This keeps the in-process caches of all workers consistent.
+
+    It also calls on_version with the catalog id and the new version of each data version change (see
+    bump_data_versions), or ALL_CATALOGS_ID for the version of all catalogs.
+
+    The listener uses its own psycopg2 connection (dsn). After (re)connecting, it calls on_change(None), and on_version
+    with all current versions, since changes made while it was not listening are lost. Then it calls on_listening(True),
+    and on_listening(False) when it loses its connection, until it listens again.
+    """
+    def __init__(self,
+                 dsn: str,
+                 on_change: Callable[[Optional[UUID]], None],
+                 on_version: Optional[Callable[[UUID, int], None]] = None,
+                 on_listening: Optional[Callable[[bool], None]] = None,
+                 reconnect_delay: float = 5.0):
+        super().__init__(name="micromap-change-listener", daemon=True)
+        self.dsn = dsn
+        self.on_change = on_change
+        self.on_version = on_version
+        self.on_listening = on_listening
+        self.reconnect_delay = reconnect_delay
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            connection = None
+            try:
+                connection = psycopg2.connect(self.dsn)
+                connection.autocommit = True
+                cursor = connection.cursor()
+                cursor.execute(f"LISTEN {CHANNEL}")
+                cursor.execute(f"LISTEN {VERSION_CHANNEL}")
+                self.on_change(None)
+                if self.on_version is not None:
+                    cursor.execute(f"SELECT id, version FROM {ORMDataVersion.__tablename__}")
+                    for catalog_id, version in cursor.fetchall():
+                        self.on_version(UUID(str(catalog_id)), version)
+                if self.on_listening is not None:
+                    self.on_listening(True)
+                self._listen(connection)
+            except psycopg2.Error as exc:
+                logger.warning("Change listener lost its database connection: %s", exc)
+            finally:
+                if self.on_listening is not None:
+                    self.on_listening(False)
+                if connection is not None:
+                    connection.close()
+            self._stopped.wait(self.reconnect_delay)
+
+    def _listen(self, connection):
+        while not self._stopped.is_set():
+            # Wait until the connection has data, but wake up regularly to check if the listener was stopped.
+            if select.select([connection], [], [], 1.0) == ([], [], []):
+                continue
+
+            connection.poll()
+            while connection.notifies:
+                notify = connection.notifies.pop(0)
+                if notify.channel == VERSION_CHANNEL:
+                    if self.on_version is not None:
+                        catalog_id, version = notify.payload.split(":")
+                        self.on_version(UUID(catalog_id), int(version))
+                else:
+                    self.on_change(None if notify.payload == ALL_CATALOGS else UUID(notify.payload))
+
+    def stop(self):
+        self._stopped.set()
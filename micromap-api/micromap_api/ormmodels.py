@@ -1,5 +1,7 @@
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
-from sqlalchemy import String, ForeignKey, Float, Boolean, CheckConstraint
+from sqlalchemy import (String, ForeignKey, Float, Boolean, CheckConstraint, LargeBinary, Index, Integer, BigInteger,
+                        DateTime, UniqueConstraint, DDL, event, func, text)
+from datetime import datetime
 from uuid import UUID
 from typing import List
 
@@ -8,6 +10,17 @@ class ORMBase(DeclarativeBase):
     id: Mapped[UUID] = mapped_column(primary_key=True)
 
 
+def trigram_index(name: str) -> Index:
+    """Returns a GIN trigram index on the lower-case name, for prefix and typo-tolerant (similarity) name search."""
+    return Index(name, func.lower(text("name")).label("lower_name"),
+                 postgresql_using="gin", postgresql_ops={"lower_name": "gin_trgm_ops"})
+
+
+# The trigram indexes require the pg_trgm extension.
+event.listen(ORMBase.metadata, "before_create",
+             DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"))
+
+
 class ORMCatalog(ORMBase):
     __tablename__ = "catalog"
 
@@ -21,6 +34,11 @@ class ORMFamily(ORMBase):
     catalog_id: Mapped[UUID] = mapped_column(ForeignKey("catalog.id"), nullable=False)
     genera: Mapped[List["ORMGenus"]] = relationship(back_populates="family")  # populates genus.family
 
+    __table_args__ = (
+        Index("ix_family_catalog_id_name", "catalog_id", "name"),  # Families of a catalog, ordered by name.
+        trigram_index("ix_family_lower_name_trgm"),
+    )
+
 
 class ORMGenus(ORMBase):
     __tablename__ = "genus"
@@ -31,6 +49,15 @@ class ORMGenus(ORMBase):
     species: Mapped[List["ORMSpecies"]]= relationship(back_populates="genus")  # populates species.genus
     is_type: Mapped[bool] = mapped_column(Boolean, nullable=False)
 
+    __table_args__ = (
+        Index("ix_genus_family_id_name", "family_id", "name"),  # Genera of a family, ordered by name.
+        Index("ix_genus_family_id_name_not_type", "family_id", "name", postgresql_where=text("NOT is_type")),
+        # Case-insensitive prefix search on the name.
+        Index("ix_genus_lower_name", func.lower(text("name")).label("lower_name"),
+              postgresql_ops={"lower_name": "varchar_pattern_ops"}),
+        trigram_index("ix_genus_lower_name_trgm"),
+    )
+
 
 class ORMSpecies(ORMBase):
     __tablename__ = "species"
@@ -41,12 +68,17 @@ class ORMSpecies(ORMBase):
     subspecies: Mapped[List["ORMSubSpecies"]] = relationship(back_populates="species")  # populates subspecies.species
     is_type: Mapped[bool] = mapped_column(Boolean, nullable=False)
 
+    __table_args__ = (
+        Index("ix_species_genus_id_name", "genus_id", "name"),  # Species of a genus, ordered by name.
+        trigram_index("ix_species_lower_name_trgm"),
+    )
+
 
 class ORMSubSpecies(ORMBase):
     __tablename__ = "subspecies"
 
     name: Mapped[str] = mapped_column(String(100), nullable=False, unique=True)
-    species_id: Mapped[UUID] = mapped_column(ForeignKey("species.id"))
+    species_id: Mapped[UUID] = mapped_column(ForeignKey("species.id"), index=True)
     species: Mapped[ORMSpecies] = relationship(back_populates="subspecies")  # populates species.subspecies
 
 
@@ -57,9 +89,15 @@ class ORMStudy(ORMBase):
     location: Mapped[str] = mapped_column(String, nullable=True)
     remarks: Mapped[str] = mapped_column(String, nullable=True)
     is_reference: Mapped[bool] = mapped_column(Boolean, nullable=False)
-    catalog_id: Mapped[UUID] = mapped_column(ForeignKey("catalog.id"), nullable=False)
+    catalog_id: Mapped[UUID] = mapped_column(ForeignKey("catalog.id"), nullable=False, index=True)
+
+    __table_args__ = (
+        Index("ix_study_id_reference", "id", postgresql_where=text("is_reference")),  # Reference studies only.
+    )
 
 
+# The relationships below are never loaded implicitly. Queries load them explicitly, depending on whether the response
+# model serializes them (see loading.load_options).
 class ORMSample(ORMBase):
     __tablename__ = "sample"
 
@@ -68,7 +106,11 @@ class ORMSample(ORMBase):
     location: Mapped[str] = mapped_column(String, nullable=True)
     age: Mapped[str] = mapped_column(String, nullable=True)
     remarks: Mapped[str] = mapped_column(String, nullable=True)
-    study: Mapped[ORMStudy] = relationship(ORMStudy, lazy='subquery')
+    study: Mapped[ORMStudy] = relationship(ORMStudy, lazy='raise')
+
+    __table_args__ = (
+        Index("ix_sample_study_id_id", "study_id", "id"),  # The samples of a study, index-only.
+    )
 
 
 class ORMSlide(ORMBase):
@@ -77,22 +119,35 @@ class ORMSlide(ORMBase):
     sample_id: Mapped[UUID] = mapped_column(ForeignKey("sample.id"), nullable=False)
     description: Mapped[str] = mapped_column(String, nullable=True)
     remarks: Mapped[str] = mapped_column(String, nullable=True)
-    sample: Mapped[ORMSample] = relationship(ORMSample, lazy='subquery')
+    sample: Mapped[ORMSample] = relationship(ORMSample, lazy='raise')
+
+    __table_args__ = (
+        Index("ix_slide_sample_id_id", "sample_id", "id"),  # The slides of a sample, index-only.
+    )
 
 
 class ORMItem(ORMBase):
     __tablename__ = "item"
 
-    key_image: Mapped[str] = mapped_column(String, nullable=True)
-    subspecies_id: Mapped[UUID] = mapped_column(ForeignKey("subspecies.id"), nullable=True)
-    species_id: Mapped[UUID] = mapped_column(ForeignKey("species.id"), nullable=True)
-    genus_id: Mapped[UUID] = mapped_column(ForeignKey("genus.id"), nullable=True)
-    family_id: Mapped[UUID] = mapped_column(ForeignKey("family.id"), nullable=True)
+    key_image: Mapped[str] = mapped_column(String, nullable=True, deferred=True)  # Legacy base64 PNG thumbnail.
+    thumbnail: Mapped[bytes] = mapped_column(LargeBinary, nullable=True, deferred=True)  # PNG thumbnail.
+    # Maximum width and height the thumbnail was derived with, or null if it was uploaded, see ORMDerivativeJob.
+    thumbnail_size: Mapped[int] = mapped_column(Integer, nullable=True)
+    subspecies_id: Mapped[UUID] = mapped_column(ForeignKey("subspecies.id"), nullable=True, index=True)
+    species_id: Mapped[UUID] = mapped_column(ForeignKey("species.id"), nullable=True, index=True)
+    genus_id: Mapped[UUID] = mapped_column(ForeignKey("genus.id"), nullable=True, index=True)
+    family_id: Mapped[UUID] = mapped_column(ForeignKey("family.id"), nullable=True, index=True)
     comment: Mapped[str] = mapped_column(String, nullable=True)
     slide_id: Mapped[UUID] = mapped_column(ForeignKey("slide.id"), nullable=True)
-    slide: Mapped[ORMSlide] = relationship(ORMSlide, lazy='subquery')
+    slide: Mapped[ORMSlide] = relationship(ORMSlide, lazy='raise')
     voxel_width: Mapped[float] = mapped_column(Float, nullable=False)
 
+    # The resolved ancestry of the taxon above, e.g. an item of a species also gets the genus and family of the species.
+    # This turns any taxonomy filter into a single indexed equality. Maintained by the repository.
+    resolved_species_id: Mapped[UUID] = mapped_column(nullable=True)
+    resolved_genus_id: Mapped[UUID] = mapped_column(nullable=True)
+    resolved_family_id: Mapped[UUID] = mapped_column(nullable=True)
+
     __table_args__ = (
         # This constraint enforces one and only one of the taxonomic levels should be used.
         CheckConstraint(
@@ -102,4 +157,85 @@ class ORMItem(ORMBase):
             "(family_id IS NOT NULL)::int = 1",
             name="force_single_taxon",
         ),
+        # Items of a taxon, ordered by id for paging.
+        Index("ix_item_resolved_species_id_id", "resolved_species_id", "id"),
+        Index("ix_item_resolved_genus_id_id", "resolved_genus_id", "id"),
+        Index("ix_item_resolved_family_id_id", "resolved_family_id", "id"),
+        Index("ix_item_slide_id_id", "slide_id", "id"),
+    )
+
+
+class ORMDerivativeJob(ORMBase):
+    """
+    Queue of derivatives to make from the stack files of items, processed by `micromap-api worker`. There is one job
+    per item and kind, which is queued again when the derivative must be made in another size.
+    """
+    __tablename__ = "derivative_job"
+
+    THUMBNAIL = "thumbnail"  # PNG thumbnail of the middle focus level, stored in item.thumbnail.
+    PYRAMID = "pyramid"  # Tile pyramid file, see pyramid.py.
+
+    item_id: Mapped[UUID] = mapped_column(ForeignKey("item.id"), nullable=False)
+    kind: Mapped[str] = mapped_column(String(20), nullable=False)
+    size: Mapped[int] = mapped_column(Integer, nullable=False)  # Thumbnail width and height, or pyramid tile size.
+    status: Mapped[str] = mapped_column(String(10), nullable=False, server_default="pending")  # Or running/done/failed.
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, server_default="0")
+    error: Mapped[str] = mapped_column(String, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    started_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True)
+    finished_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True)
+
+    # Timings of the last successful run, in milliseconds.
+    decode_ms: Mapped[float] = mapped_column(Float, nullable=True)
+    resize_ms: Mapped[float] = mapped_column(Float, nullable=True)
+    encode_ms: Mapped[float] = mapped_column(Float, nullable=True)
+    total_ms: Mapped[float] = mapped_column(Float, nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("item_id", "kind", name="uq_derivative_job_item_id_kind"),
+        Index("ix_derivative_job_status_created_at", "status", "created_at"),  # Claiming the oldest queued jobs.
+    )
+
+
+class ORMDataVersion(ORMBase):
+    """
+    Version of the data of a catalog (id), or of all catalogs (notifications.ALL_CATALOGS_ID), which is bumped by every
+    write. Responses are cached by these versions, see httpcache.py.
+    """
+    __tablename__ = "data_version"
+
+    version: Mapped[int] = mapped_column(BigInteger, nullable=False)
+
+
+class ORMItemStatistic(ORMBase):
+    """
+    Number of items of a taxon (the lowest level of their resolved ancestry) in a study, maintained by the repository
+    whenever items are added or taxa are moved, and rebuilt by `micromap-api statistics`. Items per taxon, per study or
+    per reference/non-reference are sums over these rows, instead of counts over the items.
+    """
+    __tablename__ = "item_statistic"
+
+    taxon_id: Mapped[UUID] = mapped_column(nullable=False)
+    species_id: Mapped[UUID] = mapped_column(nullable=True)  # The resolved ancestry of the taxon.
+    genus_id: Mapped[UUID] = mapped_column(nullable=True)
+    family_id: Mapped[UUID] = mapped_column(nullable=True)
+    study_id: Mapped[UUID] = mapped_column(nullable=False)
+    is_reference: Mapped[bool] = mapped_column(Boolean, nullable=False)  # Of the study.
+    item_count: Mapped[int] = mapped_column(BigInteger, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("taxon_id", "study_id", name="uq_item_statistic_taxon_id_study_id"),
+        Index("ix_item_statistic_species_id", "species_id"),
+        Index("ix_item_statistic_genus_id", "genus_id"),
+        Index("ix_item_statistic_family_id", "family_id"),
+        Index("ix_item_statistic_study_id", "study_id"),
     )
+
+
+class ORMCatalogStatistic(ORMBase):
+    """Number of taxa in a catalog (id), maintained like ORMItemStatistic."""
+    __tablename__ = "catalog_statistic"
+
+    family_count: Mapped[int] = mapped_column(BigInteger, nullable=False, server_default="0")
+    genus_count: Mapped[int] = mapped_column(BigInteger, nullable=False, server_default="0")
+    species_count: Mapped[int] = mapped_column(BigInteger, nullable=False, server_default="0")
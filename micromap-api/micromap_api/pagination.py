@@ -0,0 +1,30 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from typing import Any, List
+
+from .exceptions import InvalidCursorException
+
+
+def encode_cursor(*sort_key: Any) -> str:
+    """
+    Encodes the sort key of the last item on a page into an opaque, URL-safe cursor. The next page starts right after
+    this key, so deep pages cost the same as the first one (keyset pagination).
+    """
+    payload = json.dumps([str(value) for value in sort_key], separators=(",", ":"))
+    return urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> List[str]:
+    """
+    Decodes a cursor created by encode_cursor back into the sort key values.
+    Raises an InvalidCursorException if the cursor is malformed.
+    """
+    try:
+        sort_key = json.loads(urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise InvalidCursorException(cursor)
+
+    if not isinstance(sort_key, list) or not sort_key:
+        raise InvalidCursorException(cursor)
+
+    return sort_key
@@ -0,0 +1,161 @@
+import os
+import threading
+import time
+from typing import Any, Dict
+from uuid import uuid4
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+from .metrics import POOL_WAIT, POOL_TIMEOUTS
+from .models import PoolMetrics
+from .profiling import record
+
+
+def pgbouncer_mode() -> bool:
+    """
+    True if the database is reached through PgBouncer in transaction pooling mode (DB_PGBOUNCER=1). Every transaction
+    may then run on another server connection, so no session state may be kept: no prepared statements, no SET, and
+    no startup options.
+    """
+    return bool(int(os.getenv("DB_PGBOUNCER", "0")))
+
+
+def statement_timeout() -> int:
+    """Returns the maximum duration of a statement in milliseconds (DB_STATEMENT_TIMEOUT), or 0 for no limit."""
+    return int(os.getenv("DB_STATEMENT_TIMEOUT", "0"))
+
+
+class _WaitStatistics:
+    """Thread-safe statistics of the time spent waiting for a pooled connection."""
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, wait: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+
+class _MeteredPool:
+    """Mixin for a queue pool that measures how long each checkout waits for a connection."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_statistics = _WaitStatistics()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.wait_statistics.add(time.perf_counter() - start, timed_out=True)
+            POOL_TIMEOUTS.inc()
+            raise
+        wait = time.perf_counter() - start
+        self.wait_statistics.add(wait)
+        POOL_WAIT.observe(wait)
+        record("pool", wait)
+        return connection
+
+    def recreate(self):
+        pool = super().recreate()  # E.g. on Engine.dispose(); the statistics of the process carry over.
+        pool.wait_statistics = self.wait_statistics
+        return pool
+
+
+class MeteredQueuePool(_MeteredPool, QueuePool):
+    pass
+
+
+class MeteredAsyncQueuePool(_MeteredPool, AsyncAdaptedQueuePool):
+    pass
+
+
+def pooled_url(url: str, async_driver: bool = False) -> str:
+    """Returns the database URL with the options of the driver for PgBouncer mode."""
+    if async_driver and pgbouncer_mode():
+        return url + "?prepared_statement_cache_size=0"  # The cache of SQLAlchemy's asyncpg dialect.
+    return url
+
+
+def engine_options(async_driver: bool = False) -> Dict[str, Any]:
+    """
+    Returns the create_engine (or create_async_engine) arguments of the connection pool, configured by the DB_*
+    environment variables. Each process has its own pool, so the number of connections of a server is at most
+    (DB_POOL_SIZE + DB_MAX_OVERFLOW) per worker.
+    """
+    options = {
+        "poolclass": MeteredAsyncQueuePool if async_driver else MeteredQueuePool,
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "5")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),  # Seconds to wait for a connection.
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),  # Seconds, or -1 to keep connections forever.
+        "pool_pre_ping": bool(int(os.getenv("DB_POOL_PRE_PING", "1"))),  # Replaces connections lost by a restart.
+    }
+
+    connect_args: Dict[str, Any] = {}
+    timeout = statement_timeout()
+    if async_driver and pgbouncer_mode():
+        # asyncpg prepares every statement on the server connection, which PgBouncer may have handed to another client
+        # in the meantime. Disable its statement cache (see also pooled_url), and give the statements that are prepared
+        # anyway (once, for their result types) unique names.
+        connect_args["statement_cache_size"] = 0
+        connect_args["prepared_statement_name_func"] = _prepared_statement_name
+    if timeout and not pgbouncer_mode():
+        # PgBouncer rejects startup options, see set_statement_timeout for that mode.
+        if async_driver:
+            connect_args["server_settings"] = {"statement_timeout": str(timeout)}
+        else:
+            connect_args["options"] = f"-c statement_timeout={timeout}"
+    if connect_args:
+        options["connect_args"] = connect_args
+    return options
+
+
+def _prepared_statement_name() -> str:
+    return f"__asyncpg_{uuid4()}__"
+
+
+def set_statement_timeout(engine: Engine):
+    """
+    In PgBouncer mode, sets the statement timeout at the start of each transaction (SET LOCAL), since settings of the
+    session would leak to the other clients of the server connection. In the other modes, it is a startup option of
+    each connection (see engine_options).
+    """
+    timeout = statement_timeout()
+    if not timeout or not pgbouncer_mode():
+        return
+
+    @event.listens_for(engine, "begin")
+    def begin(connection):
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {timeout:d}")
+
+
+def pool_metrics(engine: Engine, replica: bool = False) -> PoolMetrics:
+    """Returns the state of the connection pool of the engine in this process, and how long checkouts waited."""
+    pool = engine.pool
+    metrics = PoolMetrics(pid=os.getpid(), server=f"{engine.url.host}:{engine.url.port or 5432}", replica=replica,
+                          pool=type(pool).__name__)
+    if isinstance(pool, QueuePool):
+        metrics.size = pool.size()
+        metrics.checked_out = pool.checkedout()
+        metrics.checked_in = pool.checkedin()
+        metrics.overflow = max(pool.overflow(), 0)
+    statistics = getattr(pool, "wait_statistics", None)
+    if statistics is not None:
+        metrics.checkouts = statistics.checkouts
+        metrics.timeouts = statistics.timeouts
+        metrics.max_wait_ms = statistics.max_wait * 1000
+        if statistics.checkouts + statistics.timeouts:
+            metrics.mean_wait_ms = statistics.total_wait * 1000 / (statistics.checkouts + statistics.timeouts)
+    return metrics
@@ -1,37 +1,197 @@
 import os
-from typing import List, Optional, Sequence
+from base64 import b64decode
+from datetime import timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple, Type
 from uuid import UUID, uuid4
-import random
 
 from sqlalchemy.exc import IntegrityError, NoResultFound
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, aliased
 from sqlalchemy.sql import or_, and_
-from sqlalchemy import create_engine, select, func
+from sqlalchemy import (create_engine, select, update, delete, func, case, literal, tuple_, text, Column, ColumnElement,
+                        Engine, Row, String, Subquery)
+from sqlalchemy.dialects.postgresql import insert
 
+from pydantic import BaseModel
+
+from .loading import load_options
+from .migrations import Migration, upgrade
 from .models import ItemCreateDTO
-from .exceptions import KeyViolationException, EntityDoesNotExistException
-from .ormmodels import ORMCatalog, ORMFamily, ORMGenus, ORMSpecies, ORMItem, ORMStudy, ORMSample, ORMSlide, ORMBase
-from .models import Catalog, Family, Genus, Species, Study, SampleCreateDTO, SlideCreateDTO
+from .exceptions import (KeyViolationException, BulkKeyViolationException, EntityDoesNotExistException,
+                         InvalidCursorException)
+from .ormmodels import (ORMCatalog, ORMFamily, ORMGenus, ORMSpecies, ORMSubSpecies, ORMItem, ORMStudy, ORMSample,
+                        ORMSlide, ORMBase, ORMDerivativeJob, ORMItemStatistic, ORMCatalogStatistic)
+from .models import (Catalog, Family, Genus, Species, Study, SampleCreateDTO, SlideCreateDTO, BulkInsertResult,
+                     DerivativeMetrics, TaxonSearchResult, PoolMetrics)
+from .httpcache import DataVersions
+from .notifications import notify_changes, bump_data_versions
+from .metrics import instrument, label_queries
+from .profiling import profile_statements
+from .pooling import engine_options, set_statement_timeout, pool_metrics
+from .replicas import Replica, ReplicaSet, current_replica
+from .taxonomycache import TaxonomyCache, TaxonomySnapshot
+
+
+# The columns of ORMCatalogStatistic that count families, genera and species.
+_CATALOG_STATISTIC_COLUMNS = {ORMFamily: "family_count", ORMGenus: "genus_count", ORMSpecies: "species_count"}
+
+# The orders of get_items. Items are sorted by the most abundant taxon (in the filtered items), by taxon name, in a
+# seeded random order, or by id. Each order ends with the item id, so it is total and stable for keyset pagination.
+ITEM_ORDERS = ("abundance", "name", "random", "id")
+
+
+def _item_taxon() -> ColumnElement:
+    """The taxon of an item: the lowest taxonomic level in its resolved ancestry."""
+    return func.coalesce(ORMItem.resolved_species_id, ORMItem.resolved_genus_id, ORMItem.resolved_family_id)
+
+
+def _escape_like(value: str) -> str:
+    """Escapes the LIKE wildcards in a value, so it matches literally."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def database_url(dialect: str = "postgresql", direct: bool = False) -> str:
+    """
+    Returns the database URL configured by the PG* environment variables, for the given dialect(+driver). A direct
+    URL bypasses a connection pooler like PgBouncer, for sessions that need server state (like LISTEN): it connects to
+    PGDIRECTHOST (and PGDIRECTPORT) if set.
+    """
+    server = os.getenv("PGHOSTADDR", os.getenv("PGHOST", "localhost"))
+    port = os.getenv("PGPORT", "5432")
+    if direct and os.getenv("PGDIRECTHOST"):
+        server, port = os.getenv("PGDIRECTHOST"), os.getenv("PGDIRECTPORT", "5432")
+    return _url(dialect, server, port)
+
+
+def _url(dialect: str, server: str, port: str) -> str:
+    database = os.getenv("PGDATABASE", "micromap")
+    user = os.getenv("PGUSER", "postgres")
+    password = os.getenv("PGPASSWORD", "postgres")
+    return f"{dialect}://{user}:{password}@{server}:{port}/{database}"
+
+
+def replica_set(dialect: str, create: Callable[[str], Engine]) -> Optional[ReplicaSet]:
+    """
+    Returns the read replicas in PGREPLICAHOSTS (comma-separated host[:port]), with the database and credentials of
+    the primary, or None if there are none. create returns the engine of a URL with the given dialect(+driver).
+    """
+    replicas = []
+    for host in filter(None, (host.strip() for host in os.getenv("PGREPLICAHOSTS", "").split(","))):
+        server, _, port = host.partition(":")
+        port = port or "5432"
+        replicas.append(Replica(_url("postgresql", server, port), create(_url(dialect, server, port))))
+    if not replicas:
+        return None
+    return ReplicaSet(replicas,
+                      interval=float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "2")),
+                      max_lag=float(os.getenv("DB_REPLICA_MAX_LAG", "30")))
 
 
 class PostgresqlDataRepository:
-    def __init__(self):
-        server = os.getenv("PGHOSTADDR", os.getenv("PGHOST", "localhost"))
-        database = os.getenv("PGDATABASE", "micromap")
-        user = os.getenv("PGUSER", "postgres")
-        password = os.getenv("PGPASSWORD", "postgres")
-        port = os.getenv("PGPORT", "5432")
-        echo = bool(os.getenv("BUILD_MODE", False))  # Suppress logging all statements in production mode.
-        self.engine = create_engine(f"postgresql://{user}:{password}@{server}:{port}/{database}", echo=echo)
-
-    def create_database(self):
+    def __init__(self, engine: Optional[Engine] = None, replicas: Optional[ReplicaSet] = None):
+        """
+        Creates a repository on the given engine, or on a new psycopg2 engine configured by the PG* and DB_* (pool)
+        environment variables, with the read replicas in PGREPLICAHOSTS.
+
+        The public reads of a request may use a replica, see ReplicaRoutingMiddleware. The replica set must be started
+        to find the healthy replicas. Writes, and the reads of the in-process caches, always use the primary engine.
+        """
+        if engine is None:
+            echo = bool(os.getenv("BUILD_MODE", False))  # Suppress logging all statements in production mode.
+
+            def create(url: str) -> Engine:
+                created = create_engine(url, echo=echo, **engine_options())
+                set_statement_timeout(created)
+                instrument(created)
+                profile_statements(created)
+                return created
+
+            engine = create(database_url())
+            replicas = replica_set("postgresql", create)
+        self.engine = engine
+        self.replicas = replicas
+        self.taxonomy_cache = TaxonomyCache(ttl=float(os.getenv("TAXONOMY_CACHE_TTL", "300")))
+        self.thumbnail_size = int(os.getenv("THUMBNAIL_SIZE", "128"))  # Of thumbnails derived from stack files.
+        self.data_versions = DataVersions()
+        # Minimum word similarity (0 to 1) of a name to a search query, if the name does not contain it as a prefix.
+        self.search_similarity = float(os.getenv("SEARCH_WORD_SIMILARITY", "0.5"))
+
+    def _read_engine(self) -> Engine:
+        """Returns the engine for reads that may use a replica: that of the replica chosen for this request, if any."""
+        replica = current_replica.get()
+        return self.engine if replica is None else replica.engine
+
+    def create_database(self) -> List[Migration]:
+        """
+        Creates all missing tables, then migrates the existing ones to the current schema. create_all will not attempt
+        to recreate or alter tables already present. Returns the applied migrations.
+        """
         ORMBase.metadata.create_all(self.engine)  # ORMBase.metadata is the collection of all ORM tables.
+        return upgrade(self.engine)
+
+
+    # Taxonomy cache
+
+    def _taxonomy(self, catalog_id: str) -> TaxonomySnapshot:
+        """Returns the cached taxonomy snapshot of a catalog."""
+        catalog_id = UUID(str(catalog_id))
 
+        def load() -> TaxonomySnapshot:
+            with Session(self.engine) as session:
+                return TaxonomySnapshot.from_rows(
+                    session.scalars(
+                        select(ORMFamily).where(ORMFamily.catalog_id == catalog_id).order_by(ORMFamily.name)
+                    ).all(),
+                    session.scalars(
+                        select(ORMGenus)
+                        .join(ORMFamily, ORMGenus.family_id == ORMFamily.id)
+                        .where(ORMFamily.catalog_id == catalog_id)
+                        .order_by(ORMGenus.name)
+                    ).all(),
+                    session.scalars(
+                        select(ORMSpecies)
+                        .join(ORMGenus, ORMSpecies.genus_id == ORMGenus.id)
+                        .join(ORMFamily, ORMGenus.family_id == ORMFamily.id)
+                        .where(ORMFamily.catalog_id == catalog_id)
+                        .order_by(ORMSpecies.name)
+                    ).all())
+
+        return self.taxonomy_cache.get(("taxonomy", catalog_id), load, catalog_id)
+
+    def _catalog_id_of(self, level: str, taxon_id: str) -> Optional[UUID]:
+        """Returns the (cached) catalog id of a family or genus (level), or None if it does not exist."""
+        taxon_id = UUID(str(taxon_id))
+
+        def load() -> Optional[UUID]:
+            find = self._catalog_ids_of_families if level == "family" else self._catalog_ids_of_genera
+            with Session(self.engine) as session:
+                return next(iter(find(session, [taxon_id])), None)
+
+        return self.taxonomy_cache.get((level, taxon_id), load)
+
+    @staticmethod
+    def _catalog_ids_of_families(session: Session, family_ids: Iterable[UUID]) -> Set[UUID]:
+        return set(session.scalars(select(ORMFamily.catalog_id).where(ORMFamily.id.in_(family_ids))))
+
+    @staticmethod
+    def _catalog_ids_of_genera(session: Session, genus_ids: Iterable[UUID]) -> Set[UUID]:
+        return set(session.scalars(
+            select(ORMFamily.catalog_id)
+            .join(ORMGenus, ORMGenus.family_id == ORMFamily.id)
+            .where(ORMGenus.id.in_(genus_ids))
+        ))
+
+    def _invalidate_taxonomy(self, catalog_ids: Iterable[UUID]):
+        """
+        Drops the cached taxonomy of the given catalogs in this process. Call this after committing a taxonomy change
+        that notified the other processes with notify_changes.
+        """
+        for catalog_id in catalog_ids:
+            self.taxonomy_cache.invalidate(catalog_id)
 
     # Catalogs
 
     def get_catalogs(self) -> Sequence[ORMCatalog]:
-        with Session(self.engine) as session:
+        with Session(self._read_engine()) as session:
             return session.scalars(select(ORMCatalog)).all()
 
     def add_catalog(self, new_catalog: Catalog)-> UUID:
@@ -40,10 +200,13 @@ class PostgresqlDataRepository:
         try:
             with Session(self.engine) as session:
                 session.add(db_item)
+                versions = bump_data_versions(session, [new_uuid])
                 session.commit()
         except IntegrityError as e:
             raise KeyViolationException('IntegrityError', str(e.orig))
 
+        self.data_versions.update(versions)
+
         return new_uuid
 
     def update_catalog(self, updated_catalog: Catalog):
@@ -53,18 +216,18 @@ class PostgresqlDataRepository:
                     select(ORMCatalog).where(ORMCatalog.id == updated_catalog.id)  # type: ignore
                 ).one()
                 catalog.name = updated_catalog.name
+                versions = bump_data_versions(session, [catalog.id])
                 session.commit()
             except NoResultFound:
                 raise EntityDoesNotExistException()
 
+        self.data_versions.update(versions)
+
 
     # Families
 
     def get_families(self, catalog_id: str) -> Sequence[ORMFamily]:
-        with Session(self.engine) as session:
-            return session.scalars(
-                select(ORMFamily).where(ORMFamily.catalog_id == catalog_id).order_by(ORMFamily.name)  # type: ignore
-            ).all()
+        return self._taxonomy(catalog_id).families
 
     def add_family(self, new_family: Family)-> UUID:
         new_uuid = new_family.id or uuid4()
@@ -73,10 +236,17 @@ class PostgresqlDataRepository:
         try:
             with Session(self.engine) as session:
                 session.add(db_item)
+                session.flush()  # Counted in the statistics.
+                self._add_taxon_statistics(session, ORMFamily, [new_uuid])
+                notify_changes(session, [new_family.catalog_id])
+                versions = bump_data_versions(session, [new_family.catalog_id])
                 session.commit()
         except IntegrityError as e:
             raise KeyViolationException('IntegrityError', str(e.orig))
 
+        self._invalidate_taxonomy([new_family.catalog_id])
+        self.data_versions.update(versions)
+
         return new_uuid
 
     def update_family(self, updated_family: Family):
@@ -85,12 +255,21 @@ class PostgresqlDataRepository:
                 family = session.scalars(
                     select(ORMFamily).where(ORMFamily.id == updated_family.id)  # type: ignore
                 ).one()
+                catalog_ids = {family.catalog_id, updated_family.catalog_id}
                 family.name = updated_family.name
                 family.catalog_id = updated_family.catalog_id
+                if len(catalog_ids) > 1:
+                    session.flush()
+                    self._recount_catalog_statistics(session, catalog_ids)
+                notify_changes(session, catalog_ids)
+                versions = bump_data_versions(session, catalog_ids)
                 session.commit()
             except NoResultFound:
                 raise EntityDoesNotExistException()
 
+        self._invalidate_taxonomy(catalog_ids)
+        self.data_versions.update(versions)
+
 
     # Genera
 
@@ -98,20 +277,14 @@ class PostgresqlDataRepository:
         """This function is used to fill in the genera drop down menu using the family_id
         #Additionally if the is_include_if_genus_is_type is untick then it won't return is_type
         Reference filtering handles by hiding the option is not clicked"""
-        if include_type:
-            with Session(self.engine) as session:
-                # Fetch all genera for the given family
-                return session.scalars(
-                    select(ORMGenus).where(ORMGenus.family_id == family_id).order_by(ORMGenus.name)  # type: ignore
-                ).all()
-        else: # if we don't want is_type genus
-            with (Session(self.engine) as session):
-                # Fetch all genera for the given family
-                return session.scalars(
-                    select(ORMGenus).where(ORMGenus.family_id == family_id)  # type: ignore
-                    .where(~ORMGenus.is_type)  # Filter to exclude is_type = True
-                    .order_by(ORMGenus.name)
-                ).all()
+        catalog_id = self._catalog_id_of("family", family_id)
+        if catalog_id is None:
+            return []
+
+        # Fetch all genera for the given family from the cached taxonomy of its catalog
+        taxonomy = self._taxonomy(catalog_id)
+        genera = taxonomy.genera if include_type else taxonomy.genera_without_type  # without is_type genera
+        return genera.get(UUID(str(family_id)), ())
 
     def add_genus(self, new_genus: Genus)-> UUID:
         new_uuid = new_genus.id or uuid4()
@@ -123,30 +296,59 @@ class PostgresqlDataRepository:
         try:
             with Session(self.engine) as session:
                 session.add(db_item)
+                session.flush()  # Counted in the statistics.
+                self._add_taxon_statistics(session, ORMGenus, [new_uuid])
+                catalog_ids = self._catalog_ids_of_families(session, [new_genus.family_id])
+                notify_changes(session, catalog_ids)
+                versions = bump_data_versions(session, catalog_ids)
                 session.commit()
         except IntegrityError as e:
             raise KeyViolationException('IntegrityError', str(e.orig))
 
+        self._invalidate_taxonomy(catalog_ids)
+        self.data_versions.update(versions)
+
         return new_uuid
 
     def update_genus(self, updated_genus: Genus):
         with Session(self.engine) as session:
             try:
                 genus = session.scalars(select(ORMGenus).where(ORMGenus.id == updated_genus.id)).one()  # type: ignore
+                if genus.family_id != updated_genus.family_id:
+                    # Move all items under this genus to the new family.
+                    session.execute(
+                        update(ORMItem)
+                        .where(ORMItem.resolved_genus_id == genus.id)
+                        .values(resolved_family_id=updated_genus.family_id)
+                    )
+                    session.execute(
+                        update(ORMItemStatistic)
+                        .where(ORMItemStatistic.genus_id == genus.id)
+                        .values(family_id=updated_genus.family_id)
+                    )
+                catalog_ids = self._catalog_ids_of_families(session, {genus.family_id, updated_genus.family_id})
                 genus.name = updated_genus.name
                 genus.family_id = updated_genus.family_id
                 genus.is_type = updated_genus.is_type
+                if len(catalog_ids) > 1:
+                    session.flush()
+                    self._recount_catalog_statistics(session, catalog_ids)
+                notify_changes(session, catalog_ids)
+                versions = bump_data_versions(session, catalog_ids)
                 session.commit()
             except NoResultFound:
                 raise EntityDoesNotExistException()
 
+        self._invalidate_taxonomy(catalog_ids)
+        self.data_versions.update(versions)
+
     # Species
 
     def get_species(self, genus_id: str) -> Sequence[ORMSpecies]:
-        with Session(self.engine) as session:
-            return session.scalars(
-                select(ORMSpecies).where(ORMSpecies.genus_id == genus_id).order_by(ORMSpecies.name)  # type: ignore
-            ).all()
+        catalog_id = self._catalog_id_of("genus", genus_id)
+        if catalog_id is None:
+            return []
+        return self._taxonomy(catalog_id).species.get(UUID(str(genus_id)), ())
 
     def add_species(self, new_species: Species)-> UUID:
         new_uuid = new_species.id or uuid4()
@@ -158,10 +360,18 @@ class PostgresqlDataRepository:
         try:
             with Session(self.engine) as session:
                 session.add(db_item)
+                session.flush()  # Counted in the statistics.
+                self._add_taxon_statistics(session, ORMSpecies, [new_uuid])
+                catalog_ids = self._catalog_ids_of_genera(session, [new_species.genus_id])
+                notify_changes(session, catalog_ids)
+                versions = bump_data_versions(session, catalog_ids)
                 session.commit()
         except IntegrityError as e:
             raise KeyViolationException('IntegrityError', str(e.orig))
 
+        self._invalidate_taxonomy(catalog_ids)
+        self.data_versions.update(versions)
+
         return new_uuid
 
     def update_species(self, updated_species: Species):
@@ -170,25 +380,46 @@ class PostgresqlDataRepository:
                 species = session.scalars(
                     select(ORMSpecies).where(ORMSpecies.id == updated_species.id)  # type: ignore
                 ).one()
+                if species.genus_id != updated_species.genus_id:
+                    # Move all items under this species to the new genus and its family.
+                    new_family_id = (
+                        select(ORMGenus.family_id)
+                        .where(ORMGenus.id == updated_species.genus_id)  # type: ignore
+                        .scalar_subquery()
+                    )
+                    session.execute(
+                        update(ORMItem)
+                        .where(ORMItem.resolved_species_id == species.id)
+                        .values(resolved_genus_id=updated_species.genus_id, resolved_family_id=new_family_id)
+                    )
+                    session.execute(
+                        update(ORMItemStatistic)
+                        .where(ORMItemStatistic.species_id == species.id)
+                        .values(genus_id=updated_species.genus_id, family_id=new_family_id)
+                    )
+                catalog_ids = self._catalog_ids_of_genera(session, {species.genus_id, updated_species.genus_id})
                 species.name = updated_species.name
                 species.genus_id = updated_species.genus_id
                 species.is_type = updated_species.is_type
+                if len(catalog_ids) > 1:
+                    session.flush()
+                    self._recount_catalog_statistics(session, catalog_ids)
+                notify_changes(session, catalog_ids)
+                versions = bump_data_versions(session, catalog_ids)
                 session.commit()
             except NoResultFound:
                 raise EntityDoesNotExistException()
 
+        self._invalidate_taxonomy(catalog_ids)
+        self.data_versions.update(versions)
+
     def get_species_in_catalog(self, catalog_id: str) -> Sequence[ORMSpecies]:
-        with Session(self.engine) as session:
-            all_families = select(ORMFamily.id).where(ORMFamily.catalog_id == catalog_id).scalar_subquery()  # type: ignore
-            all_genera = select(ORMGenus.id).where(ORMGenus.family_id.in_(all_families)).scalar_subquery()
-            return session.scalars(
-                select(ORMSpecies).where(ORMSpecies.genus_id.in_(all_genera)).order_by(ORMSpecies.name)
-            ).all()
+        return self._taxonomy(catalog_id).all_species
 
     # Studies
 
     def get_studies(self, catalog_id: str) -> Sequence[ORMStudy]:
-        with Session(self.engine) as session:
+        with Session(self._read_engine()) as session:
             return session.scalars(select(ORMStudy).where(ORMStudy.catalog_id == catalog_id)).all()  # type: ignore
 
     def add_study(self, new_study: Study):
@@ -204,18 +435,25 @@ class PostgresqlDataRepository:
         try:
             with Session(self.engine) as session:
                 session.add(db_item)
+                versions = bump_data_versions(session, [new_study.catalog_id])
                 session.commit()
         except IntegrityError as e:
             raise KeyViolationException('IntegrityError', str(e.orig))
 
+        self.data_versions.update(versions)
+
         return new_uuid
 
 
     # Samples
 
-    def get_samples(self, study_id: str) -> Sequence[ORMSample]:
-        with Session(self.engine) as session:
-            return session.scalars(select(ORMSample).where(ORMSample.study_id == study_id)).all()  # type: ignore
+    def get_samples(self, study_id: str, response_model: Optional[Type[BaseModel]] = None) -> Sequence[ORMSample]:
+        with Session(self._read_engine()) as session:
+            return session.scalars(
+                select(ORMSample)
+                .where(ORMSample.study_id == study_id)  # type: ignore
+                .options(*load_options(ORMSample, response_model))
+            ).all()
 
     def add_sample(self, new_sample: SampleCreateDTO):
         new_uuid = new_sample.id or uuid4()
@@ -231,18 +469,25 @@ class PostgresqlDataRepository:
 
             with Session(self.engine) as session:
                 session.add(db_item)
+                versions = bump_data_versions(session)
                 session.commit()
         except IntegrityError as e:
             raise KeyViolationException('IntegrityError', str(e.orig))
 
+        self.data_versions.update(versions)
+
         return new_uuid
 
 
     # Slides
 
-    def get_slides(self, sample_id: str) -> Sequence[ORMSlide]:
-        with Session(self.engine) as session:
-            return session.scalars(select(ORMSlide).where(ORMSlide.sample_id == sample_id)).all()  # type: ignore
+    def get_slides(self, sample_id: str, response_model: Optional[Type[BaseModel]] = None) -> Sequence[ORMSlide]:
+        with Session(self._read_engine()) as session:
+            return session.scalars(
+                select(ORMSlide)
+                .where(ORMSlide.sample_id == sample_id)  # type: ignore
+                .options(*load_options(ORMSlide, response_model))
+            ).all()
 
     def add_slide(self, new_slide: SlideCreateDTO):
         new_uuid = new_slide.id or uuid4()
@@ -255,10 +500,13 @@ class PostgresqlDataRepository:
         try:
             with Session(self.engine) as session:
                 session.add(db_item)
+                versions = bump_data_versions(session)
                 session.commit()
         except IntegrityError as e:
             raise KeyViolationException('IntegrityError', str(e.orig))
 
+        self.data_versions.update(versions)
+
         return new_uuid
 
 
@@ -268,7 +516,7 @@ class PostgresqlDataRepository:
         new_uuid = new_item.id or uuid4()
         db_item = ORMItem(
             id = new_uuid,
-            key_image = new_item.key_image,
+            thumbnail = None if new_item.key_image is None else b64decode(new_item.key_image),
             family_id = new_item.family_id,
             genus_id = new_item.genus_id,
             species_id = new_item.species_id,
@@ -279,13 +527,80 @@ class PostgresqlDataRepository:
 
         try:
             with Session(self.engine) as session:
+                self._resolve_taxonomy(session, db_item)
                 session.add(db_item)
+                session.flush()  # Counted in the statistics, and referred to by the thumbnail job.
+                self._add_item_statistics(session, [new_uuid])
+                if db_item.thumbnail is None:
+                    self._add_thumbnail_jobs(session, [new_uuid])
+                versions = bump_data_versions(session)
                 session.commit()
         except IntegrityError as e:
             raise KeyViolationException('IntegrityError', str(e.orig))
 
+        self.data_versions.update(versions)
+
         return new_uuid
 
+    @staticmethod
+    def _resolve_taxonomy(session: Session, item: ORMItem):
+        """Sets the resolved species, genus and family of a new item by walking up the taxonomy from its taxon."""
+        species_id = item.species_id
+        if item.subspecies_id is not None:
+            species_id = session.scalar(select(ORMSubSpecies.species_id).where(ORMSubSpecies.id == item.subspecies_id))
+        genus_id = item.genus_id
+        if species_id is not None:
+            genus_id = session.scalar(select(ORMSpecies.genus_id).where(ORMSpecies.id == species_id))
+        family_id = item.family_id
+        if genus_id is not None:
+            family_id = session.scalar(select(ORMGenus.family_id).where(ORMGenus.id == genus_id))
+
+        item.resolved_species_id = species_id
+        item.resolved_genus_id = genus_id
+        item.resolved_family_id = family_id
+
+    def get_thumbnail(self, item_id: UUID) -> Optional[bytes]:
+        """Returns the PNG thumbnail of an item, or None if it has none."""
+        with Session(self.engine) as session:
+            row = session.execute(
+                select(ORMItem.thumbnail, ORMItem.key_image).where(ORMItem.id == item_id)  # type: ignore
+            ).one_or_none()
+
+        if row is None:
+            raise EntityDoesNotExistException()
+
+        thumbnail, key_image = row
+        if thumbnail is None and key_image is not None:
+            return b64decode(key_image)  # Not migrated yet, see `micromap-api migrate --thumbnails`.
+        return thumbnail
+
+    def migrate_thumbnails(self, batch_size: int = 100) -> int:
+        """
+        Moves the base64 key images of existing items to the binary thumbnail column, one batch per transaction.
+        Returns the number of migrated items.
+        """
+        migrated = 0
+        while True:
+            with Session(self.engine) as session:
+                rows = session.execute(
+                    select(ORMItem.id, ORMItem.key_image)
+                    .where(ORMItem.key_image.is_not(None))
+                    .limit(batch_size)
+                    .with_for_update(skip_locked=True)  # Allows running concurrently with another migration.
+                ).all()
+                if not rows:
+                    return migrated
+
+                for item_id, key_image in rows:
+                    session.execute(
+                        update(ORMItem)
+                        .where(ORMItem.id == item_id)
+                        .values(thumbnail=b64decode(key_image), key_image=None)
+                    )
+                session.commit()
+                migrated += len(rows)
+
+
     def get_items(self,
                   family_id: Optional[str] = None,
                   genus_id: Optional[str] = None,
@@ -293,8 +608,15 @@ class PostgresqlDataRepository:
                   include_genus_type = True,
                   include_species_type = True,
                   reference_only: bool = False,
+                  study_id: Optional[str] = None,
+                  sample_id: Optional[str] = None,
+                  slide_id: Optional[str] = None,
+                  order: str = "id",
+                  seed: int = 0,
                   max_results = None,
-                  offset=0) -> List[ORMItem]:
+                  offset=0,
+                  after: Optional[Sequence[str]] = None,
+                  response_model: Optional[Type[BaseModel]] = None) -> List[ORMItem]:
 
         # this function works by input. If family is selected, the family is returned, so all genera and related species are returned
         # if genera is selected, genus and related species are returned
@@ -307,111 +629,558 @@ class PostgresqlDataRepository:
         # Sometimes users may want to filter out is_type #ToDO: highlight if Is_type on the website
         # is_type does not filter from family drop down. It only filters out if is_reference in the study field.
 
-        # TODO: there should be are more elegant way to build this query...
-        items_ids = []
-        #add a condition, if: include non-reference, then reference and non-reference returned. If exclude is_type. Then only on the non-reference filter out is_type true.
-        if not reference_only: #this can be filtered by type
+        # Filtering, ordering and paging are all done in a single statement, so only the requested page is transferred.
+        # The order (see ITEM_ORDERS) ends with the item id, which makes it a stable order for the keyset cursor
+        # (`after`: the sort key of the last item of the previous page). Without a cursor, the page is selected with an
+        # offset.
+        # Every item has its resolved ancestry, so each taxonomic level is a single indexed equality. Items of a family
+        # include those of its genera and species, items of a genus include those of its species.
+        if not (species_id or genus_id or family_id or slide_id or sample_id or study_id):
+            return []
+
+        # Each combination of filters, order and paging has its own query plan, so they are measured apart.
+        taxon = "species" if species_id else "genus" if genus_id else "family" if family_id else "all"
+        container = "slide" if slide_id else "sample" if sample_id else "study" if study_id else "all"
+        paging = "cursor" if after else "offset"
+        label_queries(f"get_items:{taxon},{container},{order},{paging}" + (",reference" if reference_only else ""))
+
+        def filtered(query):
+            if species_id:
+                query = query.where(ORMItem.resolved_species_id == species_id)  # type: ignore
+            elif genus_id:
+                query = query.where(ORMItem.resolved_genus_id == genus_id)  # type: ignore
+            elif family_id:
+                query = query.where(ORMItem.resolved_family_id == family_id)  # type: ignore
+
+            #add a condition, if: include non-reference, then reference and non-reference returned. If exclude is_type. Then only on the non-reference filter out is_type true.
+            if not reference_only: #this can be filtered by type
+                if species_id and not include_species_type: #only select where not is is_type
+                    query = query.join(ORMSpecies, ORMItem.resolved_species_id == ORMSpecies.id).where(~ORMSpecies.is_type)
+                elif genus_id and not include_genus_type: #exclude the items of the genus itself if it is_type
+                    query = (
+                        query
+                        .join(ORMGenus, ORMItem.resolved_genus_id == ORMGenus.id)  # Join with ORMGenus to check is_type
+                        .where(or_(ORMItem.genus_id.is_(None), ~ORMGenus.is_type))  # Items of its species are kept
+                    )
+            else:    #exclude all non-reference. in this case is_check does not need to be considered. Filter out the non-reference
+                query = query.where(ORMItem.slide_id.in_(
+                    select(ORMSlide.id)
+                    .join(ORMSample, ORMSample.id == ORMSlide.sample_id)
+                    .join(ORMStudy, ORMStudy.id == ORMSample.study_id)
+                    .where(ORMStudy.is_reference)
+                ))
+
+            # The slides of a sample and the samples of a study are index-only scans of (parent id, id).
+            if slide_id:
+                query = query.where(ORMItem.slide_id == slide_id)  # type: ignore
+            elif sample_id:
+                query = query.where(ORMItem.slide_id.in_(select(ORMSlide.id).where(ORMSlide.sample_id == sample_id)))
+            elif study_id:
+                query = query.where(ORMItem.slide_id.in_(
+                    select(ORMSlide.id)
+                    .where(ORMSlide.sample_id.in_(select(ORMSample.id).where(ORMSample.study_id == study_id)))
+                ))
+            return query
+
+        def abundance():
+            # Items per taxon, over the filtered items. The statistics are kept per taxon and study, so they have the
+            # counts of the taxon, study and reference filters. The type filters only leave out whole taxa, which
+            # leaves the counts of the other taxa as they are. Samples and slides have no statistics: their items are
+            # counted, which are few, through the (slide_id, id) index.
+            if sample_id or slide_id:
+                taxon = _item_taxon()
+                counts = filtered(select(taxon.label("taxon_id"), func.count().label("abundance")).select_from(ORMItem))
+                return counts.group_by(taxon).subquery("abundance")
+
+            statistics = select(ORMItemStatistic.taxon_id, func.sum(ORMItemStatistic.item_count).label("abundance"))
+            if species_id:
+                statistics = statistics.where(ORMItemStatistic.species_id == species_id)  # type: ignore
+            elif genus_id:
+                statistics = statistics.where(ORMItemStatistic.genus_id == genus_id)  # type: ignore
+            elif family_id:
+                statistics = statistics.where(ORMItemStatistic.family_id == family_id)  # type: ignore
+            if reference_only:
+                statistics = statistics.where(ORMItemStatistic.is_reference)
+            if study_id:
+                statistics = statistics.where(ORMItemStatistic.study_id == study_id)  # type: ignore
+            return statistics.group_by(ORMItemStatistic.taxon_id).subquery("abundance")
+
+        query = filtered(select(ORMItem).options(*load_options(ORMItem, response_model)))
+        query, sort_key = self._item_order(query, order, seed, abundance)
+
+        if after:
+            try:
+                if len(after) != len(sort_key):
+                    raise ValueError
+                # E.g. the ids in the cursor are compared as UUIDs, and the abundance as a number.
+                values = [column.type.python_type(value) for column, value in zip(sort_key, after)]
+            except (ValueError, NotImplementedError):
+                raise InvalidCursorException(after)
+            query = query.where(tuple_(*sort_key) > tuple_(*values))
+        else:
+            query = query.offset(offset)
+
+        with Session(self._read_engine()) as session:
+            rows = session.execute(query.add_columns(*sort_key).order_by(*sort_key).limit(max_results)).all()
+
+        items = []
+        for item, *key in rows:
+            item._sort_key = [str(value) for value in key]  # Not mapped, see get_item_sort_key.
+            items.append(item)
+        return items
+
+    @staticmethod
+    def _item_order(query, order: str, seed: int, abundance: Callable[[], Subquery]) -> Tuple[Any, List[ColumnElement]]:
+        """
+        Adds what the query needs to sort the items in the given order (see ITEM_ORDERS), and returns it with the
+        columns of the sort key, ascending, ending with the item id.
+        """
+        if order == "abundance":
+            # The number of items of the same taxon (see item_statistic), most abundant first.
+            taxon = _item_taxon()
+            counts = abundance()
+            query = query.outerjoin(counts, counts.c.taxon_id == taxon)
+            return query, [(-func.coalesce(counts.c.abundance, 0)).label("negative_abundance"), taxon.label("taxon_id"),
+                           ORMItem.id]
+
+        if order == "name":
+            # The name of the lowest taxonomic level in the resolved ancestry of the item.
+            species, genus, family = aliased(ORMSpecies), aliased(ORMGenus), aliased(ORMFamily)
+            query = (
+                query
+                .outerjoin(species, species.id == ORMItem.resolved_species_id)
+                .outerjoin(genus, genus.id == ORMItem.resolved_genus_id)
+                .outerjoin(family, family.id == ORMItem.resolved_family_id)
+            )
+            name = func.coalesce(species.name, genus.name, family.name, "")
+            return query, [name.label("taxon_name"), ORMItem.id]
+
+        if order == "random":
+            # A deterministic shuffle: the hash of the item id with a seed, which is the same for every page.
+            return query, [func.md5(func.concat(f"{seed}:", ORMItem.id), type_=String).label("random_key"), ORMItem.id]
+
+        return query, [ORMItem.id]
+
+    @staticmethod
+    def get_item_sort_key(item: ORMItem) -> Sequence[str]:
+        """Returns the sort key of an item returned by get_items, used as the keyset cursor for the next page."""
+        return vars(item).get("_sort_key") or [str(item.id)]
+
+    # Statistics
+
+    @staticmethod
+    def _add_item_statistics(session: Session, item_ids: Optional[Sequence[UUID]] = None):
+        """Adds new items (or all items if item_ids is None) to the item statistics, in the session's transaction."""
+        taxon = _item_taxon()
+        counts = (
+            select(taxon.label("taxon_id"),
+                   ORMItem.resolved_species_id,
+                   ORMItem.resolved_genus_id,
+                   ORMItem.resolved_family_id,
+                   ORMSample.study_id,
+                   ORMStudy.is_reference,
+                   func.count().label("item_count"))
+            .join(ORMSlide, ORMItem.slide_id == ORMSlide.id)
+            .join(ORMSample, ORMSlide.sample_id == ORMSample.id)
+            .join(ORMStudy, ORMSample.study_id == ORMStudy.id)
+            .group_by(taxon, ORMItem.resolved_species_id, ORMItem.resolved_genus_id, ORMItem.resolved_family_id,
+                      ORMSample.study_id, ORMStudy.is_reference)
+        )
+        if item_ids is not None:
+            if not item_ids:
+                return
+            counts = counts.where(ORMItem.id.in_(item_ids))
+        counts = counts.subquery()
+
+        statement = insert(ORMItemStatistic).from_select(
+            ["id", "taxon_id", "species_id", "genus_id", "family_id", "study_id", "is_reference", "item_count"],
+            select(func.gen_random_uuid(), *counts.c))
+        session.execute(statement.on_conflict_do_update(
+            index_elements=["taxon_id", "study_id"],
+            set_={"item_count": ORMItemStatistic.item_count + statement.excluded.item_count}))
+
+    @staticmethod
+    def _taxon_counts_by_catalog(orm_class: Type[ORMBase]):
+        """Returns a SELECT of the catalog ids and the number of families, genera or species (orm_class) in each."""
+        query = select(ORMFamily.catalog_id, func.count().label("count")).select_from(orm_class)
+        if orm_class is ORMSpecies:
+            query = query.join(ORMGenus, ORMSpecies.genus_id == ORMGenus.id)
+        if orm_class is not ORMFamily:
+            query = query.join(ORMFamily, ORMGenus.family_id == ORMFamily.id)
+        return query.group_by(ORMFamily.catalog_id)
+
+    def _add_taxon_statistics(self, session: Session, orm_class: Type[ORMBase], ids: Optional[Sequence[UUID]] = None):
+        """Adds new families, genera or species (or all of them if ids is None) to the catalog statistics."""
+        counts = self._taxon_counts_by_catalog(orm_class)
+        if ids is not None:
+            if not ids:
+                return
+            counts = counts.where(orm_class.id.in_(ids))
+
+        column = _CATALOG_STATISTIC_COLUMNS[orm_class]
+        statement = insert(ORMCatalogStatistic).from_select(["id", column], counts)
+        session.execute(statement.on_conflict_do_update(
+            index_elements=["id"],
+            set_={column: getattr(ORMCatalogStatistic, column) + getattr(statement.excluded, column)}))
+
+    def _recount_catalog_statistics(self, session: Session, catalog_ids: Iterable[UUID]):
+        """Counts the taxa of the given catalogs again, e.g. after taxa were moved between them."""
+        catalog_ids = list(catalog_ids)
+        session.execute(
+            update(ORMCatalogStatistic)
+            .where(ORMCatalogStatistic.id.in_(catalog_ids))
+            .values(family_count=0, genus_count=0, species_count=0))
+        for orm_class, column in _CATALOG_STATISTIC_COLUMNS.items():
+            counts = self._taxon_counts_by_catalog(orm_class).where(ORMFamily.catalog_id.in_(catalog_ids))
+            statement = insert(ORMCatalogStatistic).from_select(["id", column], counts)
+            session.execute(statement.on_conflict_do_update(
+                index_elements=["id"], set_={column: getattr(statement.excluded, column)}))
+
+    def rebuild_statistics(self) -> Tuple[int, int]:
+        """
+        Rebuilds the item and catalog statistics from scratch, e.g. after changing the items in the database directly.
+        Writes to the counted tables wait until the rebuild is committed. Returns the number of item statistic rows
+        and the number of catalogs.
+        """
+        with Session(self.engine) as session:
+            session.execute(text("SET LOCAL statement_timeout = 0"))  # May take longer than DB_STATEMENT_TIMEOUT.
+            session.execute(text("LOCK TABLE item, slide, sample, study, family, genus, species IN SHARE MODE"))
+            session.execute(delete(ORMItemStatistic))
+            session.execute(delete(ORMCatalogStatistic))
+            self._add_item_statistics(session)
+            for orm_class in _CATALOG_STATISTIC_COLUMNS:
+                self._add_taxon_statistics(session, orm_class)
+            versions = bump_data_versions(session)
+            session.commit()
+            rows = session.scalar(select(func.count()).select_from(ORMItemStatistic))
+            catalogs = session.scalar(select(func.count()).select_from(ORMCatalogStatistic))
+
+        self.taxonomy_cache.invalidate()
+        self.data_versions.update(versions)
+        return rows, catalogs
+
+    def get_item_count(self,
+                       family_id: Optional[str] = None,
+                       genus_id: Optional[str] = None,
+                       species_id: Optional[str] = None,
+                       study_id: Optional[str] = None,
+                       reference_only: bool = False) -> int:
+        """Returns the number of items of a taxon (including its descendants) and/or study, from the statistics."""
+        query = select(func.coalesce(func.sum(ORMItemStatistic.item_count), 0))
+        if species_id:
+            query = query.where(ORMItemStatistic.species_id == species_id)  # type: ignore
+        elif genus_id:
+            query = query.where(ORMItemStatistic.genus_id == genus_id)  # type: ignore
+        elif family_id:
+            query = query.where(ORMItemStatistic.family_id == family_id)  # type: ignore
+        if study_id:
+            query = query.where(ORMItemStatistic.study_id == study_id)  # type: ignore
+        if reference_only:
+            query = query.where(ORMItemStatistic.is_reference)
+        with Session(self._read_engine()) as session:
+            return session.scalar(query)
+
+
+    # Derivatives
+
+    def _add_thumbnail_jobs(self, session: Session, item_ids: Sequence[UUID]):
+        """Queues deriving the thumbnails of new items without one from their stack files."""
+        if item_ids:
+            session.execute(insert(ORMDerivativeJob), [
+                {"id": uuid4(), "item_id": item_id, "kind": ORMDerivativeJob.THUMBNAIL, "size": self.thumbnail_size}
+                for item_id in item_ids])
+
+    def enqueue_derivatives(self, kind: str, size: int, item_ids: Optional[Sequence[UUID]] = None) -> int:
+        """
+        Queues making a derivative of the given kind and size for all items, or the given ones. Items that have it in
+        that size already, or have a job for it, are skipped, so this can be repeated. Jobs in another size and failed
+        jobs are queued again. Returns the number of queued jobs.
+        """
+        items = select(func.gen_random_uuid(), ORMItem.id, literal(kind), literal(size))
+        if item_ids is not None:
+            items = items.where(ORMItem.id.in_(item_ids))
+        if kind == ORMDerivativeJob.THUMBNAIL:
+            items = items.where(ORMItem.thumbnail_size.is_distinct_from(size))
+
+        statement = insert(ORMDerivativeJob).from_select(["id", "item_id", "kind", "size"], items)
+        statement = statement.on_conflict_do_update(
+            index_elements=["item_id", "kind"],
+            set_={"size": statement.excluded.size, "status": "pending", "attempts": 0, "error": None,
+                  "created_at": func.now()},
+            where=or_(ORMDerivativeJob.size != statement.excluded.size, ORMDerivativeJob.status == "failed"))
+        with Session(self.engine) as session:
+            queued = session.execute(statement).rowcount
+            session.commit()
+        return queued
+
+    def claim_derivative_jobs(self, limit: int, timeout: float) -> Sequence[Row]:
+        """
+        Marks up to limit of the oldest queued jobs as running, and returns their id, item_id, kind and size.
+        Concurrent workers claim different jobs. Jobs that are running for longer than timeout seconds, e.g. of a
+        worker that was stopped, are claimed again.
+        """
+        claimable = (
+            select(ORMDerivativeJob.id)
+            .where(or_(ORMDerivativeJob.status == "pending",
+                       and_(ORMDerivativeJob.status == "running",
+                            ORMDerivativeJob.started_at < func.now() - timedelta(seconds=timeout))))
+            .order_by(ORMDerivativeJob.created_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True))
+        with Session(self.engine) as session:
+            jobs = session.execute(
+                update(ORMDerivativeJob)
+                .where(ORMDerivativeJob.id.in_(claimable))
+                .values(status="running", started_at=func.now(), attempts=ORMDerivativeJob.attempts + 1)
+                .returning(ORMDerivativeJob.id, ORMDerivativeJob.item_id, ORMDerivativeJob.kind, ORMDerivativeJob.size)
+                .execution_options(synchronize_session=False)
+            ).all()
+            session.commit()
+        return jobs
+
+    @staticmethod
+    def _running(job: Row):
+        """Matches a claimed job, unless it was queued again meanwhile, e.g. in another size."""
+        return and_(ORMDerivativeJob.id == job.id, ORMDerivativeJob.status == "running",
+                    ORMDerivativeJob.size == job.size)
+
+    def complete_derivative_job(self, job: Row, thumbnail: Optional[bytes], timings: Dict[str, float]) -> bool:
+        """
+        Marks a claimed job as done with its timings (decode_ms, resize_ms, encode_ms and total_ms), and stores the
+        thumbnail of a thumbnail job. Returns False if the result is outdated, because the job was queued again.
+        """
+        with Session(self.engine) as session:
+            completed = session.execute(
+                update(ORMDerivativeJob)
+                .where(self._running(job))
+                .values(status="done", finished_at=func.now(), error=None, **timings)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if completed and job.kind == ORMDerivativeJob.THUMBNAIL:
+                session.execute(
+                    update(ORMItem)
+                    .where(ORMItem.id == job.item_id)
+                    .values(thumbnail=thumbnail, thumbnail_size=job.size, key_image=None)
+                )
+            session.commit()
+        return bool(completed)
+
+    def fail_derivative_job(self, job: Row, error: str, max_attempts: int):
+        """Queues a claimed job again, or marks it as failed after max_attempts attempts."""
+        with Session(self.engine) as session:
+            session.execute(
+                update(ORMDerivativeJob)
+                .where(self._running(job))
+                .values(status=case((ORMDerivativeJob.attempts >= max_attempts, "failed"), else_="pending"),
+                        finished_at=func.now(),
+                        error=error)
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+
+    def get_derivative_metrics(self) -> List[DerivativeMetrics]:
+        """Returns the number of derivative jobs per kind and status, and the timings of the done ones."""
+        job = ORMDerivativeJob
+        with Session(self.engine) as session:
+            counts = session.execute(select(job.kind, job.status, func.count()).group_by(job.kind, job.status)).all()
+            timings = session.execute(
+                select(job.kind,
+                       func.avg(job.total_ms),
+                       func.percentile_cont(0.95).within_group(job.total_ms),
+                       func.max(job.total_ms),
+                       func.avg(job.decode_ms),
+                       func.avg(job.resize_ms),
+                       func.avg(job.encode_ms))
+                .where(job.status == "done")
+                .group_by(job.kind)
+            ).all()
+
+        metrics: Dict[str, Dict] = {}
+        for kind, status, count in counts:
+            metrics.setdefault(kind, {"kind": kind})[status] = count
+        for kind, mean, p95, maximum, decode, resize, encode in timings:
+            metrics[kind].update(mean_ms=mean, p95_ms=p95, max_ms=maximum, mean_decode_ms=decode,
+                                 mean_resize_ms=resize, mean_encode_ms=encode)
+        return [DerivativeMetrics(**values) for _, values in sorted(metrics.items())]
+
+    def get_pool_metrics(self) -> List[PoolMetrics]:
+        """
+        Returns the state of the connection pools of this process, of the primary and then of every replica, and how
+        long their checkouts waited.
+        """
+        replicas = [] if self.replicas is None else self.replicas.replicas
+        return [pool_metrics(self.engine), *(pool_metrics(replica.engine, replica=True) for replica in replicas)]
+
+
+    # Bulk inserts
+
+    @staticmethod
+    def _bulk_rows(new_rows: Sequence[BaseModel]) -> List[Dict]:
+        """Returns the column values of new rows, generating the ids that are not set."""
+        return [{**new_row.model_dump(), "id": new_row.id or uuid4()} for new_row in new_rows]
+
+    @staticmethod
+    def _missing_parents(session: Session, orm_class: Type[ORMBase], rows: Sequence[Dict]) -> Dict[int, str]:
+        """Checks the foreign keys of new rows, with one query per key. Returns the errors of rows missing a parent."""
+        errors = {}
+        for column in orm_class.__table__.columns:
+            for foreign_key in column.foreign_keys:
+                parent_ids = {row[column.name] for row in rows if row.get(column.name) is not None}
+                if not parent_ids:
+                    continue
+                existing = set(session.scalars(select(foreign_key.column).where(foreign_key.column.in_(parent_ids))))
+                for index, row in enumerate(rows):
+                    if row.get(column.name) is not None and row[column.name] not in existing:
+                        errors[index] = (f"Key ({column.name})=({row[column.name]}) is not present in table "
+                                         f"\"{foreign_key.column.table.name}\".")
+        return errors
+
+    def _bulk_insert(self,
+                     session: Session,
+                     orm_class: Type[ORMBase],
+                     rows: Sequence[Dict],
+                     skip_existing: bool,
+                     errors: Optional[Dict[int, str]] = None) -> BulkInsertResult:
+        """
+        Inserts rows with batched multi-row INSERTs in the session's transaction. Rows that conflict with existing rows
+        (same id or unique name) are skipped if skip_existing is set. Otherwise, and for any other violation, raises a
+        BulkKeyViolationException that reports every offending row, so nothing is inserted.
+        """
+        errors = dict(errors or {})
+        first_index: Dict[UUID, int] = {}
+        for index, row in enumerate(rows):
+            if first_index.setdefault(row["id"], index) != index:
+                errors[index] = f"Key (id)=({row['id']}) is also used by row {first_index[row['id']]}."
+        errors.update(self._missing_parents(session, orm_class, rows))
+        if errors:
+            raise BulkKeyViolationException(errors)
+
+        # ON CONFLICT DO NOTHING only returns the inserted rows, which tells which rows conflict without aborting the
+        # transaction at the first one.
+        inserted = set(session.scalars(
+            insert(orm_class).on_conflict_do_nothing().returning(orm_class.id),
+            rows))
+
+        result = BulkInsertResult(ids=[row["id"] for row in rows if row["id"] in inserted],
+                                  skipped=[row["id"] for row in rows if row["id"] not in inserted])
+        if result.skipped and not skip_existing:
+            raise BulkKeyViolationException({
+                index: f"Key (id)=({row['id']}) or its name already exists."
+                for index, row in enumerate(rows) if row["id"] not in inserted})
+        return result
+
+    def _bulk_insert_taxa(self,
+                          orm_class: Type[ORMBase],
+                          new_taxa: Sequence[BaseModel],
+                          parent_key: str,
+                          catalog_ids_of: Callable[[Session, Set[UUID]], Set[UUID]],
+                          skip_existing: bool) -> BulkInsertResult:
+        """
+        Bulk inserts families, genera or species, and invalidates the taxonomy of the catalogs they belong to, which
+        catalog_ids_of finds from the parent ids (parent_key) of the inserted taxa.
+        """
+        rows = self._bulk_rows(new_taxa)
+        try:
             with Session(self.engine) as session:
-                if species_id:
-                    if include_species_type:
-                        items_ids = session.scalars(
-                            select(ORMItem.id)
-                            .where(ORMItem.species_id == species_id)  # type: ignore
-                        ).all()
-                    else: #only select where not is is_type
-                        items_ids = session.scalars(
-                            select(ORMItem.id)
-                            .join(ORMSpecies, ORMItem.species_id == ORMSpecies.id)
-                            .where(
-                                ORMItem.species_id == species_id,  # type: ignore
-                                ~ORMSpecies.is_type
-                            )
-                        ).all()
-                elif genus_id: #genus first check to include non-reference
-                    if include_genus_type: #condition if by default returning genus_is_type, include items that are under the  species
-                        subq_species = select(ORMSpecies.id).where(ORMSpecies.genus_id == genus_id).scalar_subquery()  # type: ignore
-                        items_ids = session.scalars(
-                            select(ORMItem.id)
-                            .where(or_(ORMItem.genus_id == genus_id, ORMItem.species_id.in_(subq_species)))
-                        ).all()
-                    else: #the same fetch request but exclude Is_type
-                        subq_species = select(ORMSpecies.id).where(ORMSpecies.genus_id == genus_id).scalar_subquery()  # type: ignore
-                        # don't select is_type false
-                        items_ids = session.scalars(
-                            select(ORMItem.id)
-                            .join(ORMGenus,
-                                  ORMGenus.id == ORMItem.genus_id)  # Ensure we join with ORMGenus to check is_type
-                            .where(
-                                or_(
-                                    # Case 1: Item belongs to the genus, and genus is not a reference type (is_type != True)
-                                    and_(
-                                        ORMItem.genus_id == genus_id,  # Genus ID matches
-                                        ~ORMGenus.is_type  # Genus is not of type (non-reference)
-                                    ),
-                                    # Case 2: Item belongs to a species of the genus
-                                    ORMItem.species_id.in_(subq_species)  # Item belongs to a species under the genus
-                                )
-                            )
-                        ).all()
-
-                elif family_id:
-                    # 2 subqueries are required to capture all those that are genera and species under this item
-                    subq_genera = select(ORMGenus.id).where(ORMGenus.family_id == family_id).scalar_subquery()  # type: ignore
-                    subq_species = select(ORMSpecies.id).where(ORMSpecies.genus_id.in_(subq_genera)).scalar_subquery()
-                    items_ids = session.scalars(
-                        select(ORMItem.id)
-                        .where(or_(ORMItem.family_id == family_id, ORMItem.genus_id.in_(subq_genera), ORMItem.species_id.in_(subq_species)))
-                    ).all()
-        else:    #exclude all non-reference. in this case is_check does not need to be considered. Filter out the non-reference
+                result = self._bulk_insert(session, orm_class, rows, skip_existing)
+                self._add_taxon_statistics(session, orm_class, result.ids)
+                inserted = set(result.ids)
+                catalog_ids = catalog_ids_of(session, {row[parent_key] for row in rows if row["id"] in inserted})
+                if catalog_ids:
+                    notify_changes(session, catalog_ids)
+                versions = bump_data_versions(session, catalog_ids)
+                session.commit()
+        except IntegrityError as e:
+            raise KeyViolationException('IntegrityError', str(e.orig))
+
+        self._invalidate_taxonomy(catalog_ids)
+        self.data_versions.update(versions)
+
+        return result
+
+    def bulk_add_families(self, new_families: Sequence[Family], skip_existing: bool = False) -> BulkInsertResult:
+        return self._bulk_insert_taxa(
+            ORMFamily, new_families, "catalog_id", lambda session, catalog_ids: catalog_ids, skip_existing)
+
+    def bulk_add_genera(self, new_genera: Sequence[Genus], skip_existing: bool = False) -> BulkInsertResult:
+        return self._bulk_insert_taxa(
+            ORMGenus, new_genera, "family_id", self._catalog_ids_of_families, skip_existing)
+
+    def bulk_add_species(self, new_species: Sequence[Species], skip_existing: bool = False) -> BulkInsertResult:
+        return self._bulk_insert_taxa(
+            ORMSpecies, new_species, "genus_id", self._catalog_ids_of_genera, skip_existing)
+
+    def _bulk_add(self,
+                  orm_class: Type[ORMBase],
+                  new_rows: Sequence[BaseModel],
+                  skip_existing: bool) -> BulkInsertResult:
+        """Bulk inserts rows that need no further processing, such as samples and slides."""
+        rows = self._bulk_rows(new_rows)
+        try:
             with Session(self.engine) as session:
-                if species_id:
-                    items_ids = session.scalars(
-                        select(ORMItem.id)  # need to join slide to item to study
-                        .join(ORMSlide, ORMItem.slide_id == ORMSlide.id)
-                        .join(ORMSample, ORMSample.id == ORMSlide.sample_id)
-                        .join(ORMStudy, ORMStudy.id == ORMSample.study_id)
-                        .where(ORMStudy.is_reference)
-                        .where(ORMItem.species_id == species_id)  # type: ignore
-                    ).all()
-                elif genus_id:
-                    subq_species = select(ORMSpecies.id).where(ORMSpecies.genus_id == genus_id).scalar_subquery()  # type: ignore
-                    items_ids = session.scalars(
-                        select(ORMItem.id) #need to join slide to item to study
-                        .join(ORMSlide, ORMItem.slide_id == ORMSlide.id)
-                        .join(ORMSample, ORMSample.id == ORMSlide.sample_id)
-                        .join(ORMStudy, ORMStudy.id == ORMSample.study_id)
-                        .where(ORMStudy.is_reference)
-                        .where(or_(ORMItem.genus_id == genus_id, ORMItem.species_id.in_(subq_species)))
-                    ).all()
-                elif family_id:
-                    subq_genera = select(ORMGenus.id).where(ORMGenus.family_id == family_id).scalar_subquery()  # type: ignore
-                    subq_species = select(ORMSpecies.id).where(ORMSpecies.genus_id.in_(subq_genera)).scalar_subquery()
-                    items_ids = session.scalars(
-                        select(ORMItem.id)
-                        .join(ORMSlide, ORMItem.slide_id == ORMSlide.id)
-                        .join(ORMSample, ORMSample.id == ORMSlide.sample_id)
-                        .join(ORMStudy, ORMStudy.id == ORMSample.study_id)
-                        .where(ORMStudy.is_reference)
-                        .where(or_(ORMItem.family_id == family_id, ORMItem.genus_id.in_(subq_genera), ORMItem.species_id.in_(subq_species)))
-                    ).all()
-
-
-        if items_ids:
-            #Use a limit before the heavy query
-            paginated_ids = items_ids[offset: offset + max_results]# this ensures that the output is limited to a max number
-
-        #return items not just ids (more efficient)
+                result = self._bulk_insert(session, orm_class, rows, skip_existing)
+                versions = bump_data_versions(session)
+                session.commit()
+        except IntegrityError as e:
+            raise KeyViolationException('IntegrityError', str(e.orig))
+
+        self.data_versions.update(versions)
+
+        return result
+
+    def bulk_add_samples(self,
+                         new_samples: Sequence[SampleCreateDTO],
+                         skip_existing: bool = False) -> BulkInsertResult:
+        return self._bulk_add(ORMSample, new_samples, skip_existing)
+
+    def bulk_add_slides(self, new_slides: Sequence[SlideCreateDTO], skip_existing: bool = False) -> BulkInsertResult:
+        return self._bulk_add(ORMSlide, new_slides, skip_existing)
+
+    def bulk_add_items(self, new_items: Sequence[ItemCreateDTO], skip_existing: bool = False) -> BulkInsertResult:
+        rows = self._bulk_rows(new_items)
+        errors = {}
+        for index, row in enumerate(rows):
+            key_image = row.pop("key_image")
+            row["thumbnail"] = None if key_image is None else b64decode(key_image)
+            # Checked here as well, so the violations of force_single_taxon are reported per row.
+            if sum(row[key] is not None for key in ("subspecies_id", "species_id", "genus_id", "family_id")) != 1:
+                errors[index] = "Exactly one of subspecies_id, species_id, genus_id and family_id must be set."
+
+        try:
             with Session(self.engine) as session:
-                items = list(session.scalars(
-                select(ORMItem).where(ORMItem.id.in_(paginated_ids))
-                 ).all())
+                self._resolve_taxonomies(session, rows)
+                result = self._bulk_insert(session, ORMItem, rows, skip_existing, errors)
+                inserted = set(result.ids)
+                self._add_item_statistics(session, result.ids)
+                self._add_thumbnail_jobs(session, [row["id"] for row in rows
+                                                   if row["id"] in inserted and row["thumbnail"] is None])
+                versions = bump_data_versions(session)
+                session.commit()
+        except IntegrityError as e:
+            raise KeyViolationException('IntegrityError', str(e.orig))
+
+        self.data_versions.update(versions)
+
+        return result
+
+    @staticmethod
+    def _resolve_taxonomies(session: Session, rows: Sequence[Dict]):
+        """Like _resolve_taxonomy, for the column values of many new items, with one query per taxonomic level."""
+        def parents(child_id: Column, parent_id: Column, ids: Set[UUID]) -> Dict[UUID, UUID]:
+            ids.discard(None)
+            return dict(session.execute(select(child_id, parent_id).where(child_id.in_(ids))).all()) if ids else {}
 
-            # Shuffle after query but with a seed, so it is reproducible
-            random.seed(0)
-            random.shuffle(items)  # This shuffles the actual ORMItem objects
+        species_of = parents(ORMSubSpecies.id, ORMSubSpecies.species_id, {row["subspecies_id"] for row in rows})
+        for row in rows:
+            row["resolved_species_id"] = species_of.get(row["subspecies_id"], row["species_id"])
 
-            return items
-        return [] # return an empty list if nothing else
+        genus_of = parents(ORMSpecies.id, ORMSpecies.genus_id, {row["resolved_species_id"] for row in rows})
+        for row in rows:
+            row["resolved_genus_id"] = genus_of.get(row["resolved_species_id"], row["genus_id"])
+
+        family_of = parents(ORMGenus.id, ORMGenus.family_id, {row["resolved_genus_id"] for row in rows})
+        for row in rows:
+            row["resolved_family_id"] = family_of.get(row["resolved_genus_id"], row["family_id"])
 
 
     def get_genera_by_letter(self, letter: str, include_genus_type: bool = True):
@@ -421,7 +1190,10 @@ class PostgresqlDataRepository:
 
         If `is_include_if_genus_is_type` is False, genera where ORMGenus.is_type is True will be excluded.
         """
-        with Session(self.engine) as session:
+        # A constant prefix pattern on lower(name) can use its index, unlike ILIKE. Escape the LIKE wildcards.
+        pattern = _escape_like(letter.lower()) + "%"
+
+        with Session(self._read_engine()) as session:
             query = (
                 select(
                     ORMGenus.id,
@@ -430,13 +1202,13 @@ class PostgresqlDataRepository:
                     ORMFamily.name
                 )
                 .join(ORMFamily, ORMGenus.family_id == ORMFamily.id)
-                .where(ORMGenus.name.ilike(f'{letter}%'))
+                .where(func.lower(ORMGenus.name).like(pattern))
             )
 
             if not include_genus_type:
-                query.where(ORMGenus.is_type.is_(False))
+                query = query.where(ORMGenus.is_type.is_(False))
 
-            query.order_by(ORMGenus.name)
+            query = query.order_by(ORMGenus.name)
 
             genera = session.execute(query).all()
 
@@ -449,21 +1221,81 @@ class PostgresqlDataRepository:
 
         return genera_dicts
 
+    def search_taxa(self,
+                    query: str,
+                    catalog_id: Optional[str] = None,
+                    max_results: int = 20) -> List[TaxonSearchResult]:
+        """
+        Searches the families, genera and species by name, best match first: exact matches, then names that start with
+        the query, then names with a word that starts with it, then names with a word similar to it (pg_trgm word
+        similarity, which tolerates typos). Every condition can use the trigram index on the lower-case name, so the
+        search does not scan the taxa. The (word) prefix matches are ranked by the similarity of the whole name, since
+        the word similarity of a prefix is 1, like that of an exact match.
+        """
+        term = query.strip().lower()
+        prefix = _escape_like(term) + "%"
+        word_prefix = "% " + prefix
+
+        def search(level: str, orm_class: Type[ORMBase], *parents: Column, joins: Sequence = ()) -> Sequence[Row]:
+            name = func.lower(orm_class.name)
+            similarity = func.similarity(term, name)
+            score = case((name == term, 3.0),
+                         (name.like(prefix), 2.0 + similarity),
+                         (name.like(word_prefix), 1.0 + similarity),
+                         else_=func.word_similarity(term, name)).label("score")
+            statement = select(literal(level).label("level"), orm_class.id, orm_class.name, *parents,
+                               score).select_from(orm_class)
+            for target, on in joins:
+                statement = statement.join(target, on)
+            statement = statement.where(or_(name.like(prefix), name.like(word_prefix),
+                                            literal(term).op("<%", is_comparison=True)(name)))
+            if catalog_id:
+                statement = statement.where(ORMFamily.catalog_id == catalog_id)
+            return session.execute(statement.order_by(score.desc(), orm_class.name).limit(max_results)).all()
+
+        with Session(self._read_engine()) as session:
+            session.execute(select(func.set_config("pg_trgm.word_similarity_threshold", str(self.search_similarity),
+                                                   True)))  # For this transaction only.
+            rows = [
+                *search("family", ORMFamily),
+                *search("genus", ORMGenus, ORMGenus.is_type, ORMFamily.id.label("family_id"),
+                        ORMFamily.name.label("family_name"),
+                        joins=[(ORMFamily, ORMGenus.family_id == ORMFamily.id)]),
+                *search("species", ORMSpecies, ORMSpecies.is_type, ORMGenus.id.label("genus_id"),
+                        ORMGenus.name.label("genus_name"), ORMFamily.id.label("family_id"),
+                        ORMFamily.name.label("family_name"),
+                        joins=[(ORMGenus, ORMSpecies.genus_id == ORMGenus.id),
+                               (ORMFamily, ORMGenus.family_id == ORMFamily.id)]),
+            ]
+
+        rows.sort(key=lambda row: (-row.score, row.name))
+        return [TaxonSearchResult(**row._mapping) for row in rows[:max_results]]
+
 ##### for the dashboard summary: Part 1 is a test to show species count######
+    def _taxon_counts(self) -> Dict[str, int]:
+        """Returns the (cached) number of families, genera and species in all catalogs, from the statistics."""
+        def load() -> Dict[str, int]:
+            with Session(self.engine) as session:
+                counts = session.execute(select(
+                    func.coalesce(func.sum(ORMCatalogStatistic.family_count), 0),
+                    func.coalesce(func.sum(ORMCatalogStatistic.genus_count), 0),
+                    func.coalesce(func.sum(ORMCatalogStatistic.species_count), 0),
+                )).one()
+                return {"family": counts[0], "genus": counts[1], "species": counts[2]}
+
+        return self.taxonomy_cache.get(("counts",), load)
+
     #species count
     def get_species_count(self) -> int:  # Add 'self'
-        with Session(self.engine) as session:
-            return session.scalar(select(func.count()).select_from(ORMSpecies))
+        return self._taxon_counts()["species"]
 
     #genera count
     def get_genera_count(self) -> int:  # Add 'self'
-        with Session(self.engine) as session:
-            return session.scalar(select(func.count()).select_from(ORMGenus))
+        return self._taxon_counts()["genus"]
 
     #family count
     def get_family_count(self) -> int:  # Add 'self'
-        with Session(self.engine) as session:
-            return session.scalar(select(func.count()).select_from(ORMFamily))
+        return self._taxon_counts()["family"]
 
 
     # #Return a list of family by letter. Used for alphabetical search
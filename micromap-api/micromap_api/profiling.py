@@ -0,0 +1,202 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Callable, Deque, Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .models import RequestProfile, StatementProfile
+
+# Opt-in profiling of requests, see ProfilingMiddleware. Profiling a request only costs a few timer calls, except for
+# the EXPLAIN ANALYZE of its slow statements.
+
+# The profile of the current request, or None if it is not profiled.
+current_profile: ContextVar[Optional["Profile"]] = ContextVar("current_profile", default=None)
+
+PROFILE_HEADER = "x-profile"  # Carries the API key, to profile a single request.
+
+# The parts of a request, in the order of the Server-Timing header.
+SECTIONS = {
+    "pool": "Waiting for a database connection",
+    "sql": "SQL statements",
+    "orm": "Repository, outside SQL statements: ORM hydration and Python",
+    "serialization": "JSON serialization",
+    "explain": "EXPLAIN ANALYZE of the slow statements, by the profiler",
+}
+
+
+class Profile:
+    """The time spent per section of one request, and its slow statements."""
+    def __init__(self, slow_statement_ms: float, explain: bool):
+        self.slow_statement_ms = slow_statement_ms
+        self.explain = explain
+        self.started_at = datetime.now(timezone.utc)
+        self.durations: Dict[str, float] = {}  # Seconds per section, and in the repository ("repository").
+        self.statement_count = 0
+        self.statements: List[StatementProfile] = []
+
+    def add(self, section: str, duration: float):
+        self.durations[section] = self.durations.get(section, 0.0) + duration
+
+    def sections(self) -> Dict[str, float]:
+        """Returns the seconds spent per section (see SECTIONS)."""
+        sections = {name: self.durations.get(name, 0.0) for name in SECTIONS}
+        sections["orm"] = max(self.durations.get("repository", 0.0) - sections["pool"] - sections["sql"]
+                              - sections["explain"], 0.0)
+        return sections
+
+
+@contextmanager
+def section(name: str):
+    """Adds the time spent in the block to a section of the profile of the current request, if it is profiled."""
+    profile = current_profile.get()
+    if profile is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, time.perf_counter() - start)
+
+
+def record(name: str, duration: float):
+    """Adds a duration (in seconds) to a section of the profile of the current request, if it is profiled."""
+    profile = current_profile.get()
+    if profile is not None:
+        profile.add(name, duration)
+
+
+def profile_statements(engine: Engine):
+    """
+    Times the SQL statements of an engine for the profile of the current request. Slow SELECT statements are explained
+    with EXPLAIN ANALYZE, which runs them a second time.
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        context.profile_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        profile = current_profile.get()
+        if profile is None:
+            return
+
+        duration = time.perf_counter() - context.profile_start
+        profile.add("sql", duration)
+        profile.statement_count += 1
+        if duration * 1000 < profile.slow_statement_ms:
+            return
+
+        plan = None
+        if profile.explain and not executemany and statement.lstrip()[:6].upper() in ("SELECT", "WITH"):
+            # The rows of the statement were fetched already, so its connection can run another one.
+            start = time.perf_counter()
+            explain_cursor = connection.connection.cursor()
+            try:
+                explain_cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + statement, parameters)
+                plan = "\n".join(row[0] for row in explain_cursor.fetchall())
+            finally:
+                explain_cursor.close()
+                profile.add("explain", time.perf_counter() - start)
+        profile.statements.append(StatementProfile(sql=statement, duration_ms=duration * 1000, plan=plan))
+
+
+class ProfileBuffer:
+    """Thread-safe ring buffer of the most recent request profiles of this process."""
+    def __init__(self, size: int = 100):
+        self._profiles: Deque[RequestProfile] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, profile: RequestProfile):
+        with self._lock:
+            self._profiles.append(profile)
+
+    def recent(self) -> List[RequestProfile]:
+        """Returns the profiles, most recent first."""
+        with self._lock:
+            return list(reversed(self._profiles))
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that profiles a request if the PROFILE_HEADER carries the API key (see authorized), or every
+    request if profile_all is set. The profile is sent in the Server-Timing header of the response, per section (see
+    SECTIONS), so browser developer tools show it next to the request.
+
+    Requests profiled by header, and other profiled requests that took at least slow_request_ms, are added to the
+    buffer, with their slow statements. The slow statements of requests profiled by header are explained, those of the
+    others only if explain_all is set, since EXPLAIN ANALYZE runs them a second time.
+    """
+    def __init__(self,
+                 app,
+                 buffer: ProfileBuffer,
+                 authorized: Callable[[str], bool],
+                 profile_all: bool = False,
+                 slow_request_ms: float = 500.0,
+                 slow_statement_ms: float = 100.0,
+                 explain: bool = True,
+                 explain_all: bool = False):
+        self.app = app
+        self.buffer = buffer
+        self.authorized = authorized
+        self.profile_all = profile_all
+        self.slow_request_ms = slow_request_ms
+        self.slow_statement_ms = slow_statement_ms
+        self.explain = explain
+        self.explain_all = explain_all
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        key = dict(scope["headers"]).get(PROFILE_HEADER.encode())
+        requested = key is not None and self.authorized(key.decode("latin-1"))
+        if not (requested or self.profile_all):
+            await self.app(scope, receive, send)
+            return
+
+        # Only the statements of GET requests are explained, since a SELECT of a write may have side effects, like
+        # SELECT pg_notify(...).
+        profile = Profile(self.slow_statement_ms,
+                          self.explain and (requested or self.explain_all) and scope["method"] == "GET")
+        token = current_profile.set(profile)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                sections = profile.sections()
+                timings = [f'{name};dur={sections[name] * 1000:.1f};desc="{description}"'
+                           for name, description in SECTIONS.items()]
+                total = (time.perf_counter() - start) * 1000
+                timings.append(f'total;dur={total:.1f};desc="Until the response started"')
+                message = {**message, "headers": [*message.get("headers", []),
+                                                  (b"server-timing", ", ".join(timings).encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_profile.reset(token)
+            total_ms = (time.perf_counter() - start) * 1000
+            if requested or total_ms >= self.slow_request_ms:
+                entry = RequestProfile(
+                    method=scope["method"],
+                    path=scope["path"],
+                    query=scope["query_string"].decode("latin-1"),
+                    status=status,
+                    started_at=profile.started_at,
+                    total_ms=total_ms,
+                    sql_statements=profile.statement_count,
+                    statements=profile.statements,
+                    **{f"{name}_ms": duration * 1000 for name, duration in profile.sections().items()})
+                self.buffer.add(entry)
@@ -0,0 +1,117 @@
+from io import BytesIO
+from math import ceil
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Sequence, Tuple
+from uuid import UUID
+
+from .chunkfile import ChunkFile, InvalidChunkFileException, open_chunk_file, write_chunk_file
+
+if TYPE_CHECKING:
+    from PIL import Image  # Only needed to write pyramids, see the 'import' extra in setup.py.
+
+TILE_SIZE = 256
+
+
+def pyramid_path(stack_path: Path, item_id: UUID) -> Path:
+    return stack_path / f"{item_id}.pyramid"
+
+
+def level_count(width: int, height: int, tile_size: int) -> int:
+    """Returns the number of resolution levels needed until the whole image fits in a single tile."""
+    levels = 1
+    while max(width, height) > tile_size:
+        width, height = ceil(width / 2), ceil(height / 2)
+        levels += 1
+    return levels
+
+
+class Pyramid:
+    """
+    Multi-resolution tiles of all focus levels of an item, stored in a chunk file. Resolution level 0 is the full
+    resolution, and each next level halves the width and height, until the image fits in a single tile. Tiles are
+    PNGs of tile_size x tile_size pixels, except at the right and bottom edges.
+    """
+
+    def __init__(self, chunk_file: ChunkFile):
+        header = chunk_file.header
+        if header.get("format") != "pyramid":
+            raise InvalidChunkFileException("Not a pyramid.")
+        self.chunk_file = chunk_file
+        try:
+            self.width: int = header["width"]
+            self.height: int = header["height"]
+            self.depth: int = header["depth"]  # Number of focus levels.
+            self.tile_size: int = header["tile_size"]
+            self.levels: int = header["levels"]
+        except KeyError as e:
+            raise InvalidChunkFileException(f"The pyramid header has no {e}.")
+
+        # Chunks are ordered by focus level, resolution level, row and column.
+        self._level_offsets: List[int] = []
+        self._tiles_per_focus_level = 0
+        for level in range(self.levels):
+            self._level_offsets.append(self._tiles_per_focus_level)
+            columns, rows = self.grid(level)
+            self._tiles_per_focus_level += columns * rows
+        if chunk_file.chunk_count != self.depth * self._tiles_per_focus_level:
+            raise InvalidChunkFileException("The pyramid does not have a tile for every focus and resolution level.")
+
+    def level_size(self, level: int) -> Tuple[int, int]:
+        return ceil(self.width / 2 ** level), ceil(self.height / 2 ** level)
+
+    def grid(self, level: int) -> Tuple[int, int]:
+        """Returns the number of tile columns and rows of a resolution level."""
+        width, height = self.level_size(level)
+        return ceil(width / self.tile_size), ceil(height / self.tile_size)
+
+    def tile(self, z: int, level: int, x: int, y: int) -> memoryview:
+        """Returns the PNG tile in column x and row y of a resolution level of focus level z. Raises an IndexError."""
+        if not (0 <= z < self.depth and 0 <= level < self.levels):
+            raise IndexError((z, level))
+        columns, rows = self.grid(level)
+        if not (0 <= x < columns and 0 <= y < rows):
+            raise IndexError((x, y))
+        return self.chunk_file.chunk(z * self._tiles_per_focus_level + self._level_offsets[level] + y * columns + x)
+
+    def info(self) -> Dict[str, Any]:
+        return {"width": self.width, "height": self.height, "depth": self.depth, "tile_size": self.tile_size,
+                "levels": self.levels}
+
+
+def open_pyramid(stack_path: Path, item_id: UUID) -> Pyramid:
+    """
+    Returns the (cached, memory-mapped) pyramid of an item. Raises FileNotFoundError, or InvalidChunkFileException if
+    the file is not a valid pyramid.
+    """
+    return Pyramid(open_chunk_file(pyramid_path(stack_path, item_id)))
+
+
+def write_pyramid(path: Path, layers: Sequence["Image.Image"], tile_size: int = TILE_SIZE):
+    """Writes the pyramid of a focus stack, given the Pillow images of its focus levels, which must be equally sized."""
+    width, height = layers[0].size
+    levels = level_count(width, height, tile_size)
+
+    chunks = []
+    for layer in layers:
+        if layer.size != (width, height):
+            raise ValueError(f"Focus levels are not of equal size: {layer.size} and {(width, height)}.")
+
+        image = layer
+        for level in range(levels):
+            if level > 0:
+                image = image.reduce(2)  # Box filter, rounding the size up like level_size.
+            for top in range(0, image.height, tile_size):
+                for left in range(0, image.width, tile_size):
+                    tile = BytesIO()
+                    image.crop((left, top, min(left + tile_size, image.width), min(top + tile_size, image.height))) \
+                        .save(tile, format="PNG")
+                    chunks.append(tile.getvalue())
+
+    write_chunk_file(path, {
+        "format": "pyramid",
+        "width": width,
+        "height": height,
+        "depth": len(layers),
+        "tile_size": tile_size,
+        "levels": levels,
+    }, chunks)
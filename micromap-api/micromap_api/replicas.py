@@ -0,0 +1,156 @@
+import logging
+import threading
+from contextvars import ContextVar
+from http.cookies import SimpleCookie
+from typing import Callable, Dict, Iterable, List, Optional
+from uuid import UUID
+
+import psycopg2
+from sqlalchemy.engine import Engine
+
+from .notifications import ALL_CATALOGS_ID
+from .ormmodels import ORMDataVersion
+
+logger = logging.getLogger(__name__)
+
+# The replica that serves the reads of the current request, or None to read from the primary.
+current_replica: ContextVar[Optional["Replica"]] = ContextVar("current_replica", default=None)
+
+# The cookie with the data version of the last write of a client, see ReplicaRoutingMiddleware. Without a hyphen, so
+# nginx can read it as $cookie_micromap_written.
+VERSION_COOKIE = "micromap_written"
+
+
+class Replica:
+    """A read-only copy of the primary database, and its state as of its last health check."""
+    def __init__(self, dsn: str, engine: Engine):
+        self.dsn = dsn  # For the psycopg2 connection of the health checks.
+        self.engine = engine  # For the queries.
+        self.healthy = False
+        self.lag = 0.0  # Seconds that the replayed data lags behind the primary.
+        self.versions: Dict[UUID, int] = {}  # The data versions that the replica has replayed.
+
+    def version(self, catalog_id: Optional[UUID] = None) -> int:
+        return self.versions.get(ALL_CATALOGS_ID if catalog_id is None else catalog_id, 0)
+
+
+class ReplicaSet(threading.Thread):
+    """
+    Round-robin choice of the healthy replicas. A background thread checks every interval seconds if each replica can
+    be reached, how far it lags behind (max_lag seconds at most), and which data versions it has replayed.
+    """
+    def __init__(self, replicas: Iterable[Replica], interval: float = 2.0, max_lag: float = 30.0):
+        super().__init__(name="micromap-replica-monitor", daemon=True)
+        self.replicas: List[Replica] = list(replicas)
+        self.interval = interval
+        self.max_lag = max_lag
+        self._next = 0
+        self._lock = threading.Lock()
+        self._connections: Dict[str, psycopg2.extensions.connection] = {}
+        self._stopped = threading.Event()
+
+    def choose(self, minimum_version: int = 0) -> Optional[Replica]:
+        """
+        Returns the next healthy replica that has replayed at least the given data version (of all catalogs), or None
+        if there is none.
+        """
+        with self._lock:
+            for _ in range(len(self.replicas)):
+                replica = self.replicas[self._next]
+                self._next = (self._next + 1) % len(self.replicas)
+                if replica.healthy and replica.version() >= minimum_version:
+                    return replica
+        return None
+
+    def check(self, replica: Replica):
+        """Updates the state of the replica. A replica that cannot be reached is unhealthy until the next check."""
+        try:
+            connection = self._connections.get(replica.dsn)
+            if connection is None or connection.closed:
+                connection = self._connections[replica.dsn] = psycopg2.connect(replica.dsn, connect_timeout=5)
+                connection.autocommit = True
+            with connection.cursor() as cursor:
+                # Without incoming changes, the replay timestamp gets old while the replica is up to date.
+                cursor.execute(
+                    "SELECT CASE WHEN NOT pg_is_in_recovery() "
+                    "OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                    "ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0) END")
+                replica.lag = float(cursor.fetchone()[0])
+                cursor.execute(f"SELECT id, version FROM {ORMDataVersion.__tablename__}")
+                replica.versions = {UUID(str(catalog_id)): version for catalog_id, version in cursor.fetchall()}
+            replica.healthy = replica.lag <= self.max_lag
+        except psycopg2.Error as exc:
+            if replica.healthy:
+                logger.warning("Replica %s is unavailable: %s", replica.engine.url.host, exc)
+            replica.healthy = False
+            connection = self._connections.pop(replica.dsn, None)
+            if connection is not None:
+                connection.close()
+
+    def run(self):
+        while not self._stopped.is_set():
+            for replica in self.replicas:
+                self.check(replica)
+            self._stopped.wait(self.interval)
+        for connection in self._connections.values():
+            connection.close()
+
+    def stop(self):
+        self._stopped.set()
+
+
+class ReplicaRoutingMiddleware:
+    """
+    ASGI middleware that lets the read-only GET routes of the given paths (matched exactly, or by prefix if they end
+    with "*") read from a replica, see ReplicaSet.choose. It must be added after (outside) the ETagMiddleware, whose
+    ETags then use the data versions of the chosen replica. The reads use the primary if the repository has no replicas.
+
+    Every other successful request may have written to the primary, so its response sets a cookie with the data
+    version of the primary after the request. The following reads of that client only use replicas that have
+    replayed this version: the client reads its own writes. The cookie is also set without replicas, so a caching
+    proxy in front of the API can pass the reads of that client on, see default.conf.template.
+    """
+    def __init__(self,
+                 app,
+                 replicas: Callable[[], Optional[ReplicaSet]],
+                 paths: Iterable[str],
+                 version: Callable[[], int],
+                 cookie_max_age: int = 300):
+        self.app = app
+        self.replicas = replicas
+        self.paths = frozenset(path for path in paths if not path.endswith("*"))
+        self.prefixes = tuple(path[:-1] for path in paths if path.endswith("*"))
+        self.version = version
+        self.cookie_max_age = cookie_max_age
+
+    def routed(self, scope) -> bool:
+        return scope["method"] == "GET" and (scope["path"] in self.paths or scope["path"].startswith(self.prefixes))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if self.routed(scope):
+            replicas = self.replicas()
+            if replicas is None:
+                await self.app(scope, receive, send)
+                return
+
+            cookie = SimpleCookie(dict(scope["headers"]).get(b"cookie", b"").decode("latin-1")).get(VERSION_COOKIE)
+            minimum_version = int(cookie.value) if cookie is not None and cookie.value.isdigit() else 0
+            token = current_replica.set(replicas.choose(minimum_version))
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                current_replica.reset(token)
+            return
+
+        async def send_with_version(message):
+            if message["type"] == "http.response.start" and message["status"] < 400 and scope["method"] != "GET":
+                cookie = (f"{VERSION_COOKIE}={self.version()}; Max-Age={self.cookie_max_age}; Path=/; HttpOnly; "
+                          f"SameSite=Lax")
+                message = {**message, "headers": [*message.get("headers", []), (b"set-cookie", cookie.encode())]}
+            await send(message)
+
+        await self.app(scope, receive, send_with_version)
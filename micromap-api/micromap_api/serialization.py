@@ -0,0 +1,68 @@
+import json
+import os
+from functools import lru_cache
+from typing import Dict, Iterable, List, Mapping, Optional, Type
+
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel, TypeAdapter
+
+from .profiling import section
+
+
+# Routes that return a list of ORM rows declare their response model for the OpenAPI specification, but return the
+# JSON themselves. FastAPI would validate the rows into response models, convert those back to Python objects with
+# jsonable_encoder semantics, and then encode them with the json module. These functions validate and encode the rows
+# in one pass, in pydantic-core.
+# JSONABLE_ENCODER=1 serializes the rows like FastAPI instead, to compare both (see the serialization benchmark).
+JSONABLE_ENCODER = bool(int(os.getenv("JSONABLE_ENCODER", "0")))
+
+@lru_cache
+def _adapter(model: Type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(model)
+
+
+@lru_cache
+def _list_adapter(model: Type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(List[model])
+
+
+def _jsonable_list(model: Type[BaseModel], rows: Iterable) -> bytes:
+    """Serializes the rows like FastAPI's response model and JSONResponse: validate, jsonable_encoder, json.dumps."""
+    adapter = _list_adapter(model)
+    with section("serialization"):
+        content = jsonable_encoder(adapter.validate_python(list(rows), from_attributes=True))
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode()
+
+
+def json_list(model: Type[BaseModel], rows: Iterable) -> bytes:
+    """Returns the JSON array of the rows (e.g. ORM objects), serialized as the response model."""
+    if JSONABLE_ENCODER:
+        return _jsonable_list(model, rows)
+    adapter = _list_adapter(model)
+    with section("serialization"):
+        return adapter.dump_json(adapter.validate_python(list(rows), from_attributes=True))
+
+
+def cached_json_list(model: Type[BaseModel], rows: Iterable) -> bytes:
+    """
+    Like json_list, for rows that are cached in this process, like the taxonomy. Each row is serialized only once per
+    model, and its JSON is kept on the row, so a response is just the concatenation of these fragments. Cached rows
+    are never modified, but replaced when they change.
+    """
+    if JSONABLE_ENCODER:
+        return _jsonable_list(model, rows)
+    adapter = _adapter(model)
+    fragments = []
+    with section("serialization"):
+        for row in rows:
+            cache: Dict[type, bytes] = vars(row).setdefault("_json_fragments", {})
+            fragment = cache.get(model)
+            if fragment is None:
+                fragment = cache[model] = adapter.dump_json(adapter.validate_python(row, from_attributes=True))
+            fragments.append(fragment)
+        return b"[" + b",".join(fragments) + b"]"
+
+
+def json_response(content: bytes, headers: Optional[Mapping[str, str]] = None) -> Response:
+    return Response(content, media_type="application/json", headers=headers)
@@ -0,0 +1,67 @@
+from hashlib import sha256
+from pathlib import Path
+from typing import Dict, List, Sequence
+from uuid import UUID
+
+from .chunkfile import ChunkFile, InvalidChunkFileException, open_chunk_file, write_chunk_file
+
+
+def stack_path(stack_directory: Path, item_id: UUID) -> Path:
+    return stack_directory / f"{item_id}.stack"
+
+
+class StackFile:
+    """
+    All focus levels (slices) of an item in one chunk file, one compressed image per chunk, in focus order. Replaces
+    the separate files of the prepared layout, so serving a slice needs no file lookups beyond the (cached) mapping.
+    """
+
+    def __init__(self, chunk_file: ChunkFile):
+        header = chunk_file.header
+        if header.get("format") != "stack":
+            raise InvalidChunkFileException("Not a stack.")
+        self.chunk_file = chunk_file
+        try:
+            self.width: int = header["width"]
+            self.height: int = header["height"]
+            self.media_type: str = header["media_type"]
+        except KeyError as e:
+            raise InvalidChunkFileException(f"The stack header has no {e}.")
+        self.depth: int = chunk_file.chunk_count
+        # The SHA-256 digests of the slices, computed when the file was written. Stack files written before the digests
+        # were added to the header get them computed once, when the slice is first read.
+        self._digests: Dict[int, str] = dict(enumerate(header.get("digests", [])))
+        if len(self._digests) not in (0, self.depth):
+            raise InvalidChunkFileException("The stack does not have a digest for every slice.")
+
+    def slice(self, z: int) -> memoryview:
+        """Returns the compressed image of focus level z, without copying. Raises an IndexError."""
+        return self.chunk_file.chunk(z)
+
+    def digest(self, z: int) -> str:
+        """Returns the SHA-256 hex digest of the image of focus level z. Raises an IndexError."""
+        if z not in self._digests:
+            self._digests[z] = sha256(self.slice(z)).hexdigest()
+        return self._digests[z]
+
+    def nearest_first(self, first: int) -> List[int]:
+        """Returns all focus levels, ordered by their distance to the given level, e.g. 2, 1, 3, 0, 4 for 2 of 5."""
+        return sorted(range(self.depth), key=lambda z: (abs(z - first), z))
+
+
+def open_stack(stack_directory: Path, item_id: UUID) -> StackFile:
+    """
+    Returns the (cached, memory-mapped) stack file of an item. Raises FileNotFoundError, or InvalidChunkFileException if
+    the file is not a valid stack file.
+    """
+    return StackFile(open_chunk_file(stack_path(stack_directory, item_id)))
+
+
+def write_stack(path: Path, slices: Sequence[bytes], width: int, height: int, media_type: str = "image/png"):
+    """
+    Writes a stack file from the compressed images of the focus levels, which are stored as they are, with their
+    digests in the header.
+    """
+    header = {"format": "stack", "width": width, "height": height, "media_type": media_type,
+              "digests": [sha256(image).hexdigest() for image in slices]}
+    write_chunk_file(path, header, slices)
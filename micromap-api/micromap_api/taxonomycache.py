@@ -0,0 +1,101 @@
+import threading
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Hashable, Iterable, Mapping, Optional, Tuple, TypeVar
+from uuid import UUID
+
+from .metrics import CACHE_REQUESTS
+from .ormmodels import ORMFamily, ORMGenus, ORMSpecies
+
+T = TypeVar("T")
+
+
+def _group(rows: Iterable[Any], key: str) -> Mapping[UUID, Tuple[Any, ...]]:
+    """Groups rows by the value of their attribute `key`, preserving their order."""
+    groups: Dict[UUID, list] = {}
+    for row in rows:
+        groups.setdefault(getattr(row, key), []).append(row)
+    return MappingProxyType({parent_id: tuple(children) for parent_id, children in groups.items()})
+
+
+@dataclass(frozen=True)
+class TaxonomySnapshot:
+    """The immutable taxonomy tree of one catalog, with child lists sorted by name and precomputed counts."""
+    families: Tuple[ORMFamily, ...]
+    genera: Mapping[UUID, Tuple[ORMGenus, ...]]  # By family id.
+    genera_without_type: Mapping[UUID, Tuple[ORMGenus, ...]]  # By family id, excluding is_type genera.
+    species: Mapping[UUID, Tuple[ORMSpecies, ...]]  # By genus id.
+    all_species: Tuple[ORMSpecies, ...]
+    family_count: int
+    genus_count: int
+    species_count: int
+
+    @classmethod
+    def from_rows(cls, families: Iterable[ORMFamily], genera: Iterable[ORMGenus], species: Iterable[ORMSpecies]):
+        """Creates a snapshot from the (detached) families, genera and species of a catalog, each sorted by name."""
+        families, genera, species = tuple(families), tuple(genera), tuple(species)
+        return cls(
+            families=families,
+            genera=_group(genera, "family_id"),
+            genera_without_type=_group((genus for genus in genera if not genus.is_type), "family_id"),
+            species=_group(species, "genus_id"),
+            all_species=species,
+            family_count=len(families),
+            genus_count=len(genera),
+            species_count=len(species),
+        )
+
+
+def _kind(key: Hashable) -> str:
+    """The kind of entry of a key, like "taxonomy" for ("taxonomy", catalog_id), to label the cache metrics."""
+    return str(key[0]) if isinstance(key, tuple) and key else "other"
+
+
+class TaxonomyCache:
+    """
+    Thread-safe, in-process cache for taxonomy data, which only changes when a secure POST/PUT route runs.
+
+    Entries expire after `ttl` seconds and can be invalidated explicitly. An entry belongs either to one catalog, or to
+    all catalogs (catalog_id None). Invalidating a catalog drops its entries and those belonging to all catalogs.
+    """
+    def __init__(self, ttl: float = 300.0):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[Hashable, Tuple[Any, float, Optional[UUID]]] = {}  # Value, expiry time and catalog id.
+        self._generation = 0  # Incremented on invalidation, so loads that started before are not stored.
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, load: Callable[[], T], catalog_id: Optional[UUID] = None) -> T:
+        """Returns the cached value for key, or loads and caches it if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self.hits += 1
+                CACHE_REQUESTS.labels(_kind(key), "hit").inc()
+                return entry[0]
+            self.misses += 1
+            CACHE_REQUESTS.labels(_kind(key), "miss").inc()
+            generation = self._generation
+
+        value = load()  # Loaded outside the lock, so other entries can still be served meanwhile.
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = (value, time.monotonic() + self.ttl, catalog_id)
+        return value
+
+    def invalidate(self, catalog_id: Optional[UUID] = None):
+        """Drops the entries of a catalog and those belonging to all catalogs, or everything if catalog_id is None."""
+        with self._lock:
+            self._generation += 1
+            if catalog_id is None:
+                self._entries.clear()
+            else:
+                self._entries = {key: entry for key, entry in self._entries.items()
+                                 if entry[2] is not None and entry[2] != catalog_id}
+
+    def statistics(self) -> Dict[str, int]:
+        """Returns the hit and miss counters and the number of cached entries."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
@@ -7,6 +7,9 @@ setuptools.setup(
     author_email="H.E.Bennink@umcutrecht.nl",
     description="MicroMap API module",
     packages=['micromap_api'],
+    entry_points={
+        'console_scripts': ['micromap-api=micromap_api.cli:main'],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: GNU Lesser General Public License v3 (LGPLv3)",
@@ -18,11 +21,16 @@ setuptools.setup(
         'uvicorn~=0.23.2',
         'pydantic~=2.1.1',
         'pydantic-settings~=2.0.3',
-        'sqlalchemy~=2.0.23',
-        'psycopg2-binary~=2.9.9'
+        'sqlalchemy[asyncio]~=2.0.23',
+        'psycopg2-binary~=2.9.9',
+        'asyncpg~=0.29.0',
+        'brotli~=1.1.0',
+        'prometheus-client~=0.20.0'
     ],
     extras_require={
         'asgi webserver': ['uvicorn~=0.20.0'],
         'wsgi support': ['a2wsgi~=1.7.0'],
+        'import': ['Pillow~=10.1.0'],
+        'tests': ['pytest~=8.3', 'httpx~=0.27.0'],
     }
 )
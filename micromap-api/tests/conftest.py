@@ -0,0 +1,178 @@
+"""
+The tests run against the PostgreSQL server configured by the PG* environment variables, like the API. A test session
+creates a database of its own, named after PGDATABASE with a _test suffix, and drops it afterwards. The tests that
+need the database are skipped if the server is unreachable.
+"""
+import os
+import time
+from base64 import b64encode
+from dataclasses import dataclass, field
+from hashlib import sha256
+from typing import Any, Dict, Iterator, List, Tuple
+from uuid import UUID, uuid4
+
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+
+# Configured before the API is imported, since it connects to the database on import.
+os.environ["PGDATABASE"] = DATABASE = f"{os.getenv('PGDATABASE', 'micromap')}_test"
+os.environ["ASYNC_DB"] = "0"
+os.environ.pop("BUILD_MODE", None)  # Would log every statement.
+os.environ.pop("PGREPLICAHOSTS", None)
+API_KEY = "test-api-key"
+os.environ["API_KEY_HASH"] = sha256(API_KEY.encode()).hexdigest()
+
+from micromap_api.models import (Catalog, Family, Genus, Species, Study, SampleCreateDTO, SlideCreateDTO,  # noqa: E402
+                                 ItemCreateDTO)
+from micromap_api.postgresqldatarepository import database_url  # noqa: E402
+
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(256))  # Not decoded by the API.
+
+
+def _server():
+    """Returns an engine on the maintenance database of the server, to create and drop the test database."""
+    return create_engine(make_url(database_url()).set(database="postgres"), isolation_level="AUTOCOMMIT")
+
+
+@pytest.fixture(scope="session")
+def database() -> Iterator[str]:
+    """Creates an empty test database, and drops it after the session."""
+    server = _server()
+    try:
+        with server.connect() as connection:
+            connection.execute(text(f'DROP DATABASE IF EXISTS "{DATABASE}" WITH (FORCE)'))
+            connection.execute(text(f'CREATE DATABASE "{DATABASE}"'))
+    except OperationalError as e:
+        pytest.skip(f"PostgreSQL is not available: {e.orig}")
+    yield DATABASE
+    with server.connect() as connection:
+        connection.execute(text(f'DROP DATABASE IF EXISTS "{DATABASE}" WITH (FORCE)'))
+    server.dispose()
+
+
+@pytest.fixture(scope="session")
+def api(database):
+    """The API module, connected to the test database. Its repository creates the tables on import."""
+    from micromap_api import main
+    return main
+
+
+@pytest.fixture(scope="session")
+def repository(api):
+    """The repository of the API, so the data versions and caches of the API see the writes of the tests."""
+    return api.repository
+
+
+@pytest.fixture(scope="session")
+def client(api):
+    """A test client of the API, started like a server: with the change listener, once it listens."""
+    from fastapi.testclient import TestClient
+    with TestClient(api.app, base_url="http://testserver/api") as test_client:
+        deadline = time.monotonic() + 10
+        while api.repository.data_versions.current() is None:
+            assert time.monotonic() < deadline, "The change listener did not connect."
+            time.sleep(0.05)
+        yield test_client
+
+
+@pytest.fixture
+def statements(repository) -> Iterator[List[Tuple[str, Any]]]:
+    """The SQL statements and their parameters that the repository executes during a test, in order."""
+    recorded = []
+
+    def record(connection, cursor, statement, parameters, context, executemany):
+        recorded.append((statement, parameters))
+
+    event.listen(repository.engine, "before_cursor_execute", record)
+    yield recorded
+    event.remove(repository.engine, "before_cursor_execute", record)
+
+
+@pytest.fixture
+def secure_headers() -> Dict[str, str]:
+    return {"x-api-key": API_KEY}
+
+
+@dataclass
+class SeededCatalog:
+    """A catalog with its taxonomy, a reference and a regular study, and items of every taxonomic level."""
+    catalog: Catalog
+    families: List[Family] = field(default_factory=list)
+    genera: List[Genus] = field(default_factory=list)
+    species: List[Species] = field(default_factory=list)
+    studies: List[Study] = field(default_factory=list)
+    samples: List[SampleCreateDTO] = field(default_factory=list)
+    slides: List[SlideCreateDTO] = field(default_factory=list)
+    items: List[ItemCreateDTO] = field(default_factory=list)
+
+    def items_of(self, **taxon: UUID) -> List[ItemCreateDTO]:
+        """Returns the items with the given resolved family_id, genus_id or species_id."""
+        (level, taxon_id), = taxon.items()
+        genus_of = {species.id: species.genus_id for species in self.species}
+        family_of = {genus.id: genus.family_id for genus in self.genera}
+
+        def resolved(item: ItemCreateDTO) -> Dict[str, UUID]:
+            genus_id = genus_of.get(item.species_id, item.genus_id)
+            return {"species_id": item.species_id, "genus_id": genus_id,
+                    "family_id": family_of.get(genus_id, item.family_id)}
+
+        return [item for item in self.items if resolved(item)[level] == taxon_id]
+
+
+def seed_catalog(repository, families: int = 2, genera: int = 2, species: int = 3) -> SeededCatalog:
+    """
+    Adds a catalog with the given number of families, genera per family and species per genus. The second genus of
+    each family and the last species of each genus are pollen types. Species n has n + 1 items, alternating between
+    the studies, so the taxa differ in abundance, and every genus and family has one item of its own. Names get a
+    random suffix, since they are unique in the database.
+    """
+    suffix = uuid4().hex[:8]
+    seeded = SeededCatalog(Catalog(id=uuid4(), name=f"Catalog {suffix}"))
+    repository.add_catalog(seeded.catalog)
+    for is_reference in (True, False):
+        study = Study(id=uuid4(), catalog_id=seeded.catalog.id, is_reference=is_reference,
+                      description=f"{'Reference' if is_reference else 'Study'} {suffix}", location=None, remarks=None)
+        repository.add_study(study)
+        seeded.studies.append(study)
+        seeded.samples.append(SampleCreateDTO(id=uuid4(), study_id=study.id, description="Sample", location=None,
+                                              age=None, remarks=None))
+    repository.bulk_add_samples(seeded.samples)
+    seeded.slides = [SlideCreateDTO(id=uuid4(), sample_id=sample.id, description="Slide", remarks=None)
+                     for sample in seeded.samples]
+    repository.bulk_add_slides(seeded.slides)
+
+    key_image = b64encode(PNG).decode()
+
+    def add_items(count: int, **taxon: UUID):
+        for _ in range(count):
+            slide = seeded.slides[len(seeded.items) % len(seeded.slides)]
+            seeded.items.append(ItemCreateDTO(id=uuid4(), key_image=key_image, slide_id=slide.id, voxel_width=0.25,
+                                              comment=None, **taxon))
+
+    for family_index in range(families):
+        family = Family(id=uuid4(), catalog_id=seeded.catalog.id, name=f"Family{family_index} {suffix}aceae")
+        seeded.families.append(family)
+        add_items(1, family_id=family.id)
+        for genus_index in range(genera):
+            genus = Genus(id=uuid4(), family_id=family.id, is_type=genus_index == 1,
+                          name=f"Genus{family_index}{genus_index} {suffix}")
+            seeded.genera.append(genus)
+            add_items(1, genus_id=genus.id)
+            for species_index in range(species):
+                seeded.species.append(Species(id=uuid4(), genus_id=genus.id, is_type=species_index == species - 1,
+                                              name=f"{genus.name} species{species_index}"))
+                add_items(len(seeded.species), species_id=seeded.species[-1].id)
+
+    repository.bulk_add_families(seeded.families)
+    repository.bulk_add_genera(seeded.genera)
+    repository.bulk_add_species(seeded.species)
+    repository.bulk_add_items(seeded.items)
+    return seeded
+
+
+@pytest.fixture
+def catalog(repository) -> SeededCatalog:
+    """A new catalog for each test, so tests do not depend on each other's data."""
+    return seed_catalog(repository)
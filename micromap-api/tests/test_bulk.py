@@ -0,0 +1,82 @@
+import json
+from base64 import b64encode
+from uuid import uuid4
+
+from micromap_api.models import Family, ItemCreateDTO
+
+from .conftest import PNG
+
+
+def new_item(catalog, **values) -> dict:
+    item = ItemCreateDTO(id=uuid4(), key_image=b64encode(PNG).decode(), slide_id=catalog.slides[0].id,
+                         voxel_width=0.25, species_id=catalog.species[0].id)
+    return {**item.model_dump(mode="json"), **values}
+
+
+def species_item_count(client, catalog) -> int:
+    return client.get("/items/count/", params={"species_id": str(catalog.species[0].id)}).json()["count"]
+
+
+def test_bulk_insert(client, catalog, secure_headers):
+    before = species_item_count(client, catalog)
+    rows = [new_item(catalog) for _ in range(3)]
+    response = client.post("/items/bulk", json=rows, headers=secure_headers)
+    assert response.status_code == 201
+    assert response.json() == {"ids": [row["id"] for row in rows], "skipped": []}
+    assert species_item_count(client, catalog) == before + 3
+
+
+def test_bulk_insert_ndjson(client, catalog, secure_headers):
+    rows = [new_item(catalog) for _ in range(2)]
+    response = client.post("/items/bulk", content="\n".join(map(json.dumps, rows)) + "\n",
+                           headers={**secure_headers, "content-type": "application/x-ndjson"})
+    assert response.status_code == 201
+    assert response.json()["ids"] == [row["id"] for row in rows]
+
+
+def test_bulk_insert_reports_duplicate_ids(client, catalog, secure_headers):
+    before = species_item_count(client, catalog)
+    row = new_item(catalog)
+    response = client.post("/items/bulk", json=[row, new_item(catalog), row], headers=secure_headers)
+    assert response.status_code == 409
+    assert response.json()["detail"] == [{"row": 2, "detail": f"Key (id)=({row['id']}) is also used by row 0."}]
+    assert species_item_count(client, catalog) == before  # Nothing is inserted.
+
+
+def test_bulk_insert_reports_existing_rows(client, catalog, secure_headers):
+    existing = new_item(catalog, id=str(catalog.items[0].id))
+    new = new_item(catalog)
+    response = client.post("/items/bulk", json=[new, existing], headers=secure_headers)
+    assert response.status_code == 409
+    assert [error["row"] for error in response.json()["detail"]] == [1]
+
+    skipped = client.post("/items/bulk", params={"skip_existing": True}, json=[new, existing],
+                          headers=secure_headers)
+    assert skipped.status_code == 201
+    assert skipped.json() == {"ids": [new["id"]], "skipped": [existing["id"]]}
+
+
+def test_bulk_insert_reports_missing_parents_and_invalid_rows(client, catalog, secure_headers):
+    slide_id = str(uuid4())
+    rows = [new_item(catalog),
+            new_item(catalog, slide_id=slide_id),
+            new_item(catalog, genus_id=str(catalog.genera[0].id))]  # Two taxa.
+    response = client.post("/items/bulk", json=rows, headers=secure_headers)
+    assert response.status_code == 409
+    assert response.json()["detail"] == [
+        {"row": 1, "detail": f'Key (slide_id)=({slide_id}) is not present in table "slide".'},
+        {"row": 2, "detail": "Exactly one of subspecies_id, species_id, genus_id and family_id must be set."}]
+
+
+def test_bulk_insert_reports_existing_names(client, catalog, secure_headers):
+    existing = Family(id=uuid4(), catalog_id=catalog.catalog.id, name=catalog.families[0].name)
+    response = client.post("/families/bulk", json=[existing.model_dump(mode="json")], headers=secure_headers)
+    assert response.status_code == 409
+    assert [error["row"] for error in response.json()["detail"]] == [0]
+
+
+def test_bulk_insert_rejects_invalid_json(client, catalog, secure_headers):
+    response = client.post("/items/bulk", json=[new_item(catalog), {"slide_id": "not a uuid"}],
+                           headers=secure_headers)
+    assert response.status_code == 422
+    assert [error["row"] for error in response.json()["detail"]] == [1]
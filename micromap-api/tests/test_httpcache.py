@@ -0,0 +1,116 @@
+import logging
+import threading
+from base64 import b64encode
+from hashlib import sha256
+from uuid import uuid4
+
+from micromap_api.httpcache import DataVersions
+from micromap_api.models import Family, ItemCreateDTO
+from micromap_api.notifications import ChangeListener
+
+from .conftest import PNG, seed_catalog
+
+
+def test_data_versions_are_unknown_until_listening():
+    versions = DataVersions()
+    catalog_id = uuid4()
+    versions.update({catalog_id: 5})
+    assert versions.get(catalog_id) == 5
+    assert versions.current(catalog_id) is None
+    versions.set_known(True)
+    assert versions.current(catalog_id) == 5
+    assert versions.current(uuid4()) == 0
+    versions.update({catalog_id: 4})  # A late notification.
+    assert versions.current(catalog_id) == 5
+    versions.set_known(False)
+    assert versions.current(catalog_id) is None
+
+
+def test_disconnected_listener_is_not_listening(caplog):
+    states, disconnected = [], threading.Event()
+
+    def on_listening(listening: bool):
+        states.append(listening)
+        disconnected.set()
+
+    # Nothing listens on port 1, so every connection attempt fails.
+    listener = ChangeListener("postgresql://micromap@127.0.0.1:1/micromap", on_change=lambda catalog_id: None,
+                              on_listening=on_listening, reconnect_delay=0.05)
+    with caplog.at_level(logging.WARNING, logger="micromap_api.notifications"):
+        listener.start()
+        assert disconnected.wait(10)
+        listener.stop()
+        listener.join(10)
+    assert states and not any(states)
+    assert "Change listener lost its database connection" in caplog.text
+
+
+def test_no_etag_while_versions_are_unknown(client, repository, catalog):
+    params = {"catalog_id": str(catalog.catalog.id)}
+    etag = client.get("/families/", params=params).headers["etag"]
+    repository.data_versions.set_known(False)
+    try:
+        response = client.get("/families/", params=params, headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert "etag" not in response.headers
+    finally:
+        repository.data_versions.set_known(True)
+    assert client.get("/families/", params=params, headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_etag_changes_after_a_write(client, repository, catalog, secure_headers):
+    other = seed_catalog(repository)
+    params = {"catalog_id": str(catalog.catalog.id)}
+    first = client.get("/families/", params=params)
+    etag = first.headers["etag"]
+    assert first.headers["cache-control"] == "public, no-cache"
+    not_modified = client.get("/families/", params=params, headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert not_modified.headers["etag"] == etag
+
+    # A write to another catalog leaves the responses of this catalog valid.
+    family = Family(id=uuid4(), catalog_id=other.catalog.id, name=f"Family {uuid4().hex[:8]}aceae")
+    assert client.post("/families/", json=family.model_dump(mode="json"), headers=secure_headers).status_code == 201
+    assert client.get("/families/", params=params, headers={"If-None-Match": etag}).status_code == 304
+
+    family = Family(id=uuid4(), catalog_id=catalog.catalog.id, name=f"Family {uuid4().hex[:8]}aceae")
+    assert client.post("/families/", json=family.model_dump(mode="json"), headers=secure_headers).status_code == 201
+    modified = client.get("/families/", params=params, headers={"If-None-Match": etag})
+    assert modified.status_code == 200
+    assert modified.headers["etag"] != etag
+    assert str(family.id) in [row["id"] for row in modified.json()]
+
+
+def test_binary_routes_have_no_data_version_etag(client, catalog):
+    # Thumbnails are validated by their content, so their ETag does not change with unrelated writes.
+    response = client.get(f"/items/{catalog.items[0].id}/thumbnail")
+    assert response.headers["etag"] == f'"{sha256(PNG).hexdigest()}"'
+    assert client.get(f"/items/{catalog.items[0].id}/thumbnail",
+                      headers={"If-None-Match": response.headers["etag"]}).status_code == 304
+
+
+def test_writes_set_the_written_cookie(client, repository, catalog, secure_headers):
+    # Without replicas too, for the micro-cache of nginx.
+    assert repository.replicas is None
+    assert "set-cookie" not in client.get("/families/", params={"catalog_id": str(catalog.catalog.id)}).headers
+    family = Family(id=uuid4(), catalog_id=catalog.catalog.id, name=f"Family {uuid4().hex[:8]}aceae")
+    response = client.post("/families/", json=family.model_dump(mode="json"), headers=secure_headers)
+    assert response.status_code == 201
+    assert response.cookies["micromap_written"] == str(repository.data_versions.get())
+
+
+def test_item_etag_ignores_the_catalog_id(client, catalog, secure_headers):
+    # The items do not depend on a catalog version, since the item writes only bump the version of all catalogs.
+    species = catalog.species[0]
+    params = {"species_id": str(species.id), "catalog_id": str(catalog.catalog.id)}
+    etag = client.get("/items/", params=params).headers["etag"]
+    assert client.get("/items/", params=params, headers={"If-None-Match": etag}).status_code == 304
+
+    item = ItemCreateDTO(id=uuid4(), key_image=b64encode(PNG).decode(), slide_id=catalog.slides[0].id,
+                         voxel_width=0.25, comment=None, species_id=species.id)
+    assert client.post("/items/", json=item.model_dump(mode="json"), headers=secure_headers).status_code == 201
+    modified = client.get("/items/", params=params, headers={"If-None-Match": etag})
+    assert modified.status_code == 200
+    assert modified.headers["etag"] != etag
+    assert str(item.id) in [row["id"] for row in modified.json()]
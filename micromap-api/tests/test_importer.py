@@ -0,0 +1,56 @@
+import json
+from pathlib import Path
+from uuid import uuid4
+
+import pytest
+
+pytest.importorskip("PIL")  # The optional 'import' dependencies.
+from PIL import Image  # noqa: E402
+
+from micromap_api.importer import import_stacks, write_all_stack_files  # noqa: E402
+
+
+def write_manifest(directory: Path, rows) -> Path:
+    for row in rows:
+        stack = directory / row["stack"]
+        stack.mkdir(parents=True, exist_ok=True)
+        for n in range(3):
+            Image.new("L", (16, 16), n * 100).save(stack / f"layer_{n}.png")
+    manifest = directory / "manifest.json"
+    manifest.write_text(json.dumps(rows))
+    return manifest
+
+
+def manifest_row(catalog: str, stack: str, **values) -> dict:
+    return {"stack": stack, "catalog": catalog, "family": f"Family {catalog}", "genus": f"Genus {catalog}",
+            "study": "Study", "sample": "Sample", "slide": "Slide", "voxel_width": 0.25, **values}
+
+
+def test_import_keys_taxa_by_catalog(tmp_path, client, repository, catalog):
+    # The seeded catalog already has the family, so the import adds the genus to it.
+    name = f"Catalog {uuid4().hex[:8]}"
+    rows = [manifest_row(catalog.catalog.name, f"{name}/a", family=catalog.families[0].name),
+            manifest_row(catalog.catalog.name, f"{name}/b", family=catalog.families[0].name)]
+    manifest = write_manifest(tmp_path, rows)
+    messages = []
+    assert import_stacks(repository, manifest, tmp_path / "prepared", workers=1, log=messages.append) == (2, 0)
+    genera = client.get("/genera/", params={"family_id": str(catalog.families[0].id)}).json()
+    assert f"Genus {catalog.catalog.name}" in [genus["name"] for genus in genera]
+
+    assert import_stacks(repository, manifest, tmp_path / "prepared", workers=1, log=messages.append) == (0, 0)
+    assert messages[-1] == "Importing 0 of 2 items, 2 were imported before."
+
+
+def test_import_reports_names_of_another_catalog(tmp_path, repository, catalog):
+    name = f"Catalog {uuid4().hex[:8]}"
+    manifest = write_manifest(tmp_path, [manifest_row(name, "a", family=catalog.families[0].name)])
+    with pytest.raises(ValueError, match="family names belong to another catalog"):
+        import_stacks(repository, manifest, tmp_path / "prepared", workers=1, log=lambda message: None)
+
+
+def test_write_all_stack_files_counts_failures(tmp_path):
+    for _ in range(100):
+        (tmp_path / "prepared" / f"o_{uuid4()}").mkdir(parents=True)  # Without focus layers.
+    messages = []
+    assert write_all_stack_files(tmp_path / "prepared", tmp_path / "stacks", workers=2, log=messages.append) == (0, 100)
+    assert messages[-1] == "Processed 100 of 100 items, 100 failed."
@@ -0,0 +1,69 @@
+"""
+The number of SQL statements per request. The relationships of the ORM models are lazy='raise', so a response that
+serializes a relationship that was not loaded fails instead of loading it with statements of its own.
+"""
+import pytest
+from sqlalchemy.orm import joinedload
+
+from micromap_api.loading import load_options
+from micromap_api.models import Item, Sample
+from micromap_api.ormmodels import ORMItem, ORMSample, ORMSlide
+from micromap_api.postgresqldatarepository import ITEM_ORDERS
+
+
+def test_load_options_follow_the_response_model():
+    assert load_options(ORMItem, None) == ()
+    options = load_options(ORMSample, Sample)
+    assert [str(option.path) for option in options] == [str(joinedload(ORMSample.study).path)]
+    # Item serializes its slide, with the slide's sample and the sample's study.
+    item_options, = load_options(ORMItem, Item)
+    assert str(item_options.path) == str(joinedload(ORMItem.slide).path)
+    assert [str(option.path) for option in item_options.context[1:]] == [
+        str(joinedload(ORMItem.slide).joinedload(ORMSlide.sample).path),
+        str(joinedload(ORMItem.slide).joinedload(ORMSlide.sample).joinedload(ORMSample.study).path)]
+
+
+@pytest.mark.parametrize("order", ITEM_ORDERS)
+def test_items_in_one_statement(client, catalog, statements, order):
+    response = client.get("/items/", params={"family_id": str(catalog.families[0].id), "order": order})
+    assert response.status_code == 200
+    items = response.json()
+    assert items and all(item["slide"]["sample"]["study"]["id"] for item in items)
+    assert len(statements) == 1
+
+
+def test_item_thumbnail_in_one_statement(client, catalog, statements):
+    # There is no route for a single item: its fields come with /items/, the thumbnail has a route of its own.
+    response = client.get(f"/items/{catalog.items[0].id}/thumbnail")
+    assert response.status_code == 200
+    assert len(statements) == 1
+
+
+def test_samples_and_slides_in_one_statement(client, catalog, statements):
+    samples = client.get("/samples/", params={"study_id": str(catalog.studies[0].id)})
+    assert samples.status_code == 200
+    assert samples.json()[0]["study"]["id"] == str(catalog.studies[0].id)
+    assert len(statements) == 1
+
+    statements.clear()
+    slides = client.get("/slides/", params={"sample_id": str(catalog.samples[0].id)})
+    assert slides.status_code == 200
+    assert slides.json()[0]["sample"]["study"]["id"] == str(catalog.studies[0].id)
+    assert len(statements) == 1
+
+
+def test_taxonomy_from_one_snapshot(client, catalog, statements):
+    genus = catalog.genera[0]
+    # The catalog of the genus, and the families, genera and species of the catalog.
+    first = client.get("/species/", params={"genus_id": str(genus.id)})
+    assert first.status_code == 200
+    assert {species["id"] for species in first.json()} == {
+        str(species.id) for species in catalog.species if species.genus_id == genus.id}
+    assert len(statements) == 4
+
+    # The other taxonomy routes of the same catalog are served from the cached snapshot.
+    statements.clear()
+    assert client.get("/species/", params={"genus_id": str(genus.id)}).status_code == 200
+    assert client.get("/genera/", params={"family_id": str(catalog.families[0].id)}).status_code == 200
+    assert client.get("/families/", params={"catalog_id": str(catalog.catalog.id)}).status_code == 200
+    assert len(statements) == 1  # The catalog of the family.
@@ -0,0 +1,80 @@
+import subprocess
+import sys
+from pathlib import Path
+
+from sqlalchemy import create_engine
+
+from micromap_api.postgresqldatarepository import database_url
+from micromap_api.replicas import Replica, ReplicaSet
+
+
+def test_metrics_need_the_api_key(client):
+    for path in ("/metrics", "/pool/metrics"):
+        assert client.get(path).status_code == 401
+        assert client.get(path, headers={"x-api-key": "wrong"}).status_code == 401
+
+
+def test_metrics(client, catalog, secure_headers):
+    for path in ("/studies/", "/families/"):  # The families are cached.
+        assert client.get(path, params={"catalog_id": str(catalog.catalog.id)}).status_code == 200
+    response = client.get("/metrics", headers=secure_headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    metrics = response.text
+    for series in ('micromap_request_duration_seconds_bucket{le="0.005",method="GET",route="/studies/",status="200"}',
+                   'micromap_response_size_bytes_count{method="GET",route="/studies/"}',
+                   'micromap_sql_duration_seconds_count{query="get_studies"}',
+                   'micromap_pool_connections{server="',
+                   "micromap_pool_wait_seconds_count ",
+                   'micromap_cache_requests_total{cache="'):
+        assert series in metrics, series
+
+
+def test_pool_metrics_of_the_primary_and_the_replicas(client, repository, secure_headers, monkeypatch):
+    replica = Replica(database_url(), create_engine(database_url().replace("127.0.0.1", "localhost")))
+    monkeypatch.setattr(repository, "replicas", ReplicaSet([replica]))
+    try:
+        response = client.get("/pool/metrics", headers=secure_headers)
+    finally:
+        replica.engine.dispose()
+    assert response.status_code == 200
+    primary, replica_pool = response.json()
+    assert (primary["server"], primary["replica"]) == (f"{repository.engine.url.host}:{repository.engine.url.port}",
+                                                       False)
+    assert primary["pool"] == "MeteredQueuePool"
+    assert primary["checkouts"] > 0
+    assert primary["size"] == 5
+    assert (replica_pool["server"], replica_pool["replica"]) == (f"{replica.engine.url.host}:{replica.engine.url.port}",
+                                                                 True)
+
+
+def test_gunicorn_collects_the_metrics_of_all_workers(tmp_path: Path):
+    directory = tmp_path / "metrics"
+    directory.mkdir()
+    (directory / "gauge_livesum_1.db").write_bytes(b"")  # Of a previous run.
+    # A worker process of its own, since prometheus_client reads PROMETHEUS_MULTIPROC_DIR once, on import.
+    script = """
+import os
+import sys
+from types import SimpleNamespace
+
+from micromap_api import gunicorn_conf
+gunicorn_conf.on_starting(None)
+assert os.listdir(sys.argv[1]) == []
+from micromap_api.metrics import POOL_CONNECTIONS, REQUEST_DURATION, render
+REQUEST_DURATION.labels("GET", "/studies/", "200").observe(0.01)
+POOL_CONNECTIONS.labels("primary:5432", "open").inc(2)
+print(render()[0].decode())
+print("# EXITED")
+gunicorn_conf.child_exit(None, SimpleNamespace(pid=os.getpid()))
+print(render()[0].decode())
+"""
+    result = subprocess.run([sys.executable, "-c", script, str(directory)], capture_output=True, text=True,
+                            env={"PROMETHEUS_MULTIPROC_DIR": str(directory), "PATH": ""}, cwd=Path(__file__).parents[1])
+    assert result.returncode == 0, result.stderr
+    running, exited = result.stdout.split("# EXITED")
+    assert 'micromap_request_duration_seconds_count{method="GET",route="/studies/",status="200"} 1.0' in running
+    assert 'micromap_pool_connections{server="primary:5432",state="open"} 2.0' in running
+    # The live gauges of a worker that exited are dropped, the requests it served are kept.
+    assert 'micromap_request_duration_seconds_count{method="GET",route="/studies/",status="200"} 1.0' in exited
+    assert "micromap_pool_connections{" not in exited
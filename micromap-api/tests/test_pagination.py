@@ -0,0 +1,112 @@
+from uuid import uuid4
+
+import pytest
+
+from micromap_api.models import ItemCreateDTO
+from micromap_api.pagination import encode_cursor, decode_cursor
+from micromap_api.exceptions import InvalidCursorException
+from micromap_api.postgresqldatarepository import ITEM_ORDERS
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor(-3, "a2b2", "0b6a0c1e-8a4f-4a55-9c3f-0d6fb4f7e1a9")
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == ["-3", "a2b2", "0b6a0c1e-8a4f-4a55-9c3f-0d6fb4f7e1a9"]
+
+
+@pytest.mark.parametrize("cursor", ["not a cursor", encode_cursor(), "e30"])  # e30 is {}.
+def test_decode_invalid_cursor(cursor):
+    with pytest.raises(InvalidCursorException):
+        decode_cursor(cursor)
+
+
+def pages(client, max_results, **params):
+    """Returns the item ids of all pages, following X-Next-Cursor, and the number of requests."""
+    ids, requests, cursor = [], 0, None
+    while True:
+        response = client.get("/items/", params={**params, "max_results": max_results,
+                                                 **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        requests += 1
+        ids += [item["id"] for item in response.json()]
+        cursor = response.headers.get("x-next-cursor")
+        if cursor is None:
+            return ids, requests
+
+
+@pytest.mark.parametrize("order", ITEM_ORDERS)
+def test_cursor_pages_follow_the_order(client, catalog, order):
+    family = catalog.families[0]
+    expected = {str(item.id) for item in catalog.items_of(family_id=family.id)}
+
+    everything = client.get("/items/", params={"family_id": str(family.id), "order": order, "max_results": 500})
+    assert "x-next-cursor" not in everything.headers
+    in_order = [item["id"] for item in everything.json()]
+    assert set(in_order) == expected
+
+    paged, requests = pages(client, 4, family_id=str(family.id), order=order)
+    assert paged == in_order  # Every item once, in the same order.
+    assert requests == len(in_order) // 4 + 1
+
+
+@pytest.mark.parametrize("order", ITEM_ORDERS)
+def test_cursor_and_offset_pages_agree(client, catalog, order):
+    genus = catalog.genera[0]
+    params = {"genus_id": str(genus.id), "order": order, "max_results": 2}
+    first = client.get("/items/", params=params)
+    second = client.get("/items/", params={**params, "cursor": first.headers["x-next-cursor"]})
+    by_offset = client.get("/items/", params={**params, "page": 2})
+    assert second.json() == by_offset.json()
+
+
+def assert_abundance_order(items):
+    """Checks that the items of a taxon are together, the taxon with the most of the items first."""
+    counts = {}
+    for item in items:
+        taxon = item["species_id"] or item["genus_id"]
+        counts[taxon] = counts.get(taxon, 0) + 1
+    taxa = list(dict.fromkeys(item["species_id"] or item["genus_id"] for item in items))
+    assert len(taxa) > 1
+    assert [counts[taxon] for taxon in taxa] == sorted(counts.values(), reverse=True)
+
+
+def test_abundance_order(client, catalog):
+    genus = catalog.genera[0]
+    assert_abundance_order(client.get("/items/", params={"genus_id": str(genus.id), "order": "abundance"}).json())
+
+
+def test_abundance_order_counts_the_filtered_items(client, repository, catalog):
+    # The first species is the most abundant in the first slide, and the second species in the catalog.
+    first, second = catalog.species[:2]
+    added = [ItemCreateDTO(id=uuid4(), key_image=None, slide_id=catalog.slides[0].id, voxel_width=0.25,
+                           species_id=first.id) for _ in range(5)]
+    added += [ItemCreateDTO(id=uuid4(), key_image=None, slide_id=catalog.slides[1].id, voxel_width=0.25,
+                            species_id=second.id) for _ in range(8)]
+    repository.bulk_add_items(added)
+    params = {"genus_id": str(first.genus_id), "order": "abundance"}
+
+    for container in ({"sample": str(catalog.samples[0].id)}, {"slide": str(catalog.slides[0].id)}):
+        items = client.get("/items/", params={**params, **container}).json()
+        assert items[0]["species_id"] == str(first.id)
+        assert_abundance_order(items)
+        paged, _ = pages(client, 2, **params, **container)
+        assert paged == [item["id"] for item in items]
+
+    assert client.get("/items/", params=params).json()[0]["species_id"] == str(second.id)
+
+
+def test_random_order_depends_on_seed(client, catalog):
+    params = {"family_id": str(catalog.families[0].id), "order": "random"}
+    first = [item["id"] for item in client.get("/items/", params={**params, "seed": 1}).json()]
+    again = [item["id"] for item in client.get("/items/", params={**params, "seed": 1}).json()]
+    other = [item["id"] for item in client.get("/items/", params={**params, "seed": 2}).json()]
+    assert first == again
+    assert first != other
+    assert sorted(first) == sorted(other)
+
+
+@pytest.mark.parametrize("cursor", ["not a cursor", encode_cursor("abc"), encode_cursor(1, 2, 3, 4, 5)])
+def test_invalid_cursor_is_rejected(client, catalog, cursor):
+    response = client.get("/items/", params={"family_id": str(catalog.families[0].id), "order": "id",
+                                             "cursor": cursor})
+    assert response.status_code == 400
@@ -0,0 +1,70 @@
+import pytest
+from sqlalchemy import create_engine
+
+from micromap_api.pooling import (MeteredAsyncQueuePool, MeteredQueuePool, engine_options, pooled_url,
+                                  set_statement_timeout)
+from micromap_api.postgresqldatarepository import database_url
+
+POOL_VARIABLES = ("DB_POOL_SIZE", "DB_MAX_OVERFLOW", "DB_POOL_TIMEOUT", "DB_POOL_RECYCLE", "DB_POOL_PRE_PING",
+                  "DB_STATEMENT_TIMEOUT", "DB_PGBOUNCER")
+
+
+@pytest.fixture(autouse=True)
+def environment(monkeypatch):
+    """Starts every test from the default pool configuration."""
+    for name in POOL_VARIABLES:
+        monkeypatch.delenv(name, raising=False)
+    return monkeypatch
+
+
+def test_default_options():
+    assert engine_options() == {"poolclass": MeteredQueuePool, "pool_size": 5, "max_overflow": 5, "pool_timeout": 30.0,
+                                "pool_recycle": 1800, "pool_pre_ping": True}
+    assert engine_options(async_driver=True)["poolclass"] is MeteredAsyncQueuePool
+
+
+def test_options_from_the_environment(environment):
+    for name, value in {"DB_POOL_SIZE": "20", "DB_MAX_OVERFLOW": "0", "DB_POOL_TIMEOUT": "2.5", "DB_POOL_RECYCLE": "-1",
+                        "DB_POOL_PRE_PING": "0", "DB_STATEMENT_TIMEOUT": "1500"}.items():
+        environment.setenv(name, value)
+    options = engine_options()
+    assert (options["pool_size"], options["max_overflow"], options["pool_timeout"], options["pool_recycle"],
+            options["pool_pre_ping"]) == (20, 0, 2.5, -1, False)
+    assert options["connect_args"] == {"options": "-c statement_timeout=1500"}
+    assert engine_options(async_driver=True)["connect_args"] == {"server_settings": {"statement_timeout": "1500"}}
+
+    environment.setenv("DB_POOL_SIZE", "many")
+    with pytest.raises(ValueError):
+        engine_options()
+
+
+def test_pgbouncer_mode_keeps_no_session_state(environment):
+    environment.setenv("DB_PGBOUNCER", "1")
+    environment.setenv("DB_STATEMENT_TIMEOUT", "1500")
+    assert "connect_args" not in engine_options()  # No startup options.
+    assert pooled_url("postgresql://host/micromap") == "postgresql://host/micromap"
+
+    connect_args = engine_options(async_driver=True)["connect_args"]
+    assert connect_args["statement_cache_size"] == 0
+    assert "server_settings" not in connect_args
+    names = {connect_args["prepared_statement_name_func"]() for _ in range(3)}
+    assert len(names) == 3
+    assert pooled_url("postgresql+asyncpg://host/micromap", async_driver=True) == \
+        "postgresql+asyncpg://host/micromap?prepared_statement_cache_size=0"
+
+
+@pytest.mark.parametrize("pgbouncer", ["0", "1"])
+def test_statement_timeout(database, environment, pgbouncer):
+    environment.setenv("DB_PGBOUNCER", pgbouncer)
+    environment.setenv("DB_STATEMENT_TIMEOUT", "1500")
+    engine = create_engine(database_url(), **engine_options())
+    set_statement_timeout(engine)
+    try:
+        with engine.connect() as connection:
+            # A startup option of the session, or SET LOCAL in every transaction in PgBouncer mode.
+            assert connection.exec_driver_sql("SHOW statement_timeout").scalar() == "1500ms"
+            connection.rollback()
+            assert connection.exec_driver_sql("SHOW statement_timeout").scalar() == "1500ms"
+        assert engine.pool.wait_statistics.checkouts == 1
+    finally:
+        engine.dispose()
@@ -0,0 +1,84 @@
+import re
+from datetime import datetime, timezone
+
+from fastapi.concurrency import run_in_threadpool
+from fastapi.testclient import TestClient
+from starlette.responses import PlainTextResponse
+
+from micromap_api.models import RequestProfile
+from micromap_api.profiling import SECTIONS, ProfileBuffer, ProfilingMiddleware
+
+from .conftest import API_KEY
+
+
+def server_timing(response) -> dict:
+    """Returns the durations of the Server-Timing header by name."""
+    return {name: float(duration)
+            for name, duration in re.findall(r'(\w+);dur=([\d.]+);desc="[^"]*"', response.headers["server-timing"])}
+
+
+def test_only_requests_with_the_api_key_are_profiled(api, client, catalog):
+    params = {"catalog_id": str(catalog.catalog.id)}
+    profiled = len(api.slow_requests.recent())
+    assert "server-timing" not in client.get("/studies/", params=params).headers
+    assert "server-timing" not in client.get("/studies/", params=params, headers={"X-Profile": "wrong"}).headers
+    assert len(api.slow_requests.recent()) == profiled
+
+    response = client.get("/studies/", params=params, headers={"X-Profile": API_KEY})
+    assert response.status_code == 200
+    timings = server_timing(response)
+    assert list(timings) == [*SECTIONS, "total"]
+    assert timings["sql"] > 0
+    assert timings["total"] >= timings["sql"]
+
+    latest = api.slow_requests.recent()[0]
+    assert (latest.method, latest.path, latest.status) == ("GET", "/studies/", 200)
+    assert latest.query == f"catalog_id={params['catalog_id']}"
+    assert latest.sql_statements >= 1
+    assert latest.sql_ms > 0 and latest.serialization_ms > 0  # Not rounded to 0.1 ms, like in the header.
+
+
+def test_debug_slow_lists_the_profiles_most_recent_first(client, catalog, secure_headers):
+    assert client.get("/debug/slow").status_code == 401
+    for path in ("/catalogs/", "/families/count/"):
+        client.get(path, headers={"X-Profile": API_KEY})
+    response = client.get("/debug/slow", headers=secure_headers)
+    assert response.status_code == 200
+    assert [profile["path"] for profile in response.json()[:2]] == ["/families/count/", "/catalogs/"]
+
+
+def test_profile_buffer_keeps_the_most_recent_profiles():
+    buffer = ProfileBuffer(size=3)
+
+    def profile(index: int) -> RequestProfile:
+        return RequestProfile(method="GET", path=f"/{index}", query="", status=200,
+                              started_at=datetime.now(timezone.utc), total_ms=1.0, pool_ms=0.0, sql_ms=0.0,
+                              sql_statements=0, orm_ms=0.0, serialization_ms=0.0, explain_ms=0.0, statements=[])
+
+    for index in range(5):
+        buffer.add(profile(index))
+    assert [entry.path for entry in buffer.recent()] == ["/4", "/3", "/2"]
+
+
+def test_only_requests_profiled_by_header_are_explained(repository):
+    def count_items():
+        with repository.engine.connect() as connection:
+            return connection.exec_driver_sql("SELECT count(*) FROM item").scalar()
+
+    async def app(scope, receive, send):
+        response = PlainTextResponse(str(await run_in_threadpool(count_items)))
+        await response(scope, receive, send)
+
+    buffer = ProfileBuffer()
+    # Every statement and request is slow, so every profile is kept with its statements.
+    profiler = ProfilingMiddleware(app, buffer, authorized=lambda key: key == API_KEY, profile_all=True,
+                                   slow_request_ms=0, slow_statement_ms=0)
+    test_client = TestClient(profiler)  # Without the lifespan events, which the app does not handle.
+    test_client.get("/")
+    test_client.get("/", headers={"X-Profile": API_KEY})
+    test_client.post("/", headers={"X-Profile": API_KEY})
+    posted, requested, profiled = buffer.recent()
+    assert [statement.plan for statement in profiled.statements] == [None]
+    assert "actual time" in requested.statements[0].plan
+    assert profiled.explain_ms == 0 and requested.explain_ms > 0
+    assert [statement.plan for statement in posted.statements] == [None]  # Only SELECTs of GET requests.
@@ -0,0 +1,100 @@
+"""
+The query plans of the item filters and orders, of the genera by letter, and of the taxon search. The planner prefers a
+sequential scan of the small tables of the tests, so the plans are made with enable_seqscan off. A scan of the item or
+genus table that is still sequential, or that filters the rows of a whole index (without an index condition), means
+that no index serves the filter. Whole index scans without a filter are fine: they read the rows in the order of the
+query until its limit.
+"""
+import json
+from typing import Any, Dict, Iterator, Sequence
+
+import pytest
+
+from micromap_api.postgresqldatarepository import ITEM_ORDERS, PostgresqlDataRepository
+
+TABLES = {"item", "genus"}
+
+
+def explain(repository, statement: str, parameters, disabled: Sequence[str] = ("seqscan",)) -> Dict[str, Any]:
+    with repository.engine.connect() as connection:
+        for scan in disabled:
+            connection.exec_driver_sql(f"SET LOCAL enable_{scan} = off")
+        plan = connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters).scalar()
+        connection.rollback()
+    return (json.loads(plan) if isinstance(plan, str) else plan)[0]["Plan"]
+
+
+def nodes(plan: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from nodes(child)
+
+
+def full_scans(plan: Dict[str, Any]) -> Iterator[str]:
+    """Yields the scans of the tables that filter all their rows: sequential scans, and filtered whole index scans."""
+    for node in nodes(plan):
+        if node.get("Relation Name") not in TABLES:
+            continue
+        if node["Node Type"] == "Seq Scan" or (node["Node Type"] in ("Index Scan", "Index Only Scan")
+                                               and "Index Cond" not in node and "Filter" in node):
+            yield f"{node['Node Type']} on {node['Relation Name']} ({node.get('Index Name', 'no index')})"
+
+
+def assert_index_scans(repository, statements):
+    assert statements
+    for statement, parameters in statements:
+        plan = explain(repository, statement, parameters)
+        assert not list(full_scans(plan)), f"{statement}\n{json.dumps(plan, indent=2)}"
+
+
+FILTERS = {
+    "family": lambda catalog: {"family_id": str(catalog.families[0].id)},
+    "genus": lambda catalog: {"genus_id": str(catalog.genera[0].id)},
+    "species": lambda catalog: {"species_id": str(catalog.species[0].id)},
+    "genus_without_types": lambda catalog: {"genus_id": str(catalog.genera[1].id), "include_genus_type": False},
+    "species_without_types": lambda catalog: {"species_id": str(catalog.species[0].id),
+                                              "include_species_type": False},
+    "family_reference": lambda catalog: {"family_id": str(catalog.families[0].id), "reference_only": True},
+    "study": lambda catalog: {"study_id": str(catalog.studies[1].id)},
+    "sample": lambda catalog: {"sample_id": str(catalog.samples[1].id)},
+    "slide": lambda catalog: {"slide_id": str(catalog.slides[1].id)},
+    "genus_in_study": lambda catalog: {"genus_id": str(catalog.genera[0].id), "study_id": str(catalog.studies[0].id)},
+}
+
+
+@pytest.mark.parametrize("order", ITEM_ORDERS)
+@pytest.mark.parametrize("name", FILTERS)
+def test_get_items_uses_indexes(repository, catalog, statements, name, order):
+    params = FILTERS[name](catalog)
+    first = repository.get_items(**params, order=order, max_results=2)
+    assert first
+    repository.get_items(**params, order=order, max_results=2,
+                         after=PostgresqlDataRepository.get_item_sort_key(first[-1]))
+    assert_index_scans(repository, [(statement, parameters) for statement, parameters in statements
+                                    if "FROM item" in statement])
+
+
+def test_get_genera_by_letter_uses_indexes(repository, catalog, statements):
+    assert repository.get_genera_by_letter("g")
+    assert_index_scans(repository, [(statement, parameters) for statement, parameters in statements
+                                    if "FROM genus" in statement])
+
+
+SEARCH_INDEXES = {"family": "ix_family_lower_name_trgm", "genus": "ix_genus_lower_name_trgm",
+                  "species": "ix_species_lower_name_trgm"}
+
+
+def test_search_taxa_uses_trigram_indexes(repository, catalog, statements):
+    # Without a catalog, only the trigram indexes keep the search from scanning all taxa.
+    assert repository.search_taxa(catalog.genera[0].name.lower())
+    searches = [(statement, parameters) for statement, parameters in statements if "word_similarity(" in statement]
+    assert len(searches) == len(SEARCH_INDEXES)
+    for (statement, parameters), (table, index) in zip(searches, SEARCH_INDEXES.items()):
+        # Without plain index scans, that prefer a whole (name ordered) index with a filter on these small tables, a
+        # taxon table is either read by the bitmap scans of an index condition, or scanned sequentially.
+        plan = explain(repository, statement, parameters, disabled=("seqscan", "indexscan"))
+        scans = [node for node in nodes(plan) if node.get("Relation Name") == table]
+        assert scans and not [node for node in scans if node["Node Type"] == "Seq Scan"], json.dumps(plan, indent=2)
+        # The similarity condition (commuted to indexed name %> term) is an index condition, not a filter.
+        conditions = [node.get("Index Cond", "") for node in nodes(plan) if node.get("Index Name") == index]
+        assert any("%>" in condition or "<%" in condition for condition in conditions), json.dumps(plan, indent=2)
@@ -0,0 +1,113 @@
+import logging
+from typing import Iterator, List
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import create_engine, event
+
+from micromap_api.models import Family
+from micromap_api.postgresqldatarepository import database_url
+from micromap_api.replicas import Replica, ReplicaSet
+
+# Nothing listens on port 1, like on a replica that is down.
+UNREACHABLE = "postgresql://postgres@127.0.0.1:1/micromap"
+
+
+class ReplicaServer:
+    """
+    A replica on the test database itself, with an engine and health check connection of its own, so the reads that
+    it serves can be told apart from those of the primary. It never lags, and replays every write at once.
+    """
+    def __init__(self, name: str):
+        self.replica = Replica(f"{database_url()}?application_name={name}", create_engine(database_url()))
+        self.reads: List[str] = []
+        event.listen(self.replica.engine, "before_cursor_execute",
+                     lambda connection, cursor, statement, *args: self.reads.append(statement))
+
+
+@pytest.fixture
+def servers(repository, client, monkeypatch) -> Iterator[List[ReplicaServer]]:
+    """Two replicas of the repository, checked once. The replica set is not started, so the tests check it."""
+    servers = [ReplicaServer(f"micromap_replica_{index}") for index in range(2)]
+    replicas = ReplicaSet([server.replica for server in servers])
+    for server in servers:
+        replicas.check(server.replica)
+    monkeypatch.setattr(repository, "replicas", replicas)
+    client.cookies.clear()  # The written cookies of earlier tests.
+    yield servers
+    client.cookies.clear()
+    replicas.stop()
+    replicas.run()  # Stopped, so it only closes the health check connections.
+    for server in servers:
+        server.replica.engine.dispose()
+
+
+def read_studies(client, catalog) -> None:
+    response = client.get("/studies/", params={"catalog_id": str(catalog.catalog.id)})
+    assert response.status_code == 200
+    assert len(response.json()) == len(catalog.studies)
+
+
+def test_reads_are_spread_over_the_replicas(client, catalog, servers, statements):
+    assert all(server.replica.healthy and server.replica.lag == 0 for server in servers)
+    for _ in range(4):
+        read_studies(client, catalog)
+    assert [len(server.reads) for server in servers] == [2, 2]
+    assert not [statement for statement, _ in statements if "FROM study" in statement]
+
+
+def test_unavailable_replicas_are_skipped(client, repository, catalog, servers, statements, caplog):
+    down, up = servers
+    down.replica.dsn = UNREACHABLE
+    with caplog.at_level(logging.WARNING, logger="micromap_api.replicas"):
+        repository.replicas.check(down.replica)
+    assert not down.replica.healthy
+    assert "is unavailable" in caplog.text
+    for _ in range(2):
+        read_studies(client, catalog)
+    assert (len(down.reads), len(up.reads)) == (0, 2)
+
+    # Without a healthy replica, the primary serves the reads.
+    up.replica.dsn = UNREACHABLE
+    repository.replicas.check(up.replica)
+    read_studies(client, catalog)
+    assert (len(down.reads), len(up.reads)) == (0, 2)
+    assert [statement for statement, _ in statements if "FROM study" in statement]
+
+
+def test_lagging_replicas_are_skipped(client, repository, catalog, servers, statements):
+    repository.replicas.max_lag = -1  # Even a lag of 0 seconds is too much.
+    for server in servers:
+        repository.replicas.check(server.replica)
+    assert not any(server.replica.healthy for server in servers)
+    read_studies(client, catalog)
+    assert [len(server.reads) for server in servers] == [0, 0]
+    assert [statement for statement, _ in statements if "FROM study" in statement]
+
+
+def test_writers_read_their_writes_from_the_primary(client, repository, catalog, servers, secure_headers,
+                                                    statements):
+    family = Family(id=uuid4(), catalog_id=catalog.catalog.id, name=f"Family {uuid4().hex[:8]}aceae")
+    response = client.post("/families/", json=family.model_dump(mode="json"), headers=secure_headers)
+    assert response.status_code == 201
+    written = int(response.cookies["micromap_written"])
+    # The replicas have not replayed the write since their last check.
+    assert all(server.replica.version() < written for server in servers)
+
+    statements.clear()
+    read_studies(client, catalog)
+    assert [len(server.reads) for server in servers] == [0, 0]
+    assert [statement for statement, _ in statements if "FROM study" in statement]
+
+    # Other clients, without the cookie, read from the replicas.
+    client.cookies.clear()
+    read_studies(client, catalog)
+    assert sum(len(server.reads) for server in servers) == 1
+
+    # Once a replica has replayed the write, it serves the reads of the writer too.
+    client.cookies.set("micromap_written", str(written))
+    for server in servers:
+        repository.replicas.check(server.replica)
+    assert all(server.replica.version() >= written for server in servers)
+    read_studies(client, catalog)
+    assert sum(len(server.reads) for server in servers) == 2
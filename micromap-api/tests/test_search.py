@@ -0,0 +1,70 @@
+from typing import List
+from uuid import uuid4
+
+from micromap_api.models import Species
+
+from .conftest import SeededCatalog, seed_catalog
+
+
+def add_species(repository, catalog: SeededCatalog, *names: str) -> List[Species]:
+    species = [Species(id=uuid4(), genus_id=catalog.genera[0].id, is_type=False, name=name) for name in names]
+    repository.bulk_add_species(species)
+    return species
+
+
+def search(client, q: str, **params) -> List[dict]:
+    response = client.get("/search/", params={"q": q, **params})
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_search_ranks_exact_prefix_word_prefix_and_similar_names(client, repository, catalog):
+    # Names are unique in the database, so they contain a token of their own.
+    token = uuid4().hex[:8]
+    fuzzy, word_prefix, prefix, exact = add_species(repository, catalog, f"Pinas{token}", f"Abies pinus{token}oides",
+                                                    f"Pinus{token}ella", f"Pinus{token}")
+    results = search(client, f"Pinus{token}", catalog_id=str(catalog.catalog.id))
+    assert [result["id"] for result in results] == [str(exact.id), str(prefix.id), str(word_prefix.id), str(fuzzy.id)]
+    exact_score, prefix_score, word_prefix_score, fuzzy_score = [result["score"] for result in results]
+    assert exact_score == 3
+    assert 2 < prefix_score < 3
+    assert 1 < word_prefix_score < 2
+    assert 0 < fuzzy_score < 1
+
+    assert results[0]["level"] == "species"
+    assert results[0]["genus_id"] == str(catalog.genera[0].id)
+    assert results[0]["family_id"] == str(catalog.families[0].id)
+
+
+def test_search_tolerates_typos(client, catalog):
+    genus = catalog.genera[0]  # Named like "Genus00 <suffix>".
+    typo = genus.name.replace("Genus", "Gensu")
+    results = search(client, typo, catalog_id=str(catalog.catalog.id))
+    assert str(genus.id) in [result["id"] for result in results if result["level"] == "genus"]
+    assert all(result["score"] < 1 for result in results)  # Neither exact nor a prefix.
+
+
+def test_search_is_scoped_to_the_catalog(client, repository, catalog):
+    other = seed_catalog(repository, families=1, genera=1, species=1)
+    token = uuid4().hex[:8]
+    here, = add_species(repository, catalog, f"Quercus{token} robur")
+    there, = add_species(repository, other, f"Quercus{token} petraea")
+
+    assert [result["id"] for result in search(client, f"quercus{token}", catalog_id=str(catalog.catalog.id))] == \
+        [str(here.id)]
+    assert [result["id"] for result in search(client, f"quercus{token}", catalog_id=str(other.catalog.id))] == \
+        [str(there.id)]
+    assert {result["id"] for result in search(client, f"quercus{token}")} == {str(here.id), str(there.id)}
+
+
+def test_search_returns_at_most_max_results(client, repository, catalog):
+    token = uuid4().hex[:8]
+    species = add_species(repository, catalog, *[f"Salix{token} {epithet}" for epithet in
+                                                  ("alba", "caprea", "cinerea", "fragilis", "viminalis")])
+    params = {"catalog_id": str(catalog.catalog.id)}
+    assert len(search(client, f"salix{token}", **params)) == len(species)
+    results = search(client, f"salix{token}", max_results=3, **params)
+    assert [result["name"] for result in results] == sorted(taxon.name for taxon in species)[:3]
+
+    assert client.get("/search/", params={"q": f"salix{token}", "max_results": 101}).status_code == 422
+    assert client.get("/search/", params={"q": "s"}).status_code == 422
@@ -0,0 +1,14 @@
+from micromap_api import serialization
+
+
+def test_jsonable_encoder_serializes_the_same_json(client, catalog, monkeypatch):
+    # The serialization benchmark compares both, so they must send the same content.
+    requests = [("/items/", {"family_id": str(catalog.families[0].id), "max_results": 500}),
+                ("/species/", {"catalog_id": str(catalog.catalog.id)}),
+                ("/families/", {"catalog_id": str(catalog.catalog.id)}),
+                ("/studies/", {"catalog_id": str(catalog.catalog.id)})]
+    adapter = [client.get(path, params=params).json() for path, params in requests]
+    monkeypatch.setattr(serialization, "JSONABLE_ENCODER", True)
+    jsonable = [client.get(path, params=params).json() for path, params in requests]
+    assert jsonable == adapter
+    assert all(adapter)
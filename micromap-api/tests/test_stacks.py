@@ -0,0 +1,94 @@
+from hashlib import sha256
+from uuid import uuid4
+
+import pytest
+
+from micromap_api.chunkfile import MAGIC, write_chunk_file
+from micromap_api.pyramid import pyramid_path, write_pyramid
+from micromap_api.stackfile import open_stack, stack_path, write_stack
+
+Image = pytest.importorskip("PIL.Image")  # The optional 'import' dependencies write the pyramids.
+
+
+@pytest.fixture
+def stacks(api, tmp_path, monkeypatch):
+    """The directory of the stack files and pyramids that the API serves, empty for each test."""
+    monkeypatch.setattr(api, "STACK_PATH", tmp_path)
+    return tmp_path
+
+
+def test_pyramid_tiles(client, stacks):
+    item_id = uuid4()
+    write_pyramid(pyramid_path(stacks, item_id), [Image.new("L", (300, 200), n * 100) for n in range(2)])
+    assert client.get(f"/items/{item_id}/stack").json() == {
+        "width": 300, "height": 200, "depth": 2, "tile_size": 256, "levels": 2}
+
+    tile = client.get(f"/items/{item_id}/stack/1/0/1/0")
+    assert tile.status_code == 200
+    assert tile.headers["content-type"] == "image/png"
+    assert client.get(f"/items/{item_id}/stack/1/0/1/0", headers={"If-None-Match": tile.headers["etag"]}) \
+        .status_code == 304
+    assert client.get(f"/items/{item_id}/stack/1/1/1/0").status_code == 404
+    assert client.get(f"/items/{item_id}/stack/2/0/0/0").status_code == 404
+    assert client.get(f"/items/{uuid4()}/stack/0/0/0/0").status_code == 404
+
+
+@pytest.mark.parametrize("content", [
+    b"",
+    b"not a chunk file",
+    MAGIC + b"\x05\x00\x00\x00\x00\x00\x00\x00{oops",
+])
+def test_invalid_pyramid_is_a_server_error(client, stacks, content):
+    item_id = uuid4()
+    pyramid_path(stacks, item_id).write_bytes(content)
+    for path in (f"/items/{item_id}/stack", f"/items/{item_id}/stack/0/0/0/0"):
+        response = client.get(path)
+        assert response.status_code == 500
+        assert response.json() == {"detail": "The tile pyramid of the item is invalid."}
+
+
+def test_pyramid_without_all_tiles_is_a_server_error(client, stacks):
+    item_id = uuid4()
+    header = {"format": "pyramid", "width": 300, "height": 200, "depth": 2, "tile_size": 256, "levels": 2}
+    write_chunk_file(pyramid_path(stacks, item_id), header, [b"tile"] * 3)
+    assert client.get(f"/items/{item_id}/stack/0/0/0/0").status_code == 500
+
+
+def test_stack_slices(client, stacks):
+    item_id = uuid4()
+    slices = [b"first image", b"second image"]
+    write_stack(stack_path(stacks, item_id), slices, 16, 16)
+    digest = open_stack(stacks, item_id).chunk_file.header["digests"][1]
+    assert digest == sha256(slices[1]).hexdigest()
+
+    response = client.get(f"/items/{item_id}/stack/1")
+    assert response.content == slices[1]
+    assert response.headers["etag"] == f'"{digest}"'
+    assert client.get(f"/items/{item_id}/stack/1", headers={"If-None-Match": f'"{digest}"'}).status_code == 304
+
+    partial = client.get(f"/items/{item_id}/stack/1", headers={"Range": "bytes=7-"})
+    assert partial.status_code == 206
+    assert partial.content == b"image"
+    assert partial.headers["content-range"] == f"bytes 7-11/{len(slices[1])}"
+    assert client.get(f"/items/{item_id}/stack/2").status_code == 404
+
+
+def test_stack_without_digests(client, stacks):
+    item_id = uuid4()
+    header = {"format": "stack", "width": 16, "height": 16, "media_type": "image/png"}
+    write_chunk_file(stack_path(stacks, item_id), header, [b"image"])
+    assert client.get(f"/items/{item_id}/stack/0").headers["etag"] == f'"{sha256(b"image").hexdigest()}"'
+
+
+@pytest.mark.parametrize("header", [
+    {"format": "pyramid"},
+    {"format": "stack", "width": 16, "height": 16},
+    {"format": "stack", "width": 16, "height": 16, "media_type": "image/png", "digests": ["00"]},
+])
+def test_invalid_stack_is_a_server_error(client, stacks, header):
+    item_id = uuid4()
+    write_chunk_file(stack_path(stacks, item_id), header, [b"first", b"second"])
+    for path in (f"/items/{item_id}/stack/0", f"/items/{item_id}/stack/stream"):
+        response = client.get(path)
+        assert response.status_code == 500
+        assert response.json() == {"detail": "The stack file of the item is invalid."}
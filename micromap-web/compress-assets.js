@@ -0,0 +1,34 @@
+// Writes a gzip (.gz) and brotli (.br) copy next to each static asset, so that the web server can send them as they
+// are, instead of compressing them on every request. Usage: node compress-assets.js <file or folder>...
+const fs = require('fs');
+const path = require('path');
+const zlib = require('zlib');
+
+const EXTENSIONS = ['.html', '.js', '.css', '.json', '.svg'];
+const MINIMUM_SIZE = 1000;  // smaller files are not worth the extra request headers and files
+
+function compress(file) {
+  const data = fs.readFileSync(file);
+  if (data.length < MINIMUM_SIZE) return;
+
+  const gzip = zlib.gzipSync(data, { level: zlib.constants.Z_BEST_COMPRESSION });
+  const brotli = zlib.brotliCompressSync(data, {
+    params: {
+      [zlib.constants.BROTLI_PARAM_QUALITY]: zlib.constants.BROTLI_MAX_QUALITY,
+      [zlib.constants.BROTLI_PARAM_SIZE_HINT]: data.length,
+    },
+  });
+  fs.writeFileSync(file + '.gz', gzip);
+  fs.writeFileSync(file + '.br', brotli);
+  console.log(`${file}: ${data.length} bytes, gzip ${gzip.length} bytes, brotli ${brotli.length} bytes`);
+}
+
+function walk(name) {
+  if (fs.statSync(name).isDirectory()) {
+    for (const entry of fs.readdirSync(name)) walk(path.join(name, entry));
+  } else if (EXTENSIONS.includes(path.extname(name))) {
+    compress(name);
+  }
+}
+
+process.argv.slice(2).forEach(walk);
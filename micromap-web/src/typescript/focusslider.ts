@@ -22,6 +22,10 @@ export class FocusSlider {
             this.dispose();
             this.append();
         });
+        $(this.viewer.containerId).on(ViewerEvent.EVENT_LOADED_FOCUS_LEVEL, () => {
+            d3.select(this.id).selectAll(".viewer-focusslider-tick")
+                .attr("opacity", (d:number) => this.viewer.isFocusLevelLoaded(d) ? 1 : 0.3);
+        });
     }
 
     append() {
@@ -78,10 +82,12 @@ export class FocusSlider {
 
         const tickArray = Array.from({length: this.viewer.getMaxFocusLevel()}, (x, i) => i)
 
-        slider.selectAll(".tick")
+        // focus levels that are still loading are dimmed, until EVENT_LOADED_FOCUS_LEVEL
+        slider.selectAll(".viewer-focusslider-tick")
             .data(tickArray)
             .enter()
             .append("rect")
+            .attr("class", "viewer-focusslider-tick")
             .attr("y", (d:number) => {
                 return this.scale(d);
             })
@@ -89,7 +95,8 @@ export class FocusSlider {
             .attr("x", 20)
             .attr("width", 10)
             .attr("height", 2)
-            .attr("fill", "white");
+            .attr("fill", "white")
+            .attr("opacity", (d:number) => this.viewer.isFocusLevelLoaded(d) ? 1 : 0.3);
 
         // create the handle for the slider
         this.handle = slider.append("circle")
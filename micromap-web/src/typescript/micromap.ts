@@ -1,5 +1,5 @@
 import { DefaultService, OpenAPI, Item, Family } from './client';
-import { Viewer } from './viewer';
+import { Viewer, TileSource } from './viewer';
 import { FocusSlider } from './focusslider';
 import { ScaleBar } from "./scalebar";
 
@@ -218,19 +218,42 @@ export async function thumbnailSelected(itemId: string) {
    infoSpan = document.getElementById('info-slide-remarks') as HTMLSpanElement;
    infoSpan.textContent = selectedItem.slide.remarks
 
-  const f: string[] = ['prepared/o_' + itemId + '/' + itemId + '_1.png',
-  'prepared/o_' + itemId + '/' + itemId + '_2.png',
-  'prepared/o_' + itemId + '/' + itemId + '_3.png',
-  'prepared/o_' + itemId + '/' + itemId + '_4.png',
-  'prepared/o_' + itemId + '/' + itemId + '_5.png'
-  ];
-
-  const viewer = new Viewer('#viewer-container', 'viewer', 400, 400, f, null);
+  const viewer = await createViewer(itemId);
   new FocusSlider(viewer, "#viewer-focus-slider");
   new ScaleBar(viewer, "#viewer-scalebar", selectedItem.voxel_width);
 }
 
 
+/**
+ * Creates a viewer for the tile pyramid of an item, which only loads the tiles of the visible region and zoom level.
+ * Items without a pyramid stream their stack file instead, nearest focus level first, and items without a stack file
+ * fall back to loading the prepared focus levels at full resolution.
+ */
+async function createViewer(itemId: string): Promise<Viewer> {
+  try {
+    const stack = await DefaultService.getItemStack(itemId);
+    const tiles: TileSource = {
+      width: stack.width,
+      height: stack.height,
+      depth: stack.depth,
+      tileSize: stack.tile_size,
+      levels: stack.levels,
+      tileUrl: (z, level, x, y) => `${OpenAPI.BASE}/items/${itemId}/stack/${z}/${level}/${x}/${y}`
+    };
+    return new Viewer('#viewer-container', 'viewer', 400, 400, [], null, tiles);
+  } catch (error) {
+    const f: string[] = ['prepared/o_' + itemId + '/' + itemId + '_1.png',
+    'prepared/o_' + itemId + '/' + itemId + '_2.png',
+    'prepared/o_' + itemId + '/' + itemId + '_3.png',
+    'prepared/o_' + itemId + '/' + itemId + '_4.png',
+    'prepared/o_' + itemId + '/' + itemId + '_5.png'
+    ];
+    return new Viewer('#viewer-container', 'viewer', 400, 400, f, null, null,
+      `${OpenAPI.BASE}/items/${itemId}/stack/stream`);
+  }
+}
+
+
 async function showThumbnails(
   speciesId: string | null,
   genusId: string | null,
@@ -289,8 +312,10 @@ async function showThumbnails(
       const anchor = document.createElement('a');
       anchor.href = `javascript:MicroMap.thumbnailSelected('${item.id}')`;
 
+      // Thumbnails are separate, cacheable resources.
       const img = document.createElement('img');
-      img.src = `data:image/png;base64,${item.key_image}`;
+      img.loading = 'lazy';
+      img.src = `${OpenAPI.BASE}/items/${item.id}/thumbnail`;
       anchor.appendChild(img);
       newDiv.appendChild(anchor);
       gallery.appendChild(newDiv);
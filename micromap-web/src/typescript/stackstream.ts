@@ -0,0 +1,55 @@
+const HEADER_END = new Uint8Array([13, 10, 13, 10]); // an empty line (\r\n\r\n) ends the headers of a part
+
+function indexOf(buffer: Uint8Array, pattern: Uint8Array): number {
+    for (let i = 0; i + pattern.length <= buffer.length; i++) {
+        let j = 0;
+        while (j < pattern.length && buffer[i + j] == pattern[j]) j++;
+        if (j == pattern.length) return i;
+    }
+    return -1;
+}
+
+/**
+ * Reads a streamed focus stack (GET /items/{item_id}/stack/stream), a multipart response with one focus level per part
+ * @param {string} url                  the URL of the stream
+ * @param {function} onDepth            called with the number of focus levels, before any of the levels
+ * @param {function} onFocusLevel       called with each focus level and its image, as soon as it has arrived
+ */
+export async function readStackStream(
+    url: string,
+    onDepth: (depth: number) => void,
+    onFocusLevel: (level: number, image: Blob) => void) {
+    const response = await fetch(url);
+    if (!response.ok) {
+        throw new Error("Could not stream " + url + ": " + response.status);
+    }
+    onDepth(parseInt(response.headers.get("X-Focus-Levels")));
+
+    const decoder = new TextDecoder();
+    const reader = response.body.getReader();
+    let buffer = new Uint8Array(0);
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+
+        const joined = new Uint8Array(buffer.length + value.length);
+        joined.set(buffer);
+        joined.set(value, buffer.length);
+        buffer = joined;
+
+        // take all complete parts from the buffer. Parts are read by their Content-Length, not by their boundary
+        while (true) {
+            const headerEnd = indexOf(buffer, HEADER_END);
+            if (headerEnd < 0) break;
+            const headers = decoder.decode(buffer.subarray(0, headerEnd));
+            const length = parseInt(/Content-Length:\s*(\d+)/i.exec(headers)[1]);
+            const start = headerEnd + HEADER_END.length;
+            if (buffer.length < start + length) break;
+
+            const level = parseInt(/X-Focus-Level:\s*(\d+)/i.exec(headers)[1]);
+            const type = /Content-Type:\s*([^\r\n]+)/i.exec(headers)[1];
+            onFocusLevel(level, new Blob([buffer.slice(start, start + length)], { type: type }));
+            buffer = buffer.slice(start + length);
+        }
+    }
+}
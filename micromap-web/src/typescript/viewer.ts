@@ -1,4 +1,5 @@
 import * as d3 from 'd3';
+import { readStackStream } from './stackstream';
 /// <reference types="@types/jquery-jcrop" />
 
 export interface BoundingBox {
@@ -8,6 +9,17 @@ export interface BoundingBox {
     h: number
 }
 
+// A focus stack served as tiles of a multi-resolution pyramid, see GET /items/{item_id}/stack
+// Resolution level 0 is the full resolution, every next level halves the width and height
+export interface TileSource {
+    width: number
+    height: number
+    depth: number // the number of focus levels
+    tileSize: number
+    levels: number // the number of resolution levels
+    tileUrl: (z: number, level: number, x: number, y: number) => string
+}
+
 // Creates a new slide image canvas - allows panning and zooming, and ensures the slide is always visible
 export class Viewer {
 
@@ -19,6 +31,10 @@ export class Viewer {
     crop: BoundingBox;
     images = [];
     loadedCounter: number;
+    tiles: TileSource | null; // when set, only the tiles of the visible region are loaded, instead of the images
+    streamUrl: string | null; // when set, the images are read from a streamed focus stack, instead of the image paths
+    mismatchedSize = false;
+    tileCache: Map<string, HTMLImageElement>;
     base: d3.Selection<d3.BaseType,unknown , HTMLElement, unknown>; // the parent container of the whole viewer
 //    base: d3.Selection<d3.BaseType, {}, HTMLElement, any>; // the parent container of the whole viewer
 
@@ -41,15 +57,21 @@ export class Viewer {
      * @param {number} height           the desired height of the canvas
      * @param {[string]} imagePaths     an array of image paths
      * @param {{x,y,w,h}} crop          an optional object representing the cropped region to draw (represented as percentage decimals)
+     * @param {TileSource} tiles        an optional tile pyramid to draw instead of the image paths (ignores the crop)
+     * @param {string} streamUrl        an optional streamed focus stack to load instead of the image paths
      * @return {Viewer}                 the relevant viewer object
      */
-    constructor(containerId:string, canvasId:string, width:number, height:number, imagePaths:string[], crop?:BoundingBox) {
+    constructor(containerId:string, canvasId:string, width:number, height:number, imagePaths:string[], crop?:BoundingBox,
+                tiles?:TileSource, streamUrl?:string) {
         this.id = canvasId;
         this.containerId = containerId;
         this.width = width;
         this.height = height;
         this.imagePaths = imagePaths;
         this.crop = crop;
+        this.tiles = tiles == undefined ? null : tiles;
+        this.streamUrl = streamUrl == undefined ? null : streamUrl;
+        this.tileCache = new Map();
         this.images = [];
         this.loadedCounter = 0;
         this.focusLevel = 0;
@@ -61,12 +83,19 @@ export class Viewer {
         $(this.containerId).css("height", this.height);
         $(this.containerId).css("background-color", "grey");
         $(this.containerId).append("<div class='viewer-loading-message'><div class='fa-3x'><i class='fas fa-spinner fa-spin'></i></div><span>Loading image...</span></div>");
-        this.loadImages(() => {
+        const loaded = () => {
             $(this.containerId + ' .viewer-loading-message').remove();
             this.createCanvas(() => {
                 this.render();
             });
-        });
+        };
+        if (this.tiles != null) {
+            this.loadTiles(loaded);
+        } else if (this.streamUrl != null) {
+            this.loadStream(loaded);
+        } else {
+            this.loadImages(loaded);
+        }
     }
 
     public getImagePaths() {
@@ -75,49 +104,168 @@ export class Viewer {
 
     /**
      * Populates the "images" array with image objects loaded using image paths
-     * Will throw an error if the images are not equal sized
+     * The viewer is shown as soon as the first image has loaded, starting with the middle focus level
      */
     public loadImages(callback) {
-        // loop through all image paths (focus levels), and load the images
-        let error = false;
-        for (let i = 0; i < this.imagePaths.length; i++) {
+        this.images = this.imagePaths.map(() => null);
+        for (const i of this.nearestFirst(Math.floor(this.imagePaths.length / 2))) {
             let img = new Image();
-            img.onload = (_) => {
-                // ensure all focus level images have the same dimensions
-                if (this.imgWidth != undefined && this.imgHeight != undefined) {
-                    if (img.width != this.imgWidth || img.height != this.imgHeight) {
-                        console.error("Focus images are not of equal size! Size of image #" + i + ": " +
-                            img.width + "x" + img.height + " - expected size: " +
-                            this.imgWidth + "x" + this.imgHeight);
-                        if(!error) {
-                            error = true;
-                            $(this.containerId).trigger(ViewerEvent.EVENT_IMAGES_MISMATCHED_SIZE);
-                        }
-                        return;
-                    }
-                } else {
-                    this.imgWidth = this.nativeWidth = img.width;
-                    this.imgHeight = this.nativeHeight = img.height;
+            img.onload = (_) => this.addImage(i, img, callback);
+            img.src = this.imagePaths[i];
+        }
+    }
+
+    /**
+     * Populates the "images" array from a streamed focus stack, which sends the middle focus level first
+     * The viewer is shown as soon as the first image has loaded. Falls back to the image paths if there is no stream
+     */
+    public loadStream(callback) {
+        readStackStream(
+            this.streamUrl,
+            (depth) => {
+                this.images = Array.from({length: depth}, () => null);
+            },
+            (level, blob) => {
+                let img = new Image();
+                img.onload = (_) => {
+                    URL.revokeObjectURL(img.src);
+                    this.addImage(level, img, callback);
+                };
+                img.src = URL.createObjectURL(blob);
+            }
+        ).catch((error) => {
+            if (this.loadedCounter == 0 && this.imagePaths.length > 0) {
+                this.loadImages(callback);
+            } else {
+                console.error(error);
+            }
+        });
+    }
+
+    /**
+     * Adds the loaded image of a focus level. The first image determines the image size and shows the viewer,
+     * every next image is announced with EVENT_LOADED_FOCUS_LEVEL, e.g. to enable it in the focus slider
+     * Will throw an error if the images are not equal sized
+     */
+    public addImage(level: number, img: HTMLImageElement, callback) {
+        // ensure all focus level images have the same dimensions
+        if (this.nativeWidth != undefined && this.nativeHeight != undefined) {
+            if (img.width != this.nativeWidth || img.height != this.nativeHeight) {
+                console.error("Focus images are not of equal size! Size of image #" + level + ": " +
+                    img.width + "x" + img.height + " - expected size: " +
+                    this.nativeWidth + "x" + this.nativeHeight);
+                if(!this.mismatchedSize) {
+                    this.mismatchedSize = true;
+                    $(this.containerId).trigger(ViewerEvent.EVENT_IMAGES_MISMATCHED_SIZE);
                 }
+                return;
+            }
+        } else {
+            this.imgWidth = this.nativeWidth = img.width;
+            this.imgHeight = this.nativeHeight = img.height;
 
-                this.loadedCounter++;
-                if (this.loadedCounter == this.imagePaths.length) {
-                    // override imgWidth and imgHeight if a crop has been defined
-                    if(this.crop != null) {
-                        this.nativeWidth = this.imgWidth;
-                        this.nativeHeight = this.imgHeight;
+            // override imgWidth and imgHeight if a crop has been defined
+            if(this.crop != null) {
+                this.imgWidth *= this.crop.w;
+                this.imgHeight *= this.crop.h;
+            }
+        }
 
-                        this.imgWidth *= this.crop.w;
-                        this.imgHeight *= this.crop.h;
-                    }
+        this.images[level] = img;
+        this.loadedCounter++;
+        if (this.loadedCounter == 1) {
+            // proceed as soon as the first image has loaded - trigger a jQuery function too
+            callback();
+            $(this.containerId).trigger(ViewerEvent.EVENT_LOADED_IMAGES);
+        } else {
+            this.render(); // the image may be nearer to the selected focus level than the one displayed
+        }
+        $(this.containerId).trigger(ViewerEvent.EVENT_LOADED_FOCUS_LEVEL, [level]);
+    }
 
-                    // proceed if all images have been loaded - trigger a jQuery function too
-                    callback();
-                    $(this.containerId).trigger(ViewerEvent.EVENT_LOADED_IMAGES);
+    /**
+     * Returns all focus levels, ordered by their distance to the given level
+     */
+    public nearestFirst(level: number): number[] {
+        return Array.from({length: this.images.length}, (x, i) => i)
+            .sort((a, b) => Math.abs(a - level) - Math.abs(b - level) || a - b);
+    }
+
+    /**
+     * Returns whether the image of a focus level has been loaded (tiles are loaded on demand instead)
+     */
+    public isFocusLevelLoaded(level: number): boolean {
+        return this.tiles != null || this.images[level] != null;
+    }
+
+    /**
+     * Returns the loaded focus level nearest to the selected one, which is displayed until the selected one loads
+     */
+    public getDisplayedFocusLevel(): number {
+        return this.nearestFirst(this.focusLevel).find((level) => this.isFocusLevelLoaded(level));
+    }
+
+    /**
+     * Initialises the viewer for a tile pyramid. Tiles are loaded on demand by render, so the first paint only
+     * needs the tiles of the visible region
+     */
+    public loadTiles(callback) {
+        this.imgWidth = this.nativeWidth = this.tiles.width;
+        this.imgHeight = this.nativeHeight = this.tiles.height;
+        // proceed asynchronously, like loadImages, so add-ons constructed after the viewer receive the event
+        setTimeout(() => {
+            callback();
+            $(this.containerId).trigger(ViewerEvent.EVENT_LOADED_IMAGES);
+        });
+    }
+
+    /**
+     * Returns the (cached) tile image, and starts loading it if needed. The canvas is redrawn when it has loaded
+     */
+    private getTile(z: number, level: number, x: number, y: number): HTMLImageElement {
+        const url = this.tiles.tileUrl(z, level, x, y);
+        let tile = this.tileCache.get(url);
+        if (tile == undefined) {
+            tile = new Image();
+            tile.onload = () => this.render();
+            tile.src = url;
+            this.tileCache.set(url, tile);
+        }
+        return tile;
+    }
+
+    /**
+     * Draws the loaded tiles of a resolution level that overlap the region (x0, y0)-(x1, y1) in image coordinates
+     */
+    private drawTiles(level: number, x0: number, y0: number, x1: number, y1: number) {
+        const scale = Math.pow(2, level);
+        const span = this.tiles.tileSize * scale; // the size of a tile in image coordinates
+        for (let y = Math.max(0, Math.floor(y0 / span)); y * span < y1; y++) {
+            for (let x = Math.max(0, Math.floor(x0 / span)); x * span < x1; x++) {
+                const tile = this.getTile(this.focusLevel, level, x, y);
+                if (tile.complete && tile.naturalWidth > 0) {
+                    this.context.drawImage(tile, x * span, y * span, tile.naturalWidth * scale, tile.naturalHeight * scale);
                 }
             }
-            img.src = this.imagePaths[i];
-            this.images.push(img);
+        }
+    }
+
+    /**
+     * Draws the tiles of the visible region, at the coarsest resolution level that still has at least one image pixel
+     * per canvas pixel. The single tile of the coarsest level is drawn underneath, while the others are loading
+     */
+    private renderTiles() {
+        const k = this.transform.k;
+        const coarsest = this.tiles.levels - 1;
+        const level = Math.max(0, Math.min(coarsest, Math.floor(Math.log2(1 / k))));
+
+        this.drawTiles(coarsest, 0, 0, this.imgWidth, this.imgHeight);
+        if (level < coarsest) {
+            this.drawTiles(level,
+                -this.transform.x / k,
+                -this.transform.y / k,
+                Math.min(this.imgWidth, (this.width - this.transform.x) / k),
+                Math.min(this.imgHeight, (this.height - this.transform.y) / k));
         }
     }
 
@@ -222,11 +370,16 @@ export class Viewer {
         this.context.shadowBlur = 20;
         this.context.shadowOffsetX = 15;
         this.context.shadowOffsetY = 15;
-        if(this.crop == null) {
-            this.context.drawImage(this.images[this.focusLevel], 0, 0);
+        if(this.tiles != null) {
+            // cast the shadow once for the whole image, not for every tile
+            this.context.fillRect(0, 0, this.imgWidth, this.imgHeight);
+            this.context.shadowColor = 'transparent';
+            this.renderTiles();
+        } else if(this.crop == null) {
+            this.context.drawImage(this.images[this.getDisplayedFocusLevel()], 0, 0);
         } else {
             this.context.drawImage(
-                this.images[this.focusLevel],
+                this.images[this.getDisplayedFocusLevel()],
                 this.crop.x * this.nativeWidth,
                 this.crop.y * this.nativeHeight,
                 this.imgWidth,
@@ -254,6 +407,7 @@ export class Viewer {
      * Returns the maximum possible focus level (minimum is always 0)
      */
     public getMaxFocusLevel() {
+        if (this.tiles != null) return this.tiles.depth - 1;
         return this.images.length - 1;
     }
 
@@ -287,7 +441,8 @@ export class Viewer {
 }
 
 export enum ViewerEvent {
-    EVENT_LOADED_IMAGES = "loadedImages",
+    EVENT_LOADED_IMAGES = "loadedImages", // the viewer is ready, when the first focus level has loaded
+    EVENT_LOADED_FOCUS_LEVEL = "loadedFocusLevel",
     EVENT_ZOOMED = "zoomed",
     EVENT_IMAGES_MISMATCHED_SIZE = "imagesMismatchedSize"
 }
\ No newline at end of file